@@ -1,15 +1,86 @@
-from flask import Blueprint, jsonify
+from flask import Blueprint, request
+
+from utils.accept import negotiate
+from utils.static_document import StaticDocument
 
 bp = Blueprint("discovery", __name__)
 
-@bp.route("/apis/custom.api.local/v1")
+GROUP = "custom.api.local"
+VERSION = "v1"
+GROUP_VERSION = f"{GROUP}/{VERSION}"
+
+RESOURCES = [
+    {"name": "whoami", "singularName": "whoami", "namespaced": False, "kind": "WhoAmI", "verbs": ["get"]},
+    {"name": "mynamespace", "singularName": "mynamespace", "namespaced": False, "kind": "MyNamespaceList", "verbs": ["get", "list", "watch"]}
+]
+
+# Versions of the aggregated discovery form (APIGroupDiscoveryList) the
+# kube-apiserver aggregator asks for on /apis before falling back to
+# fetching /apis/custom.api.local/v1
+DISCOVERY_GROUP = "apidiscovery.k8s.io"
+DISCOVERY_VERSIONS = ("v2", "v2beta1")
+
+# Serialized once; every response is the same bytes and ETag
+api_resources = StaticDocument({
+    "kind": "APIResourceList",
+    "apiVersion": "v1",
+    "groupVersion": GROUP_VERSION,
+    "resources": RESOURCES
+})
+
+group = {
+    "name": GROUP,
+    "versions": [{"groupVersion": GROUP_VERSION, "version": VERSION}],
+    "preferredVersion": {"groupVersion": GROUP_VERSION, "version": VERSION}
+}
+
+api_group = StaticDocument({"kind": "APIGroup", "apiVersion": "v1", **group})
+
+api_group_list = StaticDocument({"kind": "APIGroupList", "apiVersion": "v1", "groups": [group]})
+
+aggregated = {
+    version: StaticDocument(
+        {
+            "kind": "APIGroupDiscoveryList",
+            "apiVersion": f"{DISCOVERY_GROUP}/{version}",
+            "metadata": {},
+            "items": [{
+                "metadata": {"name": GROUP},
+                "versions": [{
+                    "version": VERSION,
+                    "resources": [
+                        {
+                            "resource": r["name"],
+                            "singularResource": r["singularName"],
+                            "responseKind": {"group": GROUP, "version": VERSION, "kind": r["kind"]},
+                            "scope": "Namespaced" if r["namespaced"] else "Cluster",
+                            "verbs": r["verbs"]
+                        }
+                        for r in RESOURCES
+                    ],
+                    "freshness": "Current"
+                }]
+            }]
+        },
+        content_type=f"application/json;g={DISCOVERY_GROUP};v={version};as=APIGroupDiscoveryList"
+    )
+    for version in DISCOVERY_VERSIONS
+}
+
+
+@bp.route("/apis")
+def apis():
+    version = negotiate(request.headers.get("Accept"), "APIGroupDiscoveryList", DISCOVERY_GROUP, DISCOVERY_VERSIONS)
+    resp = aggregated[version].response() if version else api_group_list.response()
+    resp.vary.add("Accept")
+    return resp
+
+
+@bp.route(f"/apis/{GROUP}")
+def api_group_root():
+    return api_group.response()
+
+
+@bp.route(f"/apis/{GROUP_VERSION}")
 def api_root():
-    return jsonify({
-        "kind": "APIResourceList",
-        "apiVersion": "v1",
-        "groupVersion": "custom.api.local/v1",
-        "resources": [
-            {"name": "whoami", "namespaced": False, "kind": "WhoAmI", "verbs": ["get"]},
-            {"name": "mynamespace", "namespaced": False, "kind": "MyNamespaceList", "verbs": ["get"]}
-        ]
-    })
\ No newline at end of file
+    return api_resources.response()
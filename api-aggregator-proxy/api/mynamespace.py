@@ -1,74 +1,217 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify
 from datetime import datetime, timezone
+import json
 import logging
+import os
+import queue
+import time
 import traceback
 
+from kubernetes import client
+
 from k8s.client import init_k8s_client
-from k8s.rbac import can_list_namespaces
+from k8s.rbac import AccessReviewCache, BindingWatcher, can_list_namespaces
 from utils.auth import extract_team
-from services.namespace_service import filter_namespaces, format_namespaces
+from services.label_selector import LabelSelector
+from services.namespace_service import filter_namespaces, format_namespace, list_items, paginate
+from services.namespace_cache import Expired, NamespaceCache
+from services.table import INCLUDE_OBJECT, namespace_row, table, table_version
+from utils.json_stream import stream_list
 
 bp = Blueprint("namespace", __name__)
 
 v1, auth_v1 = init_k8s_client()
 logger = logging.getLogger("namespace-api")
 
-NAMESPACE_TEAM_LABEL = "team"
+NAMESPACE_TEAM_LABEL = os.environ.get("NAMESPACE_TEAM_LABEL", "team")
+
+# Default for watches that do not set timeoutSeconds
+WATCH_TIMEOUT_SECONDS = 1800
+BOOKMARK_INTERVAL_SECONDS = 60
+
+namespace_cache = NamespaceCache(v1, NAMESPACE_TEAM_LABEL)
+namespace_cache.start()
+
+sar_cache = AccessReviewCache(
+    auth_v1,
+    allowed_ttl=float(os.environ.get("SAR_CACHE_ALLOWED_TTL", 60)),
+    denied_ttl=float(os.environ.get("SAR_CACHE_DENIED_TTL", 10)),
+    max_size=int(os.environ.get("SAR_CACHE_SIZE", 4096)),
+)
+if os.environ.get("SAR_CACHE_WATCH_BINDINGS", "true").lower() == "true":
+    BindingWatcher(client.RbacAuthorizationV1Api(), sar_cache).start()
+
+
+def failure(message, reason, code):
+    return {
+        "kind": "Status",
+        "apiVersion": "v1",
+        "status": "Failure",
+        "message": message,
+        "reason": reason,
+        "code": code
+    }
+
+
+def int_param(name):
+    value = request.args.get(name) or "0"
+    if not value.isdigit():
+        raise ValueError(f"invalid {name} '{value}'")
+    return int(value)
+
+
+def watch_event(event_type, obj):
+    return json.dumps({"type": event_type, "object": obj}, separators=(",", ":")) + "\n"
+
+
+def watch_namespaces(visible, resource_version, timeout, bookmarks, version=None, include_object="Metadata"):
+    """Stream the changes to the namespaces visible() accepts as watch
+    events. A namespace whose labels change so that it becomes visible
+    or stops being visible is sent as ADDED or DELETED. With a Table
+    version, each event's object is a one-row Table."""
+    try:
+        watcher = namespace_cache.watch(resource_version)
+    except Expired as e:
+        return Response(watch_event("ERROR", failure(str(e), "Expired", 410)), mimetype="application/json")
+
+    def events():
+        deadline = time.monotonic() + timeout
+        first = True
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                try:
+                    change = watcher.events.get(timeout=min(remaining, BOOKMARK_INTERVAL_SECONDS))
+                except queue.Empty:
+                    rv = namespace_cache.bookmark(watcher) if bookmarks else None
+                    if rv:
+                        yield watch_event("BOOKMARK", {
+                            "kind": "Namespace", "apiVersion": "v1", "metadata": {"resourceVersion": rv}
+                        })
+                    continue
+                if change is None:
+                    # Dropped for falling behind; the client resumes from its last resourceVersion
+                    return
+                old, new = change
+                was_visible = old is not None and visible(old)
+                if new is not None and visible(new):
+                    event_type, ns = ("MODIFIED" if was_visible else "ADDED"), new
+                elif was_visible:
+                    event_type, ns = "DELETED", new or old
+                else:
+                    continue
+                obj = format_namespace(ns)
+                if version:
+                    metadata = {"resourceVersion": ns.metadata.resource_version}
+                    obj = {**table(version, metadata, columns=first), "rows": [namespace_row(obj, include_object, version)]}
+                    first = False
+                else:
+                    obj = {"kind": "Namespace", "apiVersion": "v1", **obj}
+                yield watch_event(event_type, obj)
+        finally:
+            namespace_cache.unwatch(watcher)
+
+    return Response(events(), mimetype="application/json")
+
 
 @bp.route("/apis/custom.api.local/v1/mynamespace")
 def mynamespace():
     user = request.headers.get("X-Remote-User", "")
+    groups = [g for h in request.headers.getlist("X-Remote-Group") for g in h.split(",") if g]
     logger.info(f"Request from user: {user}")
 
     team_name = extract_team(user)
     logger.info(f"Extracted team name: {team_name}")
 
     try:
-        user_can_list = can_list_namespaces(auth_v1, user)
+        user_can_list = can_list_namespaces(auth_v1, user, groups, cache=sar_cache)
         logger.info(f"SAR for user '{user}' allowed={user_can_list}")
     except Exception as e:
         logger.error(f"SubjectAccessReview failed for user '{user}': {e}\n{traceback.format_exc()}")
-        return jsonify({
-            "kind": "Status",
-            "apiVersion": "v1",
-            "status": "Failure",
-            "message": f"SAR failed for user '{user}': {e}",
-            "reason": "InternalError",
-            "code": 500
-        }), 500
+        return jsonify(failure(f"SAR failed for user '{user}': {e}", "InternalError", 500)), 500
 
     try:
-        ns_list = v1.list_namespace()
-    except Exception as e:
-        logger.error(f"Failed to list namespaces: {e}\n{traceback.format_exc()}")
-        return jsonify({
-            "kind": "Status",
-            "apiVersion": "v1",
-            "status": "Failure",
-            "message": f"Failed to list namespaces: {e}",
-            "reason": "InternalError",
-            "code": 500
-        }), 500
-
-    items = ns_list.items
-
-    if not user_can_list:
-        items = filter_namespaces(items, team_name, NAMESPACE_TEAM_LABEL)
-
-    namespaces = format_namespaces(items)
-
-    if not namespaces:
-        namespaces.append({
-            "metadata": {
-                "name": f"No namespaces found for team '{team_name}' (user '{user}')",
-                "creationTimestamp": datetime.now(timezone.utc).isoformat()
-            },
-            "status": {"phase": "Unknown"}
-        })
-
-    return jsonify({
-        "kind": "NamespaceList",
-        "apiVersion": "v1",
-        "metadata": {},
-        "items": namespaces
-    }), 200, {"Content-Type": "application/json"}
\ No newline at end of file
+        selector = LabelSelector(request.args.get("labelSelector"))
+        limit = int_param("limit")
+        timeout = int_param("timeoutSeconds") or WATCH_TIMEOUT_SECONDS
+        include_object = request.args.get("includeObject") or "Metadata"
+        if include_object not in INCLUDE_OBJECT:
+            raise ValueError(f"includeObject must be one of {', '.join(INCLUDE_OBJECT)}")
+    except ValueError as e:
+        return jsonify(failure(str(e), "BadRequest", 400)), 400
+
+    # kubectl asks for the Table form when printing
+    version = table_version(request.headers.get("Accept"))
+
+    if request.args.get("watch") in ("1", "true"):
+        def visible(ns):
+            labels = ns.metadata.labels or {}
+            if not user_can_list and labels.get(NAMESPACE_TEAM_LABEL) != team_name:
+                return False
+            return selector.matches(labels)
+
+        return watch_namespaces(
+            visible,
+            request.args.get("resourceVersion"),
+            timeout,
+            request.args.get("allowWatchBookmarks") in ("1", "true"),
+            version,
+            include_object
+        )
+
+    if namespace_cache.has_synced():
+        resource_version = namespace_cache.resource_version
+        if user_can_list:
+            items = namespace_cache.list()
+        else:
+            items = namespace_cache.by_team(team_name)
+    else:
+        # Until the cache has synced, list from the API server
+        try:
+            ns_list = v1.list_namespace()
+        except Exception as e:
+            logger.error(f"Failed to list namespaces: {e}\n{traceback.format_exc()}")
+            return jsonify(failure(f"Failed to list namespaces: {e}", "InternalError", 500)), 500
+
+        resource_version = ns_list.metadata.resource_version
+        items = sorted(ns_list.items, key=lambda ns: ns.metadata.name)
+
+        if not user_can_list:
+            items = filter_namespaces(items, team_name, NAMESPACE_TEAM_LABEL)
+
+    if selector:
+        items = [ns for ns in items if selector.matches(ns.metadata.labels)]
+
+    try:
+        items, continue_token, remaining = paginate(items, limit, request.args.get("continue"), resource_version)
+    except ValueError as e:
+        return jsonify(failure(str(e), "BadRequest", 400)), 400
+
+    metadata = {}
+    if resource_version:
+        metadata["resourceVersion"] = resource_version
+    if continue_token:
+        metadata["continue"] = continue_token
+        metadata["remainingItemCount"] = remaining
+
+    # A selected or paged list stays empty, so a client can tell that
+    # nothing matched from a page with one namespace in it
+    paged = limit or request.args.get("continue")
+    namespaces = list_items(items, team_name, user, placeholder=not (selector or paged))
+
+    if version:
+        now = datetime.now(timezone.utc)
+        rows = (namespace_row(ns, include_object, version, now) for ns in namespaces)
+        return Response(
+            stream_list(table(version, metadata), "rows", rows),
+            200,
+            content_type=f"application/json;as=Table;v={version};g=meta.k8s.io"
+        )
+
+    return Response(
+        stream_list({"kind": "NamespaceList", "apiVersion": "v1", "metadata": metadata}, "items", namespaces),
+        200,
+        content_type="application/json"
+    )
\ No newline at end of file
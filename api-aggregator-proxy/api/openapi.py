@@ -0,0 +1,171 @@
+from flask import Blueprint, redirect, request
+
+from api.discovery import GROUP, GROUP_VERSION, VERSION
+from utils.static_document import StaticDocument
+
+bp = Blueprint("openapi", __name__)
+
+V3_PATH = f"apis/{GROUP_VERSION}"
+SCHEMA_PREFIX = "local.api.custom.v1."
+
+QUERY_PARAMETERS = [
+    ("labelSelector", "string", "A selector to restrict the list of returned namespaces by their labels."),
+    ("limit", "integer", "The maximum number of namespaces to return. When more remain, metadata.continue is set."),
+    ("continue", "string", "The metadata.continue token of the previous page."),
+    ("watch", "boolean", "Watch for changes to the namespaces instead of listing them."),
+    ("resourceVersion", "string", "With watch, the resourceVersion to resume the watch from."),
+    ("allowWatchBookmarks", "boolean", "With watch, send BOOKMARK events."),
+    ("timeoutSeconds", "integer", "With watch, the duration of the watch in seconds."),
+    ("includeObject", "string", "For Table output, what each row carries: None, Metadata or Object."),
+]
+
+# (path, operationId, description, query parameters, response schema, content types)
+OPERATIONS = [
+    (
+        f"/apis/{GROUP_VERSION}/whoami",
+        "readCustomApiLocalV1WhoAmI",
+        "return the user and groups the request was made as",
+        [],
+        "NamespaceList",
+        ["application/json"],
+    ),
+    (
+        f"/apis/{GROUP_VERSION}/mynamespace",
+        "listCustomApiLocalV1MyNamespace",
+        "list or watch the namespaces of the caller's team, or all namespaces for callers allowed to list them",
+        QUERY_PARAMETERS,
+        "NamespaceList",
+        ["application/json", "application/json;stream=watch", "application/json;as=Table;v=v1;g=meta.k8s.io"],
+    ),
+]
+
+
+def _schemas(ref):
+    return {
+        SCHEMA_PREFIX + "Namespace": {
+            "description": "A namespace as listed by mynamespace.",
+            "type": "object",
+            "properties": {
+                "metadata": {
+                    "type": "object",
+                    "properties": {
+                        "name": {"type": "string"},
+                        "creationTimestamp": {"type": "string", "format": "date-time"},
+                        "resourceVersion": {"type": "string"},
+                        "labels": {"type": "object", "additionalProperties": {"type": "string"}}
+                    }
+                },
+                "status": {
+                    "type": "object",
+                    "properties": {"phase": {"type": "string"}}
+                }
+            }
+        },
+        SCHEMA_PREFIX + "NamespaceList": {
+            "description": "A list of namespaces.",
+            "type": "object",
+            "required": ["items"],
+            "properties": {
+                "apiVersion": {"type": "string"},
+                "kind": {"type": "string"},
+                "metadata": {
+                    "type": "object",
+                    "properties": {
+                        "resourceVersion": {"type": "string"},
+                        "continue": {"type": "string"},
+                        "remainingItemCount": {"type": "integer", "format": "int64"}
+                    }
+                },
+                "items": {"type": "array", "items": {"$ref": ref + SCHEMA_PREFIX + "Namespace"}}
+            }
+        }
+    }
+
+
+def _v2():
+    ref = "#/definitions/"
+    paths = {}
+    for path, operation_id, description, parameters, schema, produces in OPERATIONS:
+        paths[path] = {"get": {
+            "description": description,
+            "operationId": operation_id,
+            "consumes": ["*/*"],
+            "produces": produces,
+            "schemes": ["https"],
+            "tags": ["customApiLocal_v1"],
+            "parameters": [
+                {"name": name, "in": "query", "type": type_, "uniqueItems": True, "description": text}
+                for name, type_, text in parameters
+            ],
+            "responses": {
+                "200": {"description": "OK", "schema": {"$ref": ref + SCHEMA_PREFIX + schema}},
+                "401": {"description": "Unauthorized"}
+            }
+        }}
+    return {
+        "swagger": "2.0",
+        "info": {"title": GROUP, "version": VERSION},
+        "paths": paths,
+        "definitions": _schemas(ref)
+    }
+
+
+def _v3():
+    ref = "#/components/schemas/"
+    paths = {}
+    for path, operation_id, description, parameters, schema, produces in OPERATIONS:
+        paths[path] = {"get": {
+            "description": description,
+            "operationId": operation_id,
+            "tags": ["customApiLocal_v1"],
+            "parameters": [
+                {"name": name, "in": "query", "description": text, "schema": {"type": type_, "uniqueItems": True}}
+                for name, type_, text in parameters
+            ],
+            "responses": {
+                "200": {
+                    "description": "OK",
+                    "content": {
+                        content_type: {"schema": {"$ref": ref + SCHEMA_PREFIX + schema}}
+                        for content_type in produces
+                    }
+                },
+                "401": {"description": "Unauthorized"}
+            }
+        }}
+    return {
+        "openapi": "3.0.0",
+        "info": {"title": GROUP, "version": VERSION},
+        "paths": paths,
+        "components": {"schemas": _schemas(ref)}
+    }
+
+
+# Serialized once; the aggregator polls these and usually gets a 304
+openapi_v2 = StaticDocument(_v2())
+openapi_v3 = StaticDocument(_v3())
+# The v3 root lists each group version under a URL carrying its hash, so
+# clients can cache a URL forever
+openapi_v3_url = f"/openapi/v3/{V3_PATH}?hash={openapi_v3.hash}"
+openapi_v3_root = StaticDocument({"paths": {V3_PATH: {"serverRelativeURL": openapi_v3_url}}})
+
+
+@bp.route("/openapi/v2")
+def v2():
+    return openapi_v2.response()
+
+
+@bp.route("/openapi/v3")
+def v3_root():
+    return openapi_v3_root.response()
+
+
+@bp.route(f"/openapi/v3/{V3_PATH}")
+def v3():
+    requested = request.args.get("hash")
+    if requested is None:
+        return openapi_v3.response()
+    if requested != openapi_v3.hash:
+        # Like kube-apiserver, send an outdated hash to the current document
+        return redirect(openapi_v3_url, code=301)
+    return openapi_v3.response(cache_control="public, immutable, max-age=31536000")
@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+"""Load test the proxy against a local stub kube-apiserver.
+
+Generates a throwaway CA with server and client certificates, starts
+bench/stub_apiserver.py and the proxy (proxy/app.py) in each server mode,
+and drives the proxy over mTLS. Reports LIST throughput and latency
+percentiles at the given concurrency, and for a set of concurrently open
+watches the time to first event, memory per watch and the proxy's thread
+and socket counts. Linux only (process stats come from /proc).
+
+    python bench/loadtest.py --modes threaded,async --requests 2000 \\
+        --concurrency 50 --watches 500 --list-items 500 --output results.json
+"""
+import argparse
+import asyncio
+import datetime
+import ipaddress
+import json
+import os
+import resource
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+import yaml
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+PROXY_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.join(PROXY_DIR, "bench")
+
+LIST_PATH = "/api/v1/namespaces/bench/pods"
+
+
+# ------------------------
+# Certificates
+# ------------------------
+def _write_cert(directory, name, cert, key):
+    cert_path = os.path.join(directory, f"{name}.crt")
+    key_path = os.path.join(directory, f"{name}.key")
+    with open(cert_path, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, "wb") as f:
+        f.write(key.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+        ))
+    return cert_path, key_path
+
+
+def make_pki(directory):
+    """CA plus a server certificate for 127.0.0.1 (used by the stub and
+    the proxy) and a client certificate for CN=bench-user, O=bench."""
+    now = datetime.datetime.now(datetime.timezone.utc)
+    ca_key = ec.generate_private_key(ec.SECP256R1())
+    ca_name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "proxy-bench-ca")])
+    ca = (
+        x509.CertificateBuilder()
+        .subject_name(ca_name).issuer_name(ca_name)
+        .public_key(ca_key.public_key()).serial_number(x509.random_serial_number())
+        .not_valid_before(now).not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(ca_key, hashes.SHA256())
+    )
+    paths = {"ca": _write_cert(directory, "ca", ca, ca_key)[0]}
+
+    def issue(name, subject, server):
+        key = ec.generate_private_key(ec.SECP256R1())
+        builder = (
+            x509.CertificateBuilder()
+            .subject_name(x509.Name(subject)).issuer_name(ca_name)
+            .public_key(key.public_key()).serial_number(x509.random_serial_number())
+            .not_valid_before(now).not_valid_after(now + datetime.timedelta(days=1))
+        )
+        if server:
+            builder = builder.add_extension(
+                x509.SubjectAlternativeName([
+                    x509.DNSName("localhost"), x509.IPAddress(ipaddress.ip_address("127.0.0.1")),
+                ]),
+                critical=False,
+            )
+        paths[name] = _write_cert(directory, name, builder.sign(ca_key, hashes.SHA256()), key)
+
+    issue("server", [x509.NameAttribute(NameOID.COMMON_NAME, "127.0.0.1")], server=True)
+    issue("client", [
+        x509.NameAttribute(NameOID.COMMON_NAME, "bench-user"),
+        x509.NameAttribute(NameOID.ORGANIZATION_NAME, "bench"),
+    ], server=False)
+    return paths
+
+
+# ------------------------
+# Processes
+# ------------------------
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, process, timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{process.args[1]} exited with {process.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), 0.2).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"nothing listening on port {port} after {timeout}s")
+
+
+def start_stub(pki, args):
+    port = free_port()
+    cert, key = pki["server"]
+    process = subprocess.Popen([
+        sys.executable, os.path.join(BENCH_DIR, "stub_apiserver.py"),
+        "--cert", cert, "--key", key, "--port", str(port),
+        "--list-items", str(args.list_items), "--item-bytes", str(args.item_bytes),
+        "--watch-interval", str(args.watch_interval),
+    ])
+    wait_for_port(port, process)
+    return process, port
+
+
+def start_proxy(pki, directory, mode, stub_port, args):
+    port = free_port()
+    cert, key = pki["server"]
+    config = {
+        "k8s": {"api_server": f"https://127.0.0.1:{stub_port}", "ca_cert": pki["ca"]},
+        "tls": {"server_cert": cert, "server_key": key},
+        "auth": {"token": "bench"},
+        # Every open watch holds an upstream connection
+        "upstream": {"pool_size": args.watches + args.concurrency + 10, "max_idle": args.concurrency},
+        "server": {"mode": mode, "port": port},
+        "read_cache": {"coalesce": args.coalesce, "enabled": args.cache},
+        "watch_fanout": {"enabled": args.fanout},
+    }
+    path = os.path.join(directory, f"config-{mode}.yaml")
+    with open(path, "w") as f:
+        yaml.safe_dump(config, f)
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(PROXY_DIR, "proxy", "app.py")],
+        cwd=os.path.join(PROXY_DIR, "proxy"),
+        env={**os.environ, "PROXY_CONFIG": path},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    wait_for_port(port, process)
+    return process, port
+
+
+def stop(process):
+    process.terminate()
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def process_stats(pid):
+    with open(f"/proc/{pid}/status") as f:
+        status = dict(line.split(":", 1) for line in f if ":" in line)
+    sockets = 0
+    for fd in os.listdir(f"/proc/{pid}/fd"):
+        try:
+            sockets += os.readlink(f"/proc/{pid}/fd/{fd}").startswith("socket:")
+        except OSError:
+            pass
+    return {
+        "rssKiB": int(status["VmRSS"].split()[0]),
+        "threads": int(status["Threads"]),
+        "sockets": sockets,
+    }
+
+
+# ------------------------
+# Statistics
+# ------------------------
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(p / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def summarize(latencies, wall_seconds):
+    values = sorted(latencies)
+    return {
+        "requests": len(values),
+        "throughput": len(values) / wall_seconds if wall_seconds else 0.0,
+        "meanMs": sum(values) / len(values) * 1000 if values else 0.0,
+        "p50Ms": percentile(values, 50) * 1000,
+        "p90Ms": percentile(values, 90) * 1000,
+        "p99Ms": percentile(values, 99) * 1000,
+        "maxMs": values[-1] * 1000 if values else 0.0,
+    }
+
+
+# ------------------------
+# Load
+# ------------------------
+def client_ssl_context(pki):
+    context = ssl.create_default_context(cafile=pki["ca"])
+    context.load_cert_chain(*pki["client"])
+    return context
+
+
+async def run_lists(port, context, requests, concurrency, accept_encoding):
+    """requests LISTs from concurrency clients, each on its own keep-alive
+    connection."""
+    url = f"https://127.0.0.1:{port}{LIST_PATH}"
+    headers = {"Accept-Encoding": accept_encoding}
+    latencies = []
+    errors = 0
+    remaining = requests
+
+    async def client(session):
+        nonlocal errors, remaining
+        while remaining > 0:
+            remaining -= 1
+            started = time.perf_counter()
+            try:
+                async with session.get(url, headers=headers) as resp:
+                    await resp.read()
+                    if resp.status != 200:
+                        errors += 1
+            except aiohttp.ClientError:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    connector = aiohttp.TCPConnector(ssl=context, limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector, auto_decompress=False) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(client(session) for _ in range(concurrency)))
+        wall = time.perf_counter() - started
+
+    result = summarize(latencies, wall)
+    result["errors"] = errors
+    return result
+
+
+async def run_watches(port, context, count, pid, hold):
+    """Open count watches, wait for the first event on each, then sample the
+    proxy process while all of them are open."""
+    url = f"https://127.0.0.1:{port}{LIST_PATH}?watch=true"
+    before = process_stats(pid)
+    first_event = []
+    errors = 0
+    responses = []
+
+    connector = aiohttp.TCPConnector(ssl=context, limit=0)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=None)) as session:
+        async def open_watch():
+            nonlocal errors
+            started = time.perf_counter()
+            try:
+                resp = await session.get(url)
+                responses.append(resp)
+                if resp.status != 200 or not await resp.content.readline():
+                    errors += 1
+                    return
+            except aiohttp.ClientError:
+                errors += 1
+                return
+            first_event.append(time.perf_counter() - started)
+
+        # Batched so connection setup does not dominate the first events
+        for batch in range(0, count, 100):
+            await asyncio.gather(*(open_watch() for _ in range(min(100, count - batch))))
+        await asyncio.sleep(hold)
+        during = process_stats(pid)
+        for resp in responses:
+            resp.close()
+
+    opened = len(first_event)
+    values = sorted(first_event)
+    return {
+        "watches": count,
+        "opened": opened,
+        "errors": errors,
+        "firstEventP50Ms": percentile(values, 50) * 1000,
+        "firstEventP99Ms": percentile(values, 99) * 1000,
+        "rssKiB": during["rssKiB"],
+        "rssPerWatchKiB": (during["rssKiB"] - before["rssKiB"]) / opened if opened else 0.0,
+        "threads": during["threads"],
+        "sockets": during["sockets"],
+        "idleThreads": before["threads"],
+        "idleSockets": before["sockets"],
+    }
+
+
+def run_mode(mode, pki, directory, stub_port, args):
+    proxy, port = start_proxy(pki, directory, mode, stub_port, args)
+    try:
+        context = client_ssl_context(pki)
+        asyncio.run(run_lists(port, context, args.warmup, 1, args.accept_encoding))
+        result = {"mode": mode}
+        result["list"] = asyncio.run(run_lists(port, context, args.requests, args.concurrency, args.accept_encoding))
+        result["idle"] = process_stats(proxy.pid)
+        if args.watches:
+            result["watch"] = asyncio.run(run_watches(port, context, args.watches, proxy.pid, args.hold))
+        return result
+    finally:
+        stop(proxy)
+
+
+def print_report(results):
+    print(f"list items={results['listItems']} x {results['itemBytes']}B  requests={results['requests']} "
+          f"concurrency={results['concurrency']}  watches={results['watches']}")
+    for r in results["modes"]:
+        l = r["list"]
+        print(
+            f"{r['mode']:9} list {l['throughput']:8.1f} req/s  p50={l['p50Ms']:.2f}ms p90={l['p90Ms']:.2f}ms "
+            f"p99={l['p99Ms']:.2f}ms max={l['maxMs']:.2f}ms errors={l['errors']}"
+        )
+        w = r.get("watch")
+        if w:
+            print(
+                f"{'':9} watch {w['opened']}/{w['watches']} open  first event p50={w['firstEventP50Ms']:.2f}ms "
+                f"p99={w['firstEventP99Ms']:.2f}ms  rss={w['rssKiB'] / 1024:.1f}MiB "
+                f"({w['rssPerWatchKiB']:.1f}KiB/watch)  threads={w['threads']} sockets={w['sockets']} "
+                f"errors={w['errors']}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--modes", default="threaded,async", help="proxy server modes to compare")
+    parser.add_argument("--requests", type=int, default=1000, help="LIST requests per mode")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--watches", type=int, default=200, help="concurrently open watches per mode")
+    parser.add_argument("--hold", type=float, default=2.0, help="seconds to hold the watches open before sampling")
+    parser.add_argument("--watch-interval", type=float, default=1.0, help="seconds between stub watch events")
+    parser.add_argument("--list-items", type=int, default=500)
+    parser.add_argument("--item-bytes", type=int, default=1024)
+    parser.add_argument("--accept-encoding", default="gzip", help='client Accept-Encoding, e.g. "identity"')
+    parser.add_argument("--coalesce", action="store_true", help="enable read_cache.coalesce in the proxy")
+    parser.add_argument("--cache", action="store_true", help="enable read_cache in the proxy")
+    parser.add_argument("--fanout", action="store_true", help="enable watch_fanout in the proxy (async mode)")
+    parser.add_argument("--label", default="", help="free-form label stored in the results, e.g. a version")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    # Every watch is a socket on both ends
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    results = {
+        "label": args.label,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "listItems": args.list_items,
+        "itemBytes": args.item_bytes,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "watches": args.watches,
+        "acceptEncoding": args.accept_encoding,
+        "modes": [],
+    }
+    with tempfile.TemporaryDirectory(prefix="proxy-bench-") as directory:
+        pki = make_pki(directory)
+        stub, stub_port = start_stub(pki, args)
+        try:
+            for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+                results["modes"].append(run_mode(mode, pki, directory, stub_port, args))
+        finally:
+            stop(stub)
+
+    print_report(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""Stub kube-apiserver for load testing the proxy.
+
+Serves a canned Pod LIST of configurable size for any GET, a synthetic
+watch stream (one MODIFIED event every --watch-interval seconds) for any
+watch request, and allows every SubjectAccessReview. Like the real API
+server, LIST bodies larger than 128 KiB are gzipped for clients that
+accept it.
+
+    python bench/stub_apiserver.py --cert stub.crt --key stub.key \\
+        --port 9443 --list-items 500 --item-bytes 1024
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import ssl
+
+from aiohttp import web
+
+# The API server only compresses responses above this size
+GZIP_MIN_BYTES = 128 * 1024
+
+
+def pod(index, item_bytes, resource_version):
+    return {
+        "kind": "Pod",
+        "apiVersion": "v1",
+        "metadata": {
+            "name": f"pod-{index}",
+            "namespace": "bench",
+            "resourceVersion": str(resource_version),
+            "labels": {"app": "bench"},
+            "annotations": {"bench/padding": "x" * item_bytes},
+        },
+        "spec": {"containers": [{"name": "app", "image": "busybox"}]},
+    }
+
+
+def pod_list(items, item_bytes):
+    body = json.dumps({
+        "kind": "PodList",
+        "apiVersion": "v1",
+        "metadata": {"resourceVersion": str(items)},
+        "items": [{k: v for k, v in pod(i, item_bytes, i).items() if k not in ("kind", "apiVersion")} for i in range(items)],
+    }, separators=(",", ":")).encode()
+    return body, gzip.compress(body, compresslevel=1) if len(body) > GZIP_MIN_BYTES else None
+
+
+def create_app(list_items, item_bytes, watch_interval):
+    body, gzipped = pod_list(list_items, item_bytes)
+    app = web.Application()
+    open_watches = [0]
+
+    async def review(request):
+        data = await request.json()
+        data["status"] = {"allowed": True}
+        return web.json_response(data, status=201)
+
+    async def get(request):
+        if request.query.get("watch") in ("1", "true"):
+            return await watch(request)
+        if gzipped and "gzip" in request.headers.get("Accept-Encoding", ""):
+            return web.Response(body=gzipped, content_type="application/json", headers={"Content-Encoding": "gzip"})
+        return web.Response(body=body, content_type="application/json")
+
+    async def watch(request):
+        response = web.StreamResponse(headers={"Content-Type": "application/json"})
+        await response.prepare(request)
+        open_watches[0] += 1
+        resource_version = list_items
+        try:
+            while True:
+                resource_version += 1
+                event = {"type": "MODIFIED", "object": pod(resource_version % max(list_items, 1), 64, resource_version)}
+                await response.write(json.dumps(event, separators=(",", ":")).encode() + b"\n")
+                await asyncio.sleep(watch_interval)
+        except ConnectionResetError:
+            # The proxy closed the watch
+            return response
+        finally:
+            open_watches[0] -= 1
+
+    async def stats(request):
+        return web.json_response({"watches": open_watches[0]})
+
+    app.router.add_post("/apis/authorization.k8s.io/v1/subjectaccessreviews", review)
+    app.router.add_get("/_stub/stats", stats)
+    app.router.add_get("/{path:.*}", get)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cert", required=True)
+    parser.add_argument("--key", required=True)
+    parser.add_argument("--port", type=int, default=9443)
+    parser.add_argument("--list-items", type=int, default=500)
+    parser.add_argument("--item-bytes", type=int, default=1024, help="padding per LIST item")
+    parser.add_argument("--watch-interval", type=float, default=1.0, help="seconds between watch events")
+    args = parser.parse_args()
+
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(args.cert, args.key)
+    app = create_app(args.list_items, args.item_bytes, args.watch_interval)
+    web.run_app(app, host="127.0.0.1", port=args.port, ssl_context=context, print=None, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
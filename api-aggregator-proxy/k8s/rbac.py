@@ -1,16 +1,188 @@
-from kubernetes import client
+from collections import OrderedDict
+import logging
+import threading
+import time
 
-def can_list_namespaces(auth_v1, user: str) -> bool:
+from kubernetes import client, watch
+from kubernetes.client.rest import ApiException
+
+logger = logging.getLogger("namespace-api")
+
+WATCH_TIMEOUT_SECONDS = 300
+RETRY_SECONDS = 5
+
+
+def review_access(auth_v1, user, groups, verb, resource, group=""):
     sar = client.V1SubjectAccessReview(
         spec=client.V1SubjectAccessReviewSpec(
             user=user,
+            groups=list(groups) or None,
             resource_attributes=client.V1ResourceAttributes(
-                verb="list",
-                resource="namespaces",
-                group=""
+                verb=verb,
+                resource=resource,
+                group=group
             )
         )
     )
 
     resp = auth_v1.create_subject_access_review(body=sar)
-    return resp.status.allowed
\ No newline at end of file
+    return bool(resp.status.allowed)
+
+
+def can_list_namespaces(auth_v1, user: str, groups=(), cache=None) -> bool:
+    if cache is not None:
+        return cache.allowed(user, groups, "list", "namespaces")
+    return review_access(auth_v1, user, groups, "list", "namespaces")
+
+
+class _Pending:
+    def __init__(self):
+        self.done = threading.Event()
+        self.allowed = None
+        self.error = None
+
+
+class AccessReviewCache:
+    """SubjectAccessReview results keyed by (user, groups, verb, resource),
+    kept for allowed_ttl seconds when allowed and denied_ttl when denied,
+    in an LRU of at most max_size entries.
+
+    Concurrent lookups of a key that is not cached share one review. The
+    whole cache is dropped by invalidate(), which BindingWatcher calls on
+    any RoleBinding or ClusterRoleBinding change."""
+
+    def __init__(self, auth_v1, allowed_ttl=60, denied_ttl=10, max_size=4096):
+        self.auth_v1 = auth_v1
+        self.allowed_ttl = allowed_ttl
+        self.denied_ttl = denied_ttl
+        self.max_size = max_size
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (allowed, expires)
+        self._pending = {}
+        # Bumped by invalidate() so reviews started before it are not stored
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.invalidations = 0
+
+    def allowed(self, user, groups, verb, resource, group=""):
+        key = (user, tuple(sorted(groups)), verb, group, resource)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            pending = self._pending.get(key)
+            leader = pending is None
+            if leader:
+                pending = self._pending[key] = _Pending()
+                generation = self._generation
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.allowed
+
+        try:
+            pending.allowed = review_access(self.auth_v1, user, groups, verb, resource, group)
+        except Exception as e:
+            pending.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._pending[key]
+                if pending.error is None and generation == self._generation:
+                    ttl = self.allowed_ttl if pending.allowed else self.denied_ttl
+                    self._entries[key] = (pending.allowed, time.monotonic() + ttl)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_size:
+                        self._entries.popitem(last=False)
+            pending.done.set()
+        return pending.allowed
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxSize": self.max_size,
+                "allowedTTLSeconds": self.allowed_ttl,
+                "deniedTTLSeconds": self.denied_ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "invalidations": self.invalidations,
+            }
+
+
+class BindingWatcher:
+    """Watches RoleBindings and ClusterRoleBindings and invalidates an
+    AccessReviewCache whenever one changes, so RBAC changes take effect
+    without waiting for the TTLs."""
+
+    def __init__(self, rbac_v1, cache):
+        self.cache = cache
+        self.sources = {
+            "rolebindings": rbac_v1.list_role_binding_for_all_namespaces,
+            "clusterrolebindings": rbac_v1.list_cluster_role_binding,
+        }
+        self._stopped = threading.Event()
+        self._watches = {}
+        self.last_error = {}
+
+    def start(self):
+        for name, list_func in self.sources.items():
+            threading.Thread(
+                target=self._run, args=(name, list_func), name=f"{name}-watch", daemon=True
+            ).start()
+
+    def stop(self):
+        self._stopped.set()
+        for w in list(self._watches.values()):
+            w.stop()
+
+    def _run(self, name, list_func):
+        resource_version = None
+        while not self._stopped.is_set():
+            try:
+                if resource_version is None:
+                    # Only changes after this point matter
+                    resource_version = list_func(limit=1).metadata.resource_version
+                    # Anything may have changed while the watch was down
+                    self.cache.invalidate()
+                w = self._watches[name] = watch.Watch()
+                for event in w.stream(
+                    list_func,
+                    resource_version=resource_version,
+                    timeout_seconds=WATCH_TIMEOUT_SECONDS,
+                    allow_watch_bookmarks=True,
+                ):
+                    resource_version = event["object"].metadata.resource_version or resource_version
+                    if event["type"] != "BOOKMARK":
+                        logger.info(f"{name} changed, dropping cached access reviews")
+                        self.cache.invalidate()
+                self.last_error.pop(name, None)
+            except ApiException as e:
+                if e.status == 410:
+                    resource_version = None
+                    continue
+                self._failed(name, e)
+            except Exception as e:
+                self._failed(name, e)
+
+    def _failed(self, name, error):
+        self.last_error[name] = str(error)
+        logger.error(f"Watching {name} failed: {error}")
+        self._stopped.wait(RETRY_SECONDS)
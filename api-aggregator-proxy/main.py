@@ -6,8 +6,9 @@ from datetime import datetime, timezone
 import ssl
 
 from api.discovery import bp as discovery_bp
+from api.openapi import bp as openapi_bp
 from api.whoami import bp as whoami_bp
-from api.mynamespace import bp as ns_bp
+from api.mynamespace import bp as ns_bp, namespace_cache, sar_cache
 
 app = Flask(__name__)
 
@@ -48,12 +49,17 @@ def log_request():
 
 # ---------------------------
 app.register_blueprint(discovery_bp)
+app.register_blueprint(openapi_bp)
 app.register_blueprint(whoami_bp)
 app.register_blueprint(ns_bp)
 
 @app.route("/healthz")
 def health():
-    return "ok", 200
+    return jsonify({
+        "status": "ok",
+        "namespaceCache": namespace_cache.status(),
+        "accessReviewCache": sar_cache.stats()
+    }), 200
 
 # ---------------------------
 @app.errorhandler(404)
@@ -1,25 +1,53 @@
 #!/usr/bin/env python3
-from flask import Flask, request, Response, redirect
-import requests
-from OpenSSL import crypto
-import ssl
-import yaml
+from flask import Flask, request, Response, redirect, jsonify
+
+from forwarding import (
+    STATS_PATH,
+    IdentityCache,
+    identity_cache_size,
+    is_interactive,
+    is_write,
+    load_config,
+    negotiate_encoding,
+    read_cache_options,
+    response_headers,
+    rewrite_path,
+    server_port,
+    server_ssl_context,
+    upstream_headers,
+    upstream_options,
+)
+from read_cache import ReadCache, request_key
+from upstream import UpstreamPool
 
 app = Flask(__name__)
 
 
-with open("/etc/proxy-certs/config.yaml") as f:
-    cfg = yaml.safe_load(f)
+cfg = load_config()
 
 K8S_API = cfg["k8s"]["api_server"]
 CA_CERT = cfg["k8s"]["ca_cert"]
-SERVER_CERT = cfg["tls"]["server_cert"]
-SERVER_KEY = cfg["tls"]["server_key"]
 TOKEN = cfg["auth"]["token"]
 
+# "threaded" (this Flask app) or "async" (async_app.py, for many long-lived watches)
+SERVER_MODE = cfg.get("server", {}).get("mode", "threaded")
+
 METHODS = ["GET", "POST", "PUT", "PATCH", "DELETE"]
 
-INTERACTIVE_PATH_KEYWORDS = ["exec", "attach", "portforward"]
+upstream = UpstreamPool(K8S_API, CA_CERT, **upstream_options(cfg))
+identities = IdentityCache(identity_cache_size(cfg))
+read_options = read_cache_options(cfg)
+reads = ReadCache(**read_options) if read_options else None
+
+
+@app.route(STATS_PATH, methods=["GET"])
+def stats():
+    return jsonify({
+        "upstream": upstream.stats(),
+        "identities": identities.stats(),
+        "readCache": reads.stats() if reads else None,
+    })
+
 
 @app.route("/", defaults={"path": ""}, methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS", "HEAD"])
 @app.route("/<path:path>", methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS", "HEAD"])
@@ -27,8 +55,7 @@ def proxy(path):
     try:
         query = request.query_string.decode()
 
-        lower_path = path.lower()
-        if any(k in lower_path for k in INTERACTIVE_PATH_KEYWORDS):
+        if is_interactive(path):
             location = f"{K8S_API}/{path}" + ("?" + query if query else "")
             return redirect(location, code=307)
 
@@ -36,51 +63,42 @@ def proxy(path):
         if not peer_cert:
             return Response("❌ No client certificate presented", status=401)
 
-        x509 = crypto.load_certificate(crypto.FILETYPE_PEM, peer_cert)
-        user_cn = x509.get_subject().CN
-        try:
-            user_org = x509.get_subject().O
-        except Exception:
-            user_org = None
+        identity = identities.get(peer_cert)
+        if identity is None:
+            return Response("❌ Client certificate expired", status=401)
+        user_cn, user_groups = identity
 
         method = request.method
+        path = rewrite_path(method, path, query)
 
-        if method == "GET" and path.strip("/") == "api/v1/namespaces" and query == "limit=500":
-            path = "apis/custom.api.local/v1/mynamespace"
-
-
-        headers = {k: v for k, v in request.headers.items() if k.lower() != "host"}
-        headers["Impersonate-User"] = user_cn
-        if user_org:
-            headers["Impersonate-Group"] = user_org
-
-        headers["Authorization"] = f"Bearer {TOKEN}"
+        headers = upstream_headers(request.headers.items(), user_cn, user_groups, TOKEN)
 
         data = request.get_data()
 
-        resp = requests.request(
-            method=method,
-            url=f"{K8S_API}/{path}" + ("?" + query if query else ""),
-            headers=headers,
-            data=data,
-            verify=CA_CERT,
-            stream=True,
-            timeout=120
-        )
+        def send():
+            resp = upstream.send(method, path, query, headers, data)
+            return negotiate_encoding(resp, request.headers.get("Accept-Encoding"))
 
-        response_headers = {k: v for k, v in resp.headers.items() if k.lower() not in ["transfer-encoding", "content-encoding"]}
+        key = None
+        if method == "GET" and reads is not None:
+            key = request_key(user_cn, user_groups, path, query, request.headers)
+        if key is not None:
+            resp = reads.get(key, request.args, send)
+        else:
+            resp = send()
+            if reads is not None and is_write(method):
+                reads.invalidate(path)
 
-        return Response(resp.raw, status=resp.status_code, headers=response_headers, direct_passthrough=True)
+        return Response(resp, status=resp.status_code, headers=response_headers(resp), direct_passthrough=True)
 
     except Exception as e:
         return Response(f"Proxy error: {e}", status=500)
 
 
 if __name__ == "__main__":
-    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
-    context.load_cert_chain(certfile=SERVER_CERT, keyfile=SERVER_KEY)
-    context.load_verify_locations(CA_CERT)
-    context.verify_mode = ssl.CERT_REQUIRED
-
-    app.run(host="0.0.0.0", port=8443, ssl_context=context, threaded=True)
+    if SERVER_MODE == "async":
+        import async_app
 
+        async_app.main(cfg)
+    else:
+        app.run(host="0.0.0.0", port=server_port(cfg), ssl_context=server_ssl_context(cfg), threaded=True)
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""asyncio variant of the proxy (app.py), for many concurrent long-lived
+requests such as watches: each open request costs a coroutine and a
+socket instead of a thread. Selected with ``server.mode: async`` in
+config.yaml."""
+from aiohttp import web
+
+from forwarding import (
+    STATS_PATH,
+    IdentityCache,
+    identity_cache_size,
+    is_interactive,
+    is_write,
+    load_config,
+    negotiate_encoding,
+    read_cache_options,
+    response_headers,
+    rewrite_path,
+    server_port,
+    server_ssl_context,
+    upstream_headers,
+    upstream_options,
+)
+from fanout import WatchFanout, watch_key
+from read_cache import ReadCache, request_key
+from upstream import AsyncUpstreamPool
+
+# Request bodies (create/update) are read whole before forwarding
+MAX_REQUEST_BODY = 16 * 1024 * 1024
+
+
+def peer_certificate(request):
+    """DER of the verified client certificate, or None."""
+    ssl_object = request.transport.get_extra_info("ssl_object") if request.transport else None
+    return ssl_object.getpeercert(binary_form=True) if ssl_object else None
+
+
+async def stats(request):
+    return web.json_response({
+        "upstream": request.app["upstream"].stats(),
+        "identities": request.app["identities"].stats(),
+        "watchFanout": request.app["fanout"].stats() if request.app["fanout"] else None,
+        "readCache": request.app["reads"].stats() if request.app["reads"] else None,
+    })
+
+
+async def proxy(request):
+    app = request.app
+    path = request.match_info["path"]
+    query = request.query_string
+    try:
+        if is_interactive(path):
+            location = f"{app['k8s_api']}/{path}" + ("?" + query if query else "")
+            raise web.HTTPTemporaryRedirect(location)
+
+        peer_cert = peer_certificate(request)
+        if not peer_cert:
+            return web.Response(text="❌ No client certificate presented", status=401)
+
+        identity = app["identities"].get(peer_cert)
+        if identity is None:
+            return web.Response(text="❌ Client certificate expired", status=401)
+        user_cn, user_groups = identity
+
+        method = request.method
+        path = rewrite_path(method, path, query)
+
+        watch = watch_key(method, path, request.query, request.headers.get("Accept")) if app["fanout"] else None
+        if watch is None:
+            headers = upstream_headers(request.headers.items(), user_cn, user_groups, app["token"])
+
+            data = await request.read()
+
+            async def send():
+                resp = await app["upstream"].send(method, path, query, headers, data)
+                return negotiate_encoding(resp, request.headers.get("Accept-Encoding"))
+
+            key = None
+            if method == "GET" and app["reads"] is not None:
+                key = request_key(user_cn, user_groups, path, query, request.headers)
+            if key is not None:
+                resp = await app["reads"].aget(key, request.query, send)
+            else:
+                resp = await send()
+                if app["reads"] is not None and is_write(method):
+                    app["reads"].invalidate(path)
+    except web.HTTPException:
+        raise
+    except Exception as e:
+        return web.Response(text=f"Proxy error: {e}", status=500)
+
+    if watch is not None:
+        return await app["fanout"].serve(request, watch, user_cn, user_groups)
+
+    try:
+        response = web.StreamResponse(status=resp.status_code)
+        for k, v in response_headers(resp):
+            response.headers.add(k, v)
+        await response.prepare(request)
+        # write() waits while the client's socket buffer is full, so a slow
+        # reader stops the upstream reads instead of filling memory
+        async for chunk in resp:
+            await response.write(chunk)
+        await response.write_eof()
+        return response
+    finally:
+        # Also runs when the client goes away mid-stream (the handler is
+        # cancelled), which ends the upstream watch
+        await resp.aclose()
+
+
+def create_app(cfg):
+    app = web.Application(client_max_size=MAX_REQUEST_BODY)
+    app["k8s_api"] = cfg["k8s"]["api_server"]
+    app["token"] = cfg["auth"]["token"]
+    app["identities"] = IdentityCache(identity_cache_size(cfg))
+    read_options = read_cache_options(cfg)
+    app["reads"] = ReadCache(**read_options) if read_options else None
+
+    fanout = cfg.get("watch_fanout", {})
+
+    async def upstream_ctx(app):
+        app["upstream"] = AsyncUpstreamPool(app["k8s_api"], cfg["k8s"]["ca_cert"], **upstream_options(cfg))
+        app["fanout"] = None
+        if fanout.get("enabled"):
+            app["fanout"] = WatchFanout(
+                app["upstream"],
+                app["token"],
+                history=fanout.get("history", 1000),
+                linger=fanout.get("linger_seconds", 30),
+                queue_size=fanout.get("queue_size", 1000),
+                allowed_ttl=fanout.get("allowed_ttl_seconds", 60),
+                denied_ttl=fanout.get("denied_ttl_seconds", 10),
+            )
+        yield
+        if app["fanout"]:
+            app["fanout"].stop()
+        await app["upstream"].close()
+
+    app.cleanup_ctx.append(upstream_ctx)
+    app.router.add_get(STATS_PATH, stats)
+    app.router.add_route("*", "/{path:.*}", proxy)
+    return app
+
+
+def main(cfg=None):
+    cfg = cfg or load_config()
+    web.run_app(create_app(cfg), host="0.0.0.0", port=server_port(cfg), ssl_context=server_ssl_context(cfg))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,482 @@
+"""Watch fan-out for the asyncio proxy (async_app.py).
+
+Identical watch requests from different users are served from one shared
+upstream watch per (resource, namespace, selector) instead of one upstream
+watch each. The shared watch runs with the proxy's own token; every
+subscriber is checked with a SubjectAccessReview for its impersonated
+identity (cached per user) before it is sent any event."""
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict, deque, namedtuple
+from urllib.parse import urlencode
+
+from aiohttp import web
+
+logger = logging.getLogger("api-proxy")
+
+# Watch requests with any other query parameter are passed through
+FANOUT_PARAMS = {"watch", "labelSelector", "fieldSelector", "resourceVersion", "allowWatchBookmarks", "timeoutSeconds"}
+
+# Aggregated API groups whose responses depend on who is asking (mynamespace
+# lists the caller's team's namespaces): a watch shared under the proxy's
+# token would show every subscriber the proxy's view
+IDENTITY_SCOPED_GROUPS = {"custom.api.local"}
+
+# How long a subscriber waits for a new shared watch's initial LIST
+SYNC_TIMEOUT = 30
+
+WatchKey = namedtuple("WatchKey", "group version resource namespace label_selector field_selector")
+
+
+def _plain_json(accept):
+    """Whether an Accept header gets plain JSON watch events: some media
+    range accepts JSON and none asks for another representation of the
+    objects (as=Table, as=PartialObjectMetadata, ...), which the shared
+    watch does not serve."""
+    if not accept:
+        return True
+    acceptable = False
+    for media_range in accept.split(","):
+        media_type, *params = [p.strip() for p in media_range.split(";")]
+        if any(p.split("=", 1)[0].strip().lower() == "as" for p in params):
+            return False
+        acceptable = acceptable or media_type.lower() in ("application/json", "application/*", "*/*")
+    return acceptable
+
+
+def watch_key(method, path, params, accept):
+    """WatchKey of a watch request that can share an upstream watch, or
+    None. params is the request's query MultiDict."""
+    if method != "GET" or params.get("watch") not in ("true", "1"):
+        return None
+    if set(params) - FANOUT_PARAMS or len(params) != len(set(params)):
+        return None
+    # Protobuf, Table and metadata-only watches are passed through
+    if not _plain_json(accept):
+        return None
+
+    parts = path.strip("/").split("/")
+    if parts[:2] == ["api", "v1"]:
+        group, version, rest = "", "v1", parts[2:]
+    elif len(parts) >= 3 and parts[0] == "apis":
+        group, version, rest = parts[1], parts[2], parts[3:]
+    else:
+        return None
+    if group in IDENTITY_SCOPED_GROUPS:
+        return None
+    namespace = None
+    if len(rest) == 3 and rest[0] == "namespaces":
+        namespace, rest = rest[1], rest[2:]
+    if len(rest) != 1 or not rest[0]:
+        return None
+    return WatchKey(group, version, rest[0], namespace, params.get("labelSelector", ""), params.get("fieldSelector", ""))
+
+
+def collection_path(key):
+    path = f"apis/{key.group}/{key.version}" if key.group else "api/v1"
+    if key.namespace:
+        path += f"/namespaces/{key.namespace}"
+    return f"{path}/{key.resource}"
+
+
+def _selector_query(key, **extra):
+    params = {"labelSelector": key.label_selector, "fieldSelector": key.field_selector, **extra}
+    return urlencode({k: v for k, v in params.items() if v})
+
+
+def _resource_version(obj):
+    try:
+        return int(obj["metadata"]["resourceVersion"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _object_key(obj):
+    meta = obj.get("metadata", {})
+    return meta.get("namespace"), meta.get("name")
+
+
+def _event_line(event_type, obj):
+    return json.dumps({"type": event_type, "object": obj}, separators=(",", ":")).encode() + b"\n"
+
+
+def _status_line(code, reason, message):
+    return _event_line("ERROR", {
+        "kind": "Status", "apiVersion": "v1", "metadata": {},
+        "status": "Failure", "message": message, "reason": reason, "code": code,
+    })
+
+
+# ------------------------
+# Authorization
+# ------------------------
+class WatchAuthorizer:
+    """Authorizes watchers of shared watches with a SubjectAccessReview
+    (``watch`` on the resource) sent with the proxy's token. Results are
+    kept per user for allowed_ttl (or denied_ttl) seconds in a bounded LRU
+    and concurrent checks of the same key share one review."""
+
+    def __init__(self, pool, token, allowed_ttl=60, denied_ttl=10, max_size=4096):
+        self.pool = pool
+        self.token = token
+        self.allowed_ttl = allowed_ttl
+        self.denied_ttl = denied_ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()  # (user, groups, key) -> (allowed, expires)
+        self._pending = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def allowed(self, user, groups, key):
+        cache_key = (user, tuple(groups), key.group, key.resource, key.namespace)
+        entry = self._entries.get(cache_key)
+        if entry is not None and entry[1] > time.monotonic():
+            self._entries.move_to_end(cache_key)
+            self.hits += 1
+            return entry[0]
+
+        pending = self._pending.get(cache_key)
+        if pending is not None:
+            self.hits += 1
+            return await asyncio.shield(pending)
+
+        self.misses += 1
+        pending = asyncio.ensure_future(self._review(user, groups, key))
+        self._pending[cache_key] = pending
+        try:
+            allowed = await asyncio.shield(pending)
+        finally:
+            self._pending.pop(cache_key, None)
+        ttl = self.allowed_ttl if allowed else self.denied_ttl
+        self._entries[cache_key] = (allowed, time.monotonic() + ttl)
+        self._entries.move_to_end(cache_key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return allowed
+
+    async def _review(self, user, groups, key):
+        attributes = {"verb": "watch", "group": key.group, "version": key.version, "resource": key.resource}
+        if key.namespace:
+            attributes["namespace"] = key.namespace
+        body = json.dumps({
+            "apiVersion": "authorization.k8s.io/v1",
+            "kind": "SubjectAccessReview",
+            # Impersonated requests are authenticated as system:authenticated too
+            "spec": {"user": user, "groups": [*groups, "system:authenticated"], "resourceAttributes": attributes},
+        }).encode()
+        headers = [
+            ("Authorization", f"Bearer {self.token}"),
+            ("Content-Type", "application/json"),
+            ("Accept", "application/json"),
+        ]
+        resp = await self.pool.send("POST", "apis/authorization.k8s.io/v1/subjectaccessreviews", "", headers, body)
+        try:
+            data = b"".join([chunk async for chunk in resp])
+        finally:
+            await resp.aclose()
+        if resp.status_code != 201 and resp.status_code != 200:
+            raise RuntimeError(f"SubjectAccessReview failed with HTTP {resp.status_code}")
+        return bool(json.loads(data).get("status", {}).get("allowed"))
+
+    def stats(self):
+        return {"size": len(self._entries), "maxSize": self.max_size, "hits": self.hits, "misses": self.misses}
+
+
+# ------------------------
+# Shared upstream watch
+# ------------------------
+class WatchHub:
+    """One shared upstream LIST + WATCH. Keeps the current objects, the
+    latest resourceVersion and a bounded history of recent events so new
+    subscribers can start from a snapshot or resume from their own
+    resourceVersion."""
+
+    def __init__(self, fanout, key):
+        self.fanout = fanout
+        self.key = key
+        self.objects = {}  # (namespace, name) -> object
+        self.resource_version = None
+        self.history = deque(maxlen=fanout.history)  # (resourceVersion, event line)
+        # Oldest resourceVersion the history can resume from
+        self.floor = None
+        self.subscribers = set()
+        self.synced = asyncio.Event()
+        self.relists = 0
+        self.events = 0
+        self.last_error = None
+        self._linger = None
+        self._task = asyncio.ensure_future(self._run())
+
+    # --- upstream ---
+    async def _run(self):
+        while True:
+            try:
+                if self.resource_version is None:
+                    await self._list()
+                await self._watch()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error(f"Shared watch {collection_path(self.key)}: {e}")
+                await asyncio.sleep(1)
+
+    async def _get(self, query):
+        headers = [("Authorization", f"Bearer {self.fanout.token}"), ("Accept", "application/json")]
+        return await self.fanout.pool.send("GET", collection_path(self.key), query, headers, b"")
+
+    async def _list(self):
+        resp = await self._get(_selector_query(self.key))
+        try:
+            data = b"".join([chunk async for chunk in resp])
+        finally:
+            await resp.aclose()
+        if resp.status_code != 200:
+            raise RuntimeError(f"list failed with HTTP {resp.status_code}")
+        body = json.loads(data)
+        # List items carry no kind/apiVersion; watch events do
+        kind = body.get("kind", "").removesuffix("List")
+        objects = {}
+        for item in body.get("items", []):
+            item.setdefault("kind", kind)
+            item.setdefault("apiVersion", body.get("apiVersion"))
+            objects[_object_key(item)] = item
+
+        if self.synced.is_set():
+            # Relist after the watch expired: replay the difference
+            self.relists += 1
+            for k, obj in objects.items():
+                old = self.objects.get(k)
+                if old is None:
+                    self._broadcast("ADDED", _event_line("ADDED", obj))
+                elif _resource_version(old) != _resource_version(obj):
+                    self._broadcast("MODIFIED", _event_line("MODIFIED", obj))
+            for k, old in self.objects.items():
+                if k not in objects:
+                    self._broadcast("DELETED", _event_line("DELETED", old))
+
+        self.objects = objects
+        self.resource_version = body.get("metadata", {}).get("resourceVersion")
+        self.history.clear()
+        self.floor = _resource_version(body)
+        self.last_error = None
+        self.synced.set()
+
+    async def _watch(self):
+        query = _selector_query(
+            self.key, watch="1", resourceVersion=self.resource_version, allowWatchBookmarks="true"
+        )
+        resp = await self._get(query)
+        try:
+            if resp.status_code == 410:
+                self.resource_version = None
+                return
+            if resp.status_code != 200:
+                raise RuntimeError(f"watch failed with HTTP {resp.status_code}")
+            buffer = b""
+            async for chunk in resp:
+                buffer += chunk
+                *lines, buffer = buffer.split(b"\n")
+                for line in lines:
+                    if line.strip() and not self._handle(line + b"\n"):
+                        return
+        finally:
+            await resp.aclose()
+
+    def _handle(self, line):
+        """Apply one upstream watch event; False when a relist is needed."""
+        event = json.loads(line)
+        event_type, obj = event.get("type"), event.get("object", {})
+        if event_type == "ERROR":
+            if obj.get("code") == 410:
+                self.resource_version = None
+                return False
+            raise RuntimeError(obj.get("message", "watch error"))
+
+        self.resource_version = obj.get("metadata", {}).get("resourceVersion", self.resource_version)
+        if event_type == "BOOKMARK":
+            self._broadcast(event_type, line)
+            return True
+
+        if event_type == "DELETED":
+            self.objects.pop(_object_key(obj), None)
+        else:
+            self.objects[_object_key(obj)] = obj
+        rv = _resource_version(obj)
+        if rv is not None:
+            if len(self.history) == self.history.maxlen:
+                self.floor = self.history[0][0]
+            self.history.append((rv, line))
+        self.events += 1
+        self._broadcast(event_type, line)
+        return True
+
+    def _broadcast(self, event_type, line):
+        for subscriber in list(self.subscribers):
+            subscriber.deliver(event_type, line)
+
+    # --- subscribers ---
+    def subscribe(self, subscriber, resource_version):
+        """Register subscriber and return the events it must be sent before
+        live ones: a snapshot of ADDED events when it asked for no (or "0")
+        resourceVersion, the missed events when it resumes from one still in
+        the history, or a 410 Expired error otherwise."""
+        if self._linger is not None:
+            self._linger.cancel()
+            self._linger = None
+
+        if resource_version in (None, "", "0"):
+            initial = [_event_line("ADDED", obj) for obj in self.objects.values()]
+        else:
+            try:
+                since = int(resource_version)
+            except ValueError:
+                since = None
+            if since is None or self.floor is None or since < self.floor:
+                return [_status_line(410, "Expired", f"too old resource version: {resource_version}")]
+            initial = [line for rv, line in self.history if rv > since]
+        if subscriber.bookmarks and self.resource_version:
+            # Start from the shared bookmark
+            initial.append(_event_line("BOOKMARK", {
+                "kind": "", "apiVersion": "", "metadata": {"resourceVersion": self.resource_version},
+            }))
+        self.subscribers.add(subscriber)
+        return initial
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.discard(subscriber)
+        if not self.subscribers and self._linger is None:
+            self._linger = asyncio.get_running_loop().call_later(self.fanout.linger, self.fanout.release, self)
+
+    def stop(self):
+        self._task.cancel()
+
+    def status(self):
+        return {
+            "path": collection_path(self.key),
+            "labelSelector": self.key.label_selector,
+            "fieldSelector": self.key.field_selector,
+            "subscribers": len(self.subscribers),
+            "synced": self.synced.is_set(),
+            "objects": len(self.objects),
+            "resourceVersion": self.resource_version,
+            "events": self.events,
+            "relists": self.relists,
+            "lastError": self.last_error,
+        }
+
+
+class Subscriber:
+    """One client watch on a WatchHub. Events are queued up to queue_size;
+    a client that falls further behind is disconnected and resumes from
+    its last resourceVersion like after any watch timeout."""
+
+    def __init__(self, queue_size, bookmarks):
+        self.bookmarks = bookmarks
+        self.queue = asyncio.Queue(queue_size)
+        self.dropped = False
+
+    def deliver(self, event_type, line):
+        if self.dropped or (event_type == "BOOKMARK" and not self.bookmarks):
+            return
+        try:
+            self.queue.put_nowait(line)
+        except asyncio.QueueFull:
+            self.dropped = True
+            # Discard the backlog and wake the writer to disconnect
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+
+class WatchFanout:
+    """Shared upstream watches, one per WatchKey, started by the first
+    subscriber and stopped linger seconds after the last one leaves."""
+
+    def __init__(self, pool, token, history=1000, linger=30, queue_size=1000,
+                 allowed_ttl=60, denied_ttl=10):
+        self.pool = pool
+        self.token = token
+        self.history = history
+        self.linger = linger
+        self.queue_size = queue_size
+        self.authorizer = WatchAuthorizer(pool, token, allowed_ttl, denied_ttl)
+        self.hubs = {}
+
+    def release(self, hub):
+        if not hub.subscribers and self.hubs.get(hub.key) is hub:
+            del self.hubs[hub.key]
+            hub.stop()
+
+    async def serve(self, request, key, user, groups):
+        """Stream a watch from the shared hub for key to request."""
+        try:
+            allowed = await self.authorizer.allowed(user, groups, key)
+        except Exception as e:
+            return web.Response(text=f"Proxy error: {e}", status=500)
+        if not allowed:
+            return web.json_response(status=403, data={
+                "kind": "Status", "apiVersion": "v1", "metadata": {}, "status": "Failure",
+                "message": f'User "{user}" cannot watch resource "{key.resource}"', "reason": "Forbidden", "code": 403,
+            })
+
+        hub = self.hubs.get(key)
+        if hub is None:
+            hub = self.hubs[key] = WatchHub(self, key)
+        params = request.query
+        subscriber = Subscriber(self.queue_size, params.get("allowWatchBookmarks") == "true")
+        try:
+            try:
+                await asyncio.wait_for(hub.synced.wait(), SYNC_TIMEOUT)
+            except asyncio.TimeoutError:
+                return web.Response(text=f"Proxy error: shared watch not synced: {hub.last_error}", status=504)
+            initial = hub.subscribe(subscriber, params.get("resourceVersion"))
+
+            response = web.StreamResponse(status=200, headers={"Content-Type": "application/json"})
+            await response.prepare(request)
+            for line in initial:
+                await response.write(line)
+
+            timeout = float(params.get("timeoutSeconds") or 0) or None
+            deadline = None if timeout is None else time.monotonic() + timeout
+            next_review = time.monotonic() + self.authorizer.allowed_ttl
+            while subscriber in hub.subscribers:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                try:
+                    line = await asyncio.wait_for(subscriber.queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                if line is None:
+                    break
+                # Access revoked mid-watch, or a review that fails, ends the stream
+                if time.monotonic() >= next_review:
+                    try:
+                        allowed = await self.authorizer.allowed(user, groups, key)
+                    except Exception as e:
+                        logger.warning(f"Shared watch {collection_path(key)}: ending {user}'s watch, review failed: {e}")
+                        break
+                    if not allowed:
+                        logger.info(f"Shared watch {collection_path(key)}: ending {user}'s watch, access revoked")
+                        break
+                    next_review = time.monotonic() + self.authorizer.allowed_ttl
+                await response.write(line)
+            await response.write_eof()
+            return response
+        finally:
+            hub.unsubscribe(subscriber)
+
+    def stats(self):
+        return {
+            "watches": [hub.status() for hub in self.hubs.values()],
+            "subscribers": sum(len(hub.subscribers) for hub in self.hubs.values()),
+            "accessReviews": self.authorizer.stats(),
+        }
+
+    def stop(self):
+        for hub in self.hubs.values():
+            hub.stop()
+        self.hubs.clear()
@@ -0,0 +1,211 @@
+"""Request handling shared by the threaded (app.py) and asyncio
+(async_app.py) proxy servers."""
+import hashlib
+import os
+import ssl
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from urllib.parse import parse_qsl
+
+import yaml
+from OpenSSL import crypto
+
+CONFIG_PATH = os.environ.get("PROXY_CONFIG", "/etc/proxy-certs/config.yaml")
+
+INTERACTIVE_PATH_KEYWORDS = ["exec", "attach", "portforward"]
+
+# kubectl's chunked namespace list sends limit, plus continue for later
+# pages and labelSelector for -l; mynamespace serves all three
+NAMESPACE_LIST_PARAMS = {"limit", "continue", "labelSelector"}
+
+# Served by the proxy itself; kube-apiserver paths never start with an underscore
+STATS_PATH = "/_proxy/stats"
+
+# Describe the upstream connection, not the response
+DROPPED_RESPONSE_HEADERS = ("transfer-encoding", "connection", "keep-alive")
+
+# No longer apply once the body is decoded while streaming
+ENCODING_HEADERS = ("content-encoding", "content-length")
+
+# Asked of the API server whatever the client accepts: large responses
+# cross the network to the proxy compressed, and are passed through as is
+# to clients that accept gzip
+UPSTREAM_ACCEPT_ENCODING = "gzip"
+
+
+def load_config(path=CONFIG_PATH):
+    with open(path) as f:
+        return yaml.safe_load(f)
+
+
+def server_ssl_context(cfg):
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(certfile=cfg["tls"]["server_cert"], keyfile=cfg["tls"]["server_key"])
+    context.load_verify_locations(cfg["k8s"]["ca_cert"])
+    context.verify_mode = ssl.CERT_REQUIRED
+    return context
+
+
+def server_port(cfg):
+    return cfg.get("server", {}).get("port", 8443)
+
+
+def upstream_options(cfg):
+    """Keyword arguments for UpstreamPool / AsyncUpstreamPool."""
+    upstream = cfg.get("upstream", {})
+    return {
+        "pool_size": upstream.get("pool_size", 100),
+        "max_idle": upstream.get("max_idle", 20),
+        "idle_timeout": upstream.get("idle_timeout_seconds", 60),
+        "http2": upstream.get("http2", False),
+        "timeout": upstream.get("timeout_seconds", 120),
+    }
+
+
+def read_cache_options(cfg):
+    """Keyword arguments for ReadCache, or None when GETs are neither
+    coalesced nor cached."""
+    reads = cfg.get("read_cache", {})
+    if not reads.get("coalesce", False) and not reads.get("enabled", False):
+        return None
+    return {
+        # Off by default: every coalescable GET is then buffered, up to
+        # max_body, before its first byte is sent
+        "coalesce": reads.get("coalesce", False),
+        "cache": reads.get("enabled", False),
+        "ttl": reads.get("ttl_seconds", 2),
+        "max_entries": reads.get("max_entries", 1000),
+        "max_bytes": reads.get("max_bytes", 64 * 1024 * 1024),
+        "max_body": reads.get("max_body_bytes", 4 * 1024 * 1024),
+    }
+
+
+def is_write(method):
+    return method not in ("GET", "HEAD", "OPTIONS")
+
+
+def identity_cache_size(cfg):
+    return cfg.get("identity_cache", {}).get("max_size", 1024)
+
+
+def is_interactive(path):
+    lower_path = path.lower()
+    return any(k in lower_path for k in INTERACTIVE_PATH_KEYWORDS)
+
+
+def rewrite_path(method, path, query):
+    if method == "GET" and path.strip("/") == "api/v1/namespaces":
+        params = {k for k, _ in parse_qsl(query, keep_blank_values=True)}
+        if "limit" in params and params <= NAMESPACE_LIST_PARAMS:
+            return "apis/custom.api.local/v1/mynamespace"
+    return path
+
+
+class IdentityCache:
+    """Bounded LRU of client certificate identities keyed by the SHA-256
+    fingerprint of the certificate, so a certificate is parsed once rather
+    than on every request. An entry expires at the certificate's notAfter,
+    after which the certificate is refused."""
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # fingerprint -> (user, groups, not_after)
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+
+    def get(self, peer_cert):
+        """(CN, [O, ...]) of a PEM (str) or DER (bytes) client certificate,
+        or None once it has expired."""
+        raw = peer_cert.encode() if isinstance(peer_cert, str) else peer_cert
+        fingerprint = hashlib.sha256(raw).digest()
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(fingerprint)
+            if entry is not None:
+                self._entries.move_to_end(fingerprint)
+                self.hits += 1
+        if entry is None:
+            entry = _parse_certificate(peer_cert)
+            with self._lock:
+                self.misses += 1
+                self._entries[fingerprint] = entry
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        user, groups, not_after = entry
+        if now >= not_after:
+            with self._lock:
+                self._entries.pop(fingerprint, None)
+                self.expired += 1
+            return None
+        return user, groups
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxSize": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+            }
+
+
+def _parse_certificate(peer_cert):
+    if isinstance(peer_cert, str):
+        x509 = crypto.load_certificate(crypto.FILETYPE_PEM, peer_cert)
+    else:
+        x509 = crypto.load_certificate(crypto.FILETYPE_ASN1, peer_cert)
+    components = x509.get_subject().get_components()
+    user_cn = next((v.decode() for k, v in components if k == b"CN"), None)
+    user_groups = [v.decode() for k, v in components if k == b"O"]
+    not_after = datetime.strptime(x509.get_notAfter().decode(), "%Y%m%d%H%M%SZ")
+    return user_cn, user_groups, not_after.replace(tzinfo=timezone.utc).timestamp()
+
+
+def upstream_headers(client_headers, user_cn, user_groups, token):
+    headers = [
+        (k, v) for k, v in client_headers
+        if k.lower() not in ("authorization", "accept-encoding") and not k.lower().startswith("impersonate-")
+    ]
+    headers.append(("Accept-Encoding", UPSTREAM_ACCEPT_ENCODING))
+    headers.append(("Impersonate-User", user_cn))
+    for group in user_groups:
+        headers.append(("Impersonate-Group", group))
+
+    headers.append(("Authorization", f"Bearer {token}"))
+    return headers
+
+
+def accepts_encoding(accept_encoding, encoding):
+    """Whether an Accept-Encoding header value allows encoding."""
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.partition(";")
+        if name.strip().lower() not in (encoding.lower(), "*"):
+            continue
+        params = params.strip().replace(" ", "")
+        if params.startswith("q="):
+            try:
+                return float(params[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+def negotiate_encoding(resp, client_accept_encoding):
+    """Keep the upstream body encoded when the client accepts its
+    Content-Encoding (or it has none), otherwise have it decoded while
+    streaming. Bodies are never re-encoded, so protobuf and other
+    unencoded responses pass through byte for byte."""
+    encoding = resp.headers.get("content-encoding")
+    resp.decode = bool(encoding) and not accepts_encoding(client_accept_encoding, encoding)
+    return resp
+
+
+def response_headers(resp):
+    dropped = DROPPED_RESPONSE_HEADERS + (ENCODING_HEADERS if resp.decode else ())
+    return [(k, v) for k, v in resp.headers.multi_items() if k.lower() not in dropped]
@@ -0,0 +1,310 @@
+"""Coalescing and short-TTL caching of read-only GETs, shared by the
+threaded (app.py) and asyncio (async_app.py) proxy servers.
+
+Everything is keyed by the impersonated identity first, so one user's
+response is never served to another."""
+import asyncio
+import gzip
+import json
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qsl, urlencode
+
+from forwarding import accepts_encoding
+
+# Streams that never end cannot be buffered or shared
+STREAMING_PARAMS = {"watch", "follow"}
+
+# Matched against the cached response's resourceVersion instead of being
+# part of the key
+VERSION_PARAMS = {"resourceVersion", "resourceVersionMatch"}
+
+# The API server answers these per request (e.g. with a 304), so such GETs
+# are neither shared nor answered from the cache
+CONDITIONAL_HEADERS = ("If-None-Match", "If-Modified-Since")
+
+
+def request_key(user, groups, path, query, headers):
+    """Cache and coalescing key of a GET, or None when it must not be
+    coalesced (watches, followed logs, conditional requests). Clients that
+    accept gzip get the body as the API server encoded it, the others a
+    decoded one. headers is the request's case-insensitive header map."""
+    if any(headers.get(name) is not None for name in CONDITIONAL_HEADERS):
+        return None
+    params = parse_qsl(query, keep_blank_values=True)
+    if any(k in STREAMING_PARAMS and v in ("true", "1") for k, v in params):
+        return None
+    normalized = urlencode(sorted((k, v) for k, v in params if k not in VERSION_PARAMS))
+    return (
+        user, tuple(groups), path.strip("/"), normalized,
+        headers.get("Accept") or "", accepts_encoding(headers.get("Accept-Encoding"), "gzip"),
+    )
+
+
+def _response_version(headers, body, decoded):
+    if "json" not in headers.get("content-type", ""):
+        return None
+    try:
+        if not decoded and headers.get("content-encoding") == "gzip":
+            body = gzip.decompress(body)
+        return json.loads(body).get("metadata", {}).get("resourceVersion")
+    except (ValueError, AttributeError, OSError):
+        return None
+
+
+def _satisfies(cached_version, params):
+    """Whether a response at cached_version answers a request with the
+    given resourceVersion semantics. Unset and "0" accept any fresh entry;
+    Exact needs the same version, NotOlderThan (the default for any other
+    version) a version at least as new."""
+    requested = params.get("resourceVersion")
+    if requested in (None, "", "0"):
+        return True
+    if cached_version is None:
+        return False
+    if params.get("resourceVersionMatch") == "Exact":
+        return cached_version == requested
+    try:
+        return int(cached_version) >= int(requested)
+    except ValueError:
+        return False
+
+
+class CachedResponse:
+    """A fully read upstream response. Iterable any number of times, so
+    one copy can be shared by coalesced requests and cache hits."""
+
+    def __init__(self, status_code, headers, body, decode):
+        self.status_code = status_code
+        self.headers = headers
+        self.body = body
+        # Whether body was decoded from the upstream Content-Encoding
+        self.decode = decode
+        self.resource_version = _response_version(headers, body, decode) if status_code == 200 else None
+
+    def __iter__(self):
+        return iter((self.body,))
+
+    async def __aiter__(self):
+        yield self.body
+
+    async def aclose(self):
+        pass
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.waiter = None  # asyncio.Future, created by the async leader
+        self.response = None
+
+
+class _Prefixed:
+    """A response too large to share: the chunks already read, then the
+    rest of the upstream stream."""
+
+    def __init__(self, response, chunks, rest):
+        self._response = response
+        self._chunks = chunks
+        self._rest = rest
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.decode = response.decode
+
+    def __iter__(self):
+        yield from self._chunks
+        yield from self._rest
+
+    def close(self):
+        self._response.close()
+
+    async def __aiter__(self):
+        for chunk in self._chunks:
+            yield chunk
+        async for chunk in self._rest:
+            yield chunk
+
+    async def aclose(self):
+        await self._response.aclose()
+
+
+class ReadCache:
+    """Optional singleflight coalescing of identical concurrent GETs plus
+    an optional TTL cache of their responses.
+
+    With coalesce, requests with the same key that arrive while one is in
+    flight wait for it and share its response. Responses up to max_body
+    bytes are buffered for that (and for the cache); larger ones are
+    streamed to the first request and the others send their own. Without
+    coalesce, requests never wait on each other. With cache enabled, 200 responses are also kept for
+    ttl seconds in an LRU bounded by max_entries and max_bytes, and a
+    request with a resourceVersion is only answered from an entry at least
+    that new. Any write through the proxy drops cached responses under or
+    above the written path."""
+
+    def __init__(self, coalesce=True, cache=False, ttl=2, max_entries=1000, max_bytes=64 * 1024 * 1024,
+                 max_body=4 * 1024 * 1024):
+        self.coalesce = coalesce
+        self.cache = cache
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_body = max_body
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (CachedResponse, expires)
+        self._bytes = 0
+        self._flights = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.invalidations = 0
+
+    # --- threaded server ---
+    def get(self, key, params, send):
+        """Response for a GET with key, from the cache, a request in flight,
+        or send() (which returns an UpstreamResponse)."""
+        cached = self._lookup(key, params)
+        if cached is not None:
+            return cached
+
+        with self._lock:
+            flight = self._flights.get(key) if self.coalesce else None
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                if self.coalesce:
+                    self._flights[key] = flight
+        if not leader:
+            flight.done.wait()
+            if flight.response is not None and _satisfies(flight.response.resource_version, params):
+                self._count("coalesced")
+                return flight.response
+            return send()
+
+        try:
+            response = send()
+            chunks, size = [], 0
+            rest = iter(response)
+            for chunk in rest:
+                chunks.append(chunk)
+                size += len(chunk)
+                if size > self.max_body:
+                    return _Prefixed(response, chunks, rest)
+            flight.response = CachedResponse(response.status_code, response.headers, b"".join(chunks), response.decode)
+            self._store(key, flight.response)
+            return flight.response
+        finally:
+            if self.coalesce:
+                with self._lock:
+                    del self._flights[key]
+            flight.done.set()
+
+    # --- asyncio server ---
+    async def aget(self, key, params, send):
+        """get() for the asyncio server; send() returns an
+        AsyncUpstreamResponse."""
+        cached = self._lookup(key, params)
+        if cached is not None:
+            return cached
+
+        flight = self._flights.get(key) if self.coalesce else None
+        if flight is not None:
+            await asyncio.shield(flight.waiter)
+            if flight.response is not None and _satisfies(flight.response.resource_version, params):
+                self._count("coalesced")
+                return flight.response
+            return await send()
+
+        flight = _Flight()
+        if self.coalesce:
+            self._flights[key] = flight
+            flight.waiter = asyncio.get_running_loop().create_future()
+        try:
+            response = await send()
+            chunks, size = [], 0
+            rest = response.__aiter__()
+            try:
+                async for chunk in rest:
+                    chunks.append(chunk)
+                    size += len(chunk)
+                    if size > self.max_body:
+                        return _Prefixed(response, chunks, rest)
+            except BaseException:
+                await response.aclose()
+                raise
+            await response.aclose()
+            flight.response = CachedResponse(response.status_code, response.headers, b"".join(chunks), response.decode)
+            self._store(key, flight.response)
+            return flight.response
+        finally:
+            if self.coalesce:
+                del self._flights[key]
+                flight.waiter.set_result(None)
+
+    # --- cache ---
+    def _lookup(self, key, params):
+        if not self.cache:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= now:
+                self._drop(key)
+                entry = None
+            if entry is None or not _satisfies(entry[0].resource_version, params):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def _store(self, key, response):
+        if not self.cache or response.status_code != 200:
+            return
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = (response, time.monotonic() + self.ttl)
+            self._bytes += len(response.body)
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                self._drop(next(iter(self._entries)))
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry[0].body)
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def invalidate(self, path):
+        """Drop cached responses for path, the collection it belongs to and
+        the objects under it, for every identity."""
+        path = path.strip("/")
+        with self._lock:
+            stale = [
+                key for key in self._entries
+                if key[2] == path or path.startswith(key[2] + "/") or key[2].startswith(path + "/")
+            ]
+            for key in stale:
+                self._drop(key)
+            self.invalidations += len(stale)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "coalesce": self.coalesce,
+                "cache": self.cache,
+                "ttlSeconds": self.ttl,
+                "entries": len(self._entries),
+                "maxEntries": self.max_entries,
+                "bytes": self._bytes,
+                "maxBytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "inFlight": len(self._flights),
+                "invalidations": self.invalidations,
+            }
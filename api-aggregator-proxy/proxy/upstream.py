@@ -0,0 +1,202 @@
+import ssl
+import threading
+
+import httpx
+
+# Hop-by-hop headers (RFC 7230 section 6.1) apply to one connection and are
+# never forwarded; HTTP/2 rejects them outright.
+HOP_BY_HOP_HEADERS = {
+    "connection",
+    "keep-alive",
+    "proxy-authenticate",
+    "proxy-authorization",
+    "proxy-connection",
+    "te",
+    "trailer",
+    "transfer-encoding",
+    "upgrade",
+    "host",
+}
+
+
+class UpstreamPool:
+    """Shared, thread-safe keep-alive client for the kube-apiserver.
+
+    Connections (TCP + TLS) are reused across requests instead of being
+    opened per call, idle connections are closed after idle_timeout
+    seconds, and with http2 many requests are multiplexed over one
+    connection. The CA bundle is loaded once."""
+
+    transport_class = httpx.HTTPTransport
+    client_class = httpx.Client
+
+    def __init__(self, base_url, ca_cert, pool_size=100, max_idle=20, idle_timeout=60,
+                 http2=False, timeout=120, connect_timeout=10):
+        self.base_url = base_url.rstrip("/")
+        self.pool_size = pool_size
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.http2 = http2
+
+        ssl_context = ssl.create_default_context(cafile=ca_cert)
+        self._transport = self.transport_class(
+            verify=ssl_context,
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=pool_size,
+                max_keepalive_connections=max_idle,
+                keepalive_expiry=idle_timeout,
+            ),
+        )
+        self.client = self.client_class(
+            transport=self._transport,
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            # Upstream redirects are the client's business
+            follow_redirects=False,
+        )
+        self._init_counters()
+
+    def send(self, method, path, query, headers, body):
+        """Start an upstream request. Returns an UpstreamResponse whose body
+        is read as it is iterated; closing it releases the connection."""
+        request = self._build_request(method, path, query, headers, body)
+        self._started()
+        try:
+            response = self.client.send(request, stream=True)
+        except Exception as e:
+            self._failed(e)
+            raise
+        return UpstreamResponse(self, response)
+
+    def close(self):
+        self.client.close()
+
+    # --- shared with AsyncUpstreamPool ---
+    def _init_counters(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.pool_timeouts = 0
+
+    def _build_request(self, method, path, query, headers, body):
+        url = f"{self.base_url}/{path}" + ("?" + query if query else "")
+        forwarded = [(k, v) for k, v in headers if k.lower() not in HOP_BY_HOP_HEADERS]
+        return self.client.build_request(method, url, headers=forwarded, content=body or None)
+
+    def _started(self):
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def _failed(self, error):
+        with self._lock:
+            self.in_flight -= 1
+            self.errors += 1
+            if isinstance(error, httpx.PoolTimeout):
+                self.pool_timeouts += 1
+
+    def _released(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def stats(self):
+        connections = list(getattr(getattr(self._transport, "_pool", None), "connections", []))
+        idle = sum(1 for c in connections if c.is_idle())
+        with self._lock:
+            return {
+                "poolSize": self.pool_size,
+                "maxIdle": self.max_idle,
+                "idleTimeoutSeconds": self.idle_timeout,
+                "http2": self.http2,
+                "connections": len(connections),
+                "idleConnections": idle,
+                "activeConnections": len(connections) - idle,
+                "http2Connections": sum(1 for c in connections if "HTTP/2" in c.info()),
+                "requests": self.requests,
+                "inFlight": self.in_flight,
+                "maxInFlight": self.max_in_flight,
+                "errors": self.errors,
+                "poolTimeouts": self.pool_timeouts,
+            }
+
+
+class UpstreamResponse:
+    """A streaming upstream response, usable directly as a WSGI body: the
+    server calls close() when it is done or the client went away."""
+
+    def __init__(self, pool, response):
+        self._pool = pool
+        self._response = response
+        self._closed = False
+        self.status_code = response.status_code
+        self.headers = response.headers
+        # False passes the body through with its Content-Encoding
+        self.decode = True
+
+    def __iter__(self):
+        try:
+            yield from self._response.iter_bytes() if self.decode else self._response.iter_raw()
+        finally:
+            self.close()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._response.close()
+        self._pool._released()
+
+
+class AsyncUpstreamPool(UpstreamPool):
+    """UpstreamPool for the asyncio server (async_app.py). A request waiting
+    on the upstream holds no thread, so one process can keep thousands of
+    watches open; pool_size (or http2 multiplexing) bounds how many reach
+    the API server at once."""
+
+    transport_class = httpx.AsyncHTTPTransport
+    client_class = httpx.AsyncClient
+
+    async def send(self, method, path, query, headers, body):
+        """Start an upstream request. Returns an AsyncUpstreamResponse whose
+        body is read as it is iterated; closing it releases the connection."""
+        request = self._build_request(method, path, query, headers, body)
+        self._started()
+        try:
+            response = await self.client.send(request, stream=True)
+        except Exception as e:
+            self._failed(e)
+            raise
+        return AsyncUpstreamResponse(self, response)
+
+    async def close(self):
+        await self.client.aclose()
+
+
+class AsyncUpstreamResponse:
+    """A streaming upstream response for the asyncio server. Chunks are
+    pulled from the upstream only as fast as the client accepts them."""
+
+    def __init__(self, pool, response):
+        self._pool = pool
+        self._response = response
+        self._closed = False
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.decode = True
+
+    async def __aiter__(self):
+        chunks = self._response.aiter_bytes() if self.decode else self._response.aiter_raw()
+        async for chunk in chunks:
+            yield chunk
+
+    async def aclose(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            await self._response.aclose()
+        finally:
+            self._pool._released()
@@ -0,0 +1,76 @@
+import re
+
+_KEY = r"(?:[A-Za-z0-9](?:[-A-Za-z0-9.]*[A-Za-z0-9])?/)?[A-Za-z0-9](?:[-A-Za-z0-9_.]*[A-Za-z0-9])?"
+_VALUE = r"(?:[A-Za-z0-9](?:[-A-Za-z0-9_.]*[A-Za-z0-9])?)?"
+
+_EXISTS = re.compile(rf"^(?P<not>!?)\s*(?P<key>{_KEY})$")
+_EQUALS = re.compile(rf"^(?P<key>{_KEY})\s*(?P<op>==|=|!=)\s*(?P<value>{_VALUE})$")
+_SET = re.compile(rf"^(?P<key>{_KEY})\s+(?P<op>in|notin)\s*\((?P<values>.*)\)$")
+_VALUE_ONLY = re.compile(rf"^{_VALUE}$")
+
+
+def _split(text):
+    """Split on the commas that are not inside an in/notin value list."""
+    parts, depth, start = [], 0, 0
+    for i, c in enumerate(text):
+        if c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+        elif c == "," and depth == 0:
+            parts.append(text[start:i])
+            start = i + 1
+    parts.append(text[start:])
+    return parts
+
+
+class LabelSelector:
+    """A parsed labelSelector, in the syntax of the Kubernetes API:
+    comma-separated requirements of the form key, !key, key=value,
+    key==value, key!=value, key in (a,b) and key notin (a,b).
+
+    Raises ValueError for a selector that cannot be parsed."""
+
+    def __init__(self, text):
+        self.text = text or ""
+        self.requirements = []  # (key, operator, values)
+        if not self.text.strip():
+            return
+        for part in _split(self.text):
+            self.requirements.append(self._parse(part.strip()))
+
+    @staticmethod
+    def _parse(requirement):
+        m = _EQUALS.match(requirement)
+        if m:
+            op = "!=" if m["op"] == "!=" else "="
+            return m["key"], op, {m["value"]}
+        m = _SET.match(requirement)
+        if m:
+            values = {v.strip() for v in m["values"].split(",")}
+            if not all(_VALUE_ONLY.match(v) for v in values):
+                raise ValueError(f"invalid label values in '{requirement}'")
+            return m["key"], m["op"], values
+        m = _EXISTS.match(requirement)
+        if m:
+            return m["key"], "!" if m["not"] else "exists", set()
+        raise ValueError(f"unable to parse requirement: '{requirement}'")
+
+    def __bool__(self):
+        return bool(self.requirements)
+
+    def matches(self, labels):
+        labels = labels or {}
+        for key, op, values in self.requirements:
+            if op in ("=", "in"):
+                if labels.get(key) not in values:
+                    return False
+            elif op in ("!=", "notin"):
+                if key in labels and labels[key] in values:
+                    return False
+            elif op == "exists":
+                if key not in labels:
+                    return False
+            elif key in labels:
+                return False
+        return True
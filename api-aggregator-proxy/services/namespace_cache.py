@@ -0,0 +1,270 @@
+from collections import deque
+import logging
+import queue
+import threading
+import time
+
+from kubernetes import watch
+from kubernetes.client.rest import ApiException
+
+logger = logging.getLogger("namespace-api")
+
+WATCH_TIMEOUT_SECONDS = 300
+RETRY_SECONDS = 5
+# Changes kept for watches resuming from a resourceVersion
+WATCH_HISTORY = 1000
+# Changes a watcher may fall behind by before it is dropped
+WATCHER_QUEUE_SIZE = 1000
+
+
+def _rv(resource_version):
+    try:
+        return int(resource_version)
+    except (TypeError, ValueError):
+        return None
+
+
+class Expired(Exception):
+    """The resourceVersion a watch asked for is older than the history."""
+
+
+class Watcher:
+    """Changes for one watch request. Each item of events is an (old, new)
+    pair of V1Namespaces, with old None for an added namespace and new None
+    for a deleted one. A None item means the watcher was dropped, because
+    it fell too far behind or the cache stopped."""
+
+    def __init__(self, initial):
+        self.events = queue.Queue()
+        for change in initial:
+            self.events.put(change)
+        self.limit = len(initial) + WATCHER_QUEUE_SIZE
+        self.closed = False
+
+    def _deliver(self, change):
+        if self.events.qsize() >= self.limit:
+            self._close()
+            return False
+        self.events.put(change)
+        return True
+
+    def _close(self):
+        self.closed = True
+        self.events.put(None)
+
+
+class NamespaceCache:
+    """In-memory copy of all Namespaces, kept current by a LIST + WATCH
+    loop in a background thread, with a secondary index on the team label.
+
+    Reads never call the API server: list() returns every namespace and
+    by_team() only the namespaces labelled with a team, in time
+    proportional to that team's namespace count. watch() registers a
+    Watcher that is sent every later change, including the differences a
+    relist finds."""
+
+    def __init__(self, v1, label_key):
+        self.v1 = v1
+        self.label_key = label_key
+
+        self._lock = threading.Lock()
+        self._namespaces = {}  # name -> V1Namespace
+        self._by_team = {}  # label value -> {name: V1Namespace}
+        self._watchers = set()
+        self._history = deque(maxlen=WATCH_HISTORY)  # (resourceVersion, old, new)
+        self._floor = None  # watches may resume from any resourceVersion >= floor
+        self._synced = threading.Event()
+        self._stopped = threading.Event()
+        self._watch = None
+        self._thread = None
+
+        self.resource_version = None
+        self.last_sync = None
+        self.last_error = None
+        self.relists = 0
+        self.events = 0
+
+    # --- lifecycle ---
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="namespace-cache", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._watch is not None:
+            self._watch.stop()
+        with self._lock:
+            for watcher in self._watchers:
+                watcher._close()
+            self._watchers.clear()
+
+    def has_synced(self):
+        return self._synced.is_set()
+
+    def wait_for_sync(self, timeout=None):
+        return self._synced.wait(timeout)
+
+    # --- reads ---
+    def list(self):
+        with self._lock:
+            items = list(self._namespaces.values())
+        return sorted(items, key=lambda ns: ns.metadata.name)
+
+    def by_team(self, team):
+        with self._lock:
+            items = list(self._by_team.get(team, {}).values())
+        return sorted(items, key=lambda ns: ns.metadata.name)
+
+    # --- watchers ---
+    def watch(self, resource_version=None):
+        """Register a Watcher. Without a resourceVersion (or with "0") its
+        first events add every current namespace; with one, they are the
+        changes since then. Raises Expired if those are no longer kept."""
+        with self._lock:
+            if resource_version in (None, "", "0"):
+                initial = [(None, ns) for ns in self._namespaces.values()]
+            else:
+                since = _rv(resource_version)
+                if since is None or self._floor is None or since < self._floor:
+                    raise Expired(f"too old resource version: {resource_version}")
+                initial = [(old, new) for rv, old, new in self._history if rv > since]
+            watcher = Watcher(initial)
+            self._watchers.add(watcher)
+        return watcher
+
+    def unwatch(self, watcher):
+        with self._lock:
+            self._watchers.discard(watcher)
+
+    def bookmark(self, watcher):
+        """The resourceVersion watcher has been sent every change up to, or
+        None while it still has changes queued."""
+        with self._lock:
+            if watcher.events.empty():
+                return self.resource_version
+        return None
+
+    def _notify(self, resource_version, old, new):
+        # Called with the lock held
+        if len(self._history) == self._history.maxlen:
+            self._floor = self._history[0][0]
+        self._history.append((resource_version, old, new))
+        for watcher in list(self._watchers):
+            if not watcher._deliver((old, new)):
+                logger.warning("Dropping a namespace watcher that fell behind")
+                self._watchers.discard(watcher)
+
+    # --- LIST + WATCH ---
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                if self.resource_version is None:
+                    self._list()
+                self._watch_changes()
+            except ApiException as e:
+                if e.status == 410:
+                    logger.info("Namespace watch expired, relisting")
+                    self.resource_version = None
+                    continue
+                self._failed(e)
+            except Exception as e:
+                self._failed(e)
+
+    def _failed(self, error):
+        self.last_error = str(error)
+        logger.error(f"Namespace cache: {error}")
+        self._stopped.wait(RETRY_SECONDS)
+
+    def _list(self):
+        ns_list = self.v1.list_namespace()
+        namespaces = {ns.metadata.name: ns for ns in ns_list.items}
+        by_team = {}
+        for name, ns in namespaces.items():
+            team = self._team(ns)
+            if team is not None:
+                by_team.setdefault(team, {})[name] = ns
+        resource_version = ns_list.metadata.resource_version
+        with self._lock:
+            if self._watchers:
+                # Tell watchers what changed while the watch was down
+                for name, ns in namespaces.items():
+                    old = self._namespaces.get(name)
+                    if old is None or old.metadata.resource_version != ns.metadata.resource_version:
+                        self._notify(_rv(ns.metadata.resource_version), old, ns)
+                for name, old in self._namespaces.items():
+                    if name not in namespaces:
+                        self._notify(_rv(resource_version), old, None)
+            self._namespaces = namespaces
+            self._by_team = by_team
+            # Changes before the relist were not all seen
+            self._history.clear()
+            self._floor = _rv(resource_version)
+            self.resource_version = resource_version
+        if self._synced.is_set():
+            self.relists += 1
+        self.last_sync = time.time()
+        self.last_error = None
+        self._synced.set()
+        logger.info(f"Namespace cache synced: {len(namespaces)} namespaces at resourceVersion {self.resource_version}")
+
+    def _watch_changes(self):
+        self._watch = watch.Watch()
+        for event in self._watch.stream(
+            self.v1.list_namespace,
+            resource_version=self.resource_version,
+            timeout_seconds=WATCH_TIMEOUT_SECONDS,
+            allow_watch_bookmarks=True,
+        ):
+            if self._stopped.is_set():
+                break
+            ns = event["object"]
+            if event["type"] == "BOOKMARK":
+                with self._lock:
+                    self.resource_version = ns.metadata.resource_version or self.resource_version
+                continue
+            self._apply(event["type"], ns)
+            self.events += 1
+
+    def _apply(self, event_type, ns):
+        name = ns.metadata.name
+        with self._lock:
+            self.resource_version = ns.metadata.resource_version or self.resource_version
+            old = self._namespaces.pop(name, None)
+            if old is not None:
+                old_team = self._team(old)
+                if old_team is not None:
+                    members = self._by_team.get(old_team, {})
+                    members.pop(name, None)
+                    if not members:
+                        self._by_team.pop(old_team, None)
+            if event_type != "DELETED":
+                self._namespaces[name] = ns
+                team = self._team(ns)
+                if team is not None:
+                    self._by_team.setdefault(team, {})[name] = ns
+                self._notify(_rv(ns.metadata.resource_version), old, ns)
+            elif old is not None:
+                # The deleted object carries the resourceVersion of the deletion
+                self._notify(_rv(ns.metadata.resource_version), ns, None)
+
+    def _team(self, ns):
+        labels = ns.metadata.labels or {}
+        return labels.get(self.label_key)
+
+    def status(self):
+        with self._lock:
+            namespaces = len(self._namespaces)
+            teams = len(self._by_team)
+            watchers = len(self._watchers)
+        return {
+            "synced": self.has_synced(),
+            "namespaces": namespaces,
+            "teams": teams,
+            "labelKey": self.label_key,
+            "resourceVersion": self.resource_version,
+            "lastSync": self.last_sync,
+            "relists": self.relists,
+            "events": self.events,
+            "watchers": watchers,
+            "lastError": self.last_error,
+        }
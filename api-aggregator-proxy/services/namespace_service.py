@@ -1,3 +1,8 @@
+import base64
+import json
+from datetime import datetime, timezone
+
+
 def filter_namespaces(namespaces, team_name, label_key):
     return [
         ns for ns in namespaces
@@ -6,21 +11,76 @@ def filter_namespaces(namespaces, team_name, label_key):
     ]
 
 
+def format_namespace(ns):
+    metadata = {
+        "name": ns.metadata.name,
+        "creationTimestamp": (
+            ns.metadata.creation_timestamp.isoformat()
+            if ns.metadata.creation_timestamp else None
+        )
+    }
+    if ns.metadata.resource_version:
+        metadata["resourceVersion"] = ns.metadata.resource_version
+    if ns.metadata.labels:
+        metadata["labels"] = ns.metadata.labels
+
+    return {
+        "metadata": metadata,
+        "status": {
+            "phase": ns.status.phase if ns.status else "Unknown"
+        }
+    }
+
+
 def format_namespaces(ns_list):
-    result = []
-
-    for ns in ns_list:
-        result.append({
-            "metadata": {
-                "name": ns.metadata.name,
-                "creationTimestamp": (
-                    ns.metadata.creation_timestamp.isoformat()
-                    if ns.metadata.creation_timestamp else None
-                )
-            },
-            "status": {
-                "phase": ns.status.phase if ns.status else "Unknown"
-            }
-        })
-
-    return result
\ No newline at end of file
+    return [format_namespace(ns) for ns in ns_list]
+
+
+def list_items(namespaces, team_name, user, placeholder=True):
+    """The items of a list response, formatted while it is written. With
+    placeholder, an empty list gets one entry saying that no namespaces
+    were found for the team, for kubectl to print."""
+    if namespaces or not placeholder:
+        return (format_namespace(ns) for ns in namespaces)
+    return [{
+        "metadata": {
+            "name": f"No namespaces found for team '{team_name}' (user '{user}')",
+            "creationTimestamp": datetime.now(timezone.utc).isoformat()
+        },
+        "status": {"phase": "Unknown"}
+    }]
+
+
+def encode_continue(resource_version, start):
+    """A continue token for the page after the namespace named start. It
+    holds the name rather than an offset, so namespaces created or deleted
+    between pages do not shift later pages."""
+    token = {"v": "meta.k8s.io/v1", "rv": resource_version, "start": start}
+    return base64.urlsafe_b64encode(json.dumps(token, separators=(",", ":")).encode()).decode()
+
+
+def decode_continue(token):
+    """The name a continue token resumes after. Raises ValueError if the
+    token was not made by encode_continue."""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(token.encode()))
+        start = data["start"]
+    except Exception:
+        raise ValueError("continue key is not valid") from None
+    if data.get("v") != "meta.k8s.io/v1" or not isinstance(start, str):
+        raise ValueError("continue key is not valid")
+    return start
+
+
+def paginate(namespaces, limit, token, resource_version):
+    """One page of namespaces sorted by name: at most limit (0 for all)
+    starting after the continue token, with the token for the next page
+    and the number of namespaces left after it, or None for both on the
+    last page."""
+    if token:
+        start = decode_continue(token)
+        namespaces = [ns for ns in namespaces if ns.metadata.name > start]
+    if not limit or len(namespaces) <= limit:
+        return namespaces, None, None
+    page = namespaces[:limit]
+    return page, encode_continue(resource_version, page[-1].metadata.name), len(namespaces) - limit
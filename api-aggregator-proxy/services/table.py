@@ -0,0 +1,105 @@
+from datetime import datetime, timezone
+
+from utils.accept import negotiate
+
+TABLE_GROUP = "meta.k8s.io"
+TABLE_VERSIONS = ("v1", "v1beta1")
+INCLUDE_OBJECT = ("None", "Metadata", "Object")
+
+# The columns kube-apiserver prints for Namespaces
+NAMESPACE_COLUMNS = [
+    {
+        "name": "Name",
+        "type": "string",
+        "format": "name",
+        "description": "Name must be unique within a namespace. Cannot be updated.",
+        "priority": 0
+    },
+    {
+        "name": "Status",
+        "type": "string",
+        "format": "",
+        "description": "The status of the namespace",
+        "priority": 0
+    },
+    {
+        "name": "Age",
+        "type": "string",
+        "format": "",
+        "description": "CreationTimestamp is a timestamp representing the server time when this object was created.",
+        "priority": 0
+    },
+]
+
+
+def table_version(accept):
+    """The Table version (v1 or v1beta1) asked for in an Accept header such
+    as kubectl's "application/json;as=Table;v=v1;g=meta.k8s.io,
+    application/json", or None if no Table form is acceptable."""
+    return negotiate(accept, "Table", TABLE_GROUP, TABLE_VERSIONS)
+
+
+def human_duration(seconds):
+    """Age in kubectl's short form: 45s, 5m30s, 3h20m, 4d5h, 2y30d."""
+    seconds = int(seconds)
+    if seconds < -1:
+        return "<invalid>"
+    if seconds < 0:
+        return "0s"
+    if seconds < 60 * 2:
+        return f"{seconds}s"
+    minutes = seconds // 60
+    if minutes < 10:
+        return f"{minutes}m{seconds % 60}s" if seconds % 60 else f"{minutes}m"
+    if minutes < 60 * 3:
+        return f"{minutes}m"
+    hours = minutes // 60
+    if hours < 8:
+        return f"{hours}h{minutes % 60}m" if minutes % 60 else f"{hours}h"
+    if hours < 48:
+        return f"{hours}h"
+    days = hours // 24
+    if hours < 24 * 8:
+        return f"{days}d{hours % 24}h" if hours % 24 else f"{days}d"
+    if hours < 24 * 365 * 2:
+        return f"{days}d"
+    if hours < 24 * 365 * 8:
+        return f"{days // 365}y{days % 365}d" if days % 365 else f"{days // 365}y"
+    return f"{days // 365}y"
+
+
+def _age(creation_timestamp, now):
+    if not creation_timestamp:
+        return "<unknown>"
+    created = datetime.fromisoformat(creation_timestamp.replace("Z", "+00:00"))
+    return human_duration((now - created).total_seconds())
+
+
+def namespace_row(ns, include_object="Metadata", version="v1", now=None):
+    """A Table row for a namespace as formatted by format_namespace."""
+    now = now or datetime.now(timezone.utc)
+    row = {
+        "cells": [
+            ns["metadata"]["name"],
+            ns.get("status", {}).get("phase", "Unknown"),
+            _age(ns["metadata"].get("creationTimestamp"), now),
+        ]
+    }
+    if include_object == "Object":
+        row["object"] = {"kind": "Namespace", "apiVersion": "v1", **ns}
+    elif include_object == "Metadata":
+        row["object"] = {
+            "kind": "PartialObjectMetadata",
+            "apiVersion": f"{TABLE_GROUP}/{version}",
+            "metadata": ns["metadata"]
+        }
+    return row
+
+
+def table(version, metadata, columns=True):
+    """A Table without its rows. Watch events after the first leave out the
+    column definitions, as kube-apiserver does."""
+    head = {"kind": "Table", "apiVersion": f"{TABLE_GROUP}/{version}", "metadata": metadata}
+    if columns:
+        head["columnDefinitions"] = NAMESPACE_COLUMNS
+    return head
@@ -0,0 +1,97 @@
+import pytest
+
+from services.label_selector import LabelSelector
+
+# (selector, requirements)
+PARSE_CASES = [
+    ("", []),
+    ("   ", []),
+    (None, []),
+    ("a", [("a", "exists", set())]),
+    ("!a", [("a", "!", set())]),
+    ("! a", [("a", "!", set())]),
+    ("a=b", [("a", "=", {"b"})]),
+    ("a==b", [("a", "=", {"b"})]),
+    ("a!=b", [("a", "!=", {"b"})]),
+    ("  a = b  ", [("a", "=", {"b"})]),
+    ("a=", [("a", "=", {""})]),
+    ("example.com/team==a", [("example.com/team", "=", {"a"})]),
+    ("a in (b,c)", [("a", "in", {"b", "c"})]),
+    ("a in ( b , c )", [("a", "in", {"b", "c"})]),
+    ("a in(b)", [("a", "in", {"b"})]),
+    ("a notin (b)", [("a", "notin", {"b"})]),
+    # As in apimachinery, an empty list and a trailing comma mean the empty value
+    ("a in ()", [("a", "in", {""})]),
+    ("a notin ()", [("a", "notin", {""})]),
+    ("a in (b,)", [("a", "in", {"b", ""})]),
+    (
+        "a in (b),c notin (d,e),!f",
+        [("a", "in", {"b"}), ("c", "notin", {"d", "e"}), ("f", "!", set())],
+    ),
+]
+
+
+@pytest.mark.parametrize("text, requirements", PARSE_CASES)
+def test_parse(text, requirements):
+    assert LabelSelector(text).requirements == requirements
+
+
+INVALID_CASES = [
+    "a,",
+    "a,,b",
+    "=b",
+    "a=b=c",
+    "a>1",
+    "a=-b",
+    "-a=b",
+    "ain (b)",
+    "a in (b",
+    "a in b",
+    "a in (b c)",
+    "a in (-b)",
+]
+
+
+@pytest.mark.parametrize("text", INVALID_CASES)
+def test_invalid(text):
+    with pytest.raises(ValueError):
+        LabelSelector(text)
+
+
+# (selector, labels, matches)
+MATCH_CASES = [
+    ("", None, True),
+    ("a", {"a": ""}, True),
+    ("a", {}, False),
+    ("!a", {}, True),
+    ("!a", {"a": "b"}, False),
+    ("a=b", {"a": "b"}, True),
+    ("a=b", {"a": "c"}, False),
+    ("a=b", {}, False),
+    # != and notin also match when the label is missing
+    ("a!=b", {}, True),
+    ("a!=b", {"a": "c"}, True),
+    ("a!=b", {"a": "b"}, False),
+    ("a in (b,c)", {"a": "c"}, True),
+    ("a in (b,c)", {"a": "d"}, False),
+    ("a in (b,c)", {}, False),
+    ("a notin (b,c)", {}, True),
+    ("a notin (b,c)", {"a": "b"}, False),
+    ("a in ()", {"a": ""}, True),
+    ("a in ()", {"a": "b"}, False),
+    ("a in ()", {}, False),
+    ("a notin ()", {"a": "b"}, True),
+    ("a notin ()", {"a": ""}, False),
+    ("a=b,c", {"a": "b", "c": "d"}, True),
+    ("a=b,c", {"a": "b"}, False),
+]
+
+
+@pytest.mark.parametrize("text, labels, matches", MATCH_CASES)
+def test_matches(text, labels, matches):
+    assert LabelSelector(text).matches(labels) is matches
+
+
+def test_bool():
+    assert not LabelSelector("")
+    assert LabelSelector("a")
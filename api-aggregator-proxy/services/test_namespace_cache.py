@@ -0,0 +1,139 @@
+import pytest
+from kubernetes.client import V1ListMeta, V1Namespace, V1NamespaceList, V1ObjectMeta
+
+from services import namespace_cache
+from services.namespace_cache import Expired, NamespaceCache
+
+
+def namespace(name, resource_version, team=None):
+    labels = {"team": team} if team else None
+    return V1Namespace(metadata=V1ObjectMeta(name=name, resource_version=str(resource_version), labels=labels))
+
+
+class FakeCoreV1:
+    def __init__(self, resource_version, *items):
+        self.resource_version = resource_version
+        self.items = list(items)
+
+    def list_namespace(self):
+        return V1NamespaceList(metadata=V1ListMeta(resource_version=str(self.resource_version)), items=self.items)
+
+
+def drain(watcher):
+    changes = []
+    while not watcher.events.empty():
+        change = watcher.events.get_nowait()
+        changes.append(None if change is None else tuple(ns and ns.metadata.name for ns in change))
+    return changes
+
+
+@pytest.fixture
+def cache():
+    """A cache listed at resourceVersion 10 that then saw events 11 to 13.
+    The watch loop is not started; events are applied directly."""
+    cache = NamespaceCache(FakeCoreV1(10, namespace("a", 5, "x"), namespace("b", 6)), "team")
+    cache._list()
+    cache._apply("ADDED", namespace("c", 11, "x"))
+    cache._apply("MODIFIED", namespace("b", 12, "y"))
+    cache._apply("DELETED", namespace("a", 13, "x"))
+    return cache
+
+
+def test_list_and_index(cache):
+    assert [ns.metadata.name for ns in cache.list()] == ["b", "c"]
+    assert [ns.metadata.name for ns in cache.by_team("x")] == ["c"]
+    assert [ns.metadata.name for ns in cache.by_team("y")] == ["b"]
+    assert cache.resource_version == "13"
+
+
+# (resourceVersion to resume from, (old, new) names of the changes sent first)
+RESUME_CASES = [
+    (None, [(None, "b"), (None, "c")]),
+    ("", [(None, "b"), (None, "c")]),
+    ("0", [(None, "b"), (None, "c")]),
+    ("10", [(None, "c"), ("b", "b"), ("a", None)]),
+    ("11", [("b", "b"), ("a", None)]),
+    ("13", []),
+    # Newer than anything seen: nothing to replay yet
+    ("99", []),
+]
+
+
+@pytest.mark.parametrize("resource_version, changes", RESUME_CASES)
+def test_watch_resume(cache, resource_version, changes):
+    watcher = cache.watch(resource_version)
+    assert sorted(drain(watcher), key=repr) == sorted(changes, key=repr)
+
+
+@pytest.mark.parametrize("resource_version", ["9", "1", "not-a-number"])
+def test_watch_expired(cache, resource_version):
+    with pytest.raises(Expired):
+        cache.watch(resource_version)
+
+
+def test_watch_expired_before_sync():
+    cache = NamespaceCache(FakeCoreV1(1), "team")
+    with pytest.raises(Expired):
+        cache.watch("1")
+
+
+def test_history_overflow(monkeypatch):
+    monkeypatch.setattr(namespace_cache, "WATCH_HISTORY", 3)
+    cache = NamespaceCache(FakeCoreV1(10), "team")
+    cache._list()
+    for rv in range(11, 16):
+        cache._apply("ADDED", namespace(f"ns-{rv}", rv))
+
+    # Only 13 to 15 are kept: resuming needs a version from 13 on
+    with pytest.raises(Expired):
+        cache.watch("11")
+    assert drain(cache.watch("12")) == [(None, "ns-13"), (None, "ns-14"), (None, "ns-15")]
+    assert drain(cache.watch("14")) == [(None, "ns-15")]
+
+
+def test_watchers_get_new_events(cache):
+    watcher = cache.watch("13")
+    cache._apply("ADDED", namespace("d", 14))
+    cache._apply("DELETED", namespace("d", 15))
+    assert drain(watcher) == [(None, "d"), ("d", None)]
+
+    cache.unwatch(watcher)
+    cache._apply("ADDED", namespace("e", 16))
+    assert drain(watcher) == []
+
+
+def test_deleting_an_unknown_namespace_sends_nothing(cache):
+    watcher = cache.watch("13")
+    cache._apply("DELETED", namespace("unknown", 14))
+    assert drain(watcher) == []
+
+
+def test_relist_sends_differences_and_resets_history(cache):
+    watcher = cache.watch("13")
+    cache.v1 = FakeCoreV1(20, namespace("b", 12, "y"), namespace("c", 18, "z"), namespace("d", 19))
+    cache._list()
+
+    assert sorted(drain(watcher), key=repr) == sorted([("c", "c"), (None, "d")], key=repr)
+    assert [ns.metadata.name for ns in cache.by_team("z")] == ["c"]
+    assert cache.by_team("x") == []
+    # Changes before the relist were not all seen
+    with pytest.raises(Expired):
+        cache.watch("13")
+    assert drain(cache.watch("20")) == []
+
+
+def test_bookmark(cache):
+    watcher = cache.watch("12")
+    assert cache.bookmark(watcher) is None
+    drain(watcher)
+    assert cache.bookmark(watcher) == "13"
+
+
+def test_slow_watcher_is_dropped(cache, monkeypatch):
+    monkeypatch.setattr(namespace_cache, "WATCHER_QUEUE_SIZE", 2)
+    watcher = cache.watch("13")
+    for rv in range(14, 18):
+        cache._apply("ADDED", namespace(f"ns-{rv}", rv))
+    assert watcher.closed
+    assert drain(watcher) == [(None, "ns-14"), (None, "ns-15"), None]
+    assert cache.status()["watchers"] == 0
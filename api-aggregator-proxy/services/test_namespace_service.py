@@ -0,0 +1,106 @@
+import base64
+import json
+
+import pytest
+from kubernetes.client import V1Namespace, V1ObjectMeta
+
+from services.namespace_service import decode_continue, encode_continue, list_items, paginate
+from services.table import namespace_row
+
+
+def namespaces(*names):
+    return [V1Namespace(metadata=V1ObjectMeta(name=name)) for name in sorted(names)]
+
+
+def names(page):
+    return [ns.metadata.name for ns in page]
+
+
+def token(data):
+    return base64.urlsafe_b64encode(json.dumps(data).encode()).decode()
+
+
+def test_continue_round_trip():
+    assert decode_continue(encode_continue("42", "team-a")) == "team-a"
+
+
+@pytest.mark.parametrize("bad", [
+    "",
+    "not base64!",
+    base64.urlsafe_b64encode(b"not json").decode(),
+    token({"v": "meta.k8s.io/v1"}),
+    token({"v": "meta.k8s.io/v2", "rv": "1", "start": "a"}),
+    token({"v": "meta.k8s.io/v1", "rv": "1", "start": 3}),
+])
+def test_decode_invalid(bad):
+    with pytest.raises(ValueError):
+        decode_continue(bad)
+
+
+# (namespaces, limit, continue after, page, has next page, remaining)
+PAGE_CASES = [
+    (["a", "b", "c"], 0, None, ["a", "b", "c"], False, None),
+    (["a", "b", "c"], 3, None, ["a", "b", "c"], False, None),
+    (["a", "b", "c"], 5, None, ["a", "b", "c"], False, None),
+    (["a", "b", "c"], 2, None, ["a", "b"], True, 1),
+    (["a", "b", "c"], 2, "b", ["c"], False, None),
+    (["a", "b", "c", "d", "e"], 2, "b", ["c", "d"], True, 1),
+    ([], 2, None, [], False, None),
+    (["a", "b"], 2, "b", [], False, None),
+]
+
+
+@pytest.mark.parametrize("items, limit, after, page, more, remaining", PAGE_CASES)
+def test_paginate(items, limit, after, page, more, remaining):
+    start = encode_continue("1", after) if after else None
+    result, next_token, left = paginate(namespaces(*items), limit, start, "1")
+    assert names(result) == page
+    assert (next_token is not None) is more
+    assert left == remaining
+    if more:
+        assert decode_continue(next_token) == page[-1]
+
+
+# (namespaces on the first page, namespaces when the next page is read, names read in total)
+CHANGE_CASES = [
+    # The continue token holds the last name, not an offset: deleting a
+    # namespace already returned does not skip one on the next page
+    (["a", "b", "c", "d"], ["b", "c", "d"], ["a", "b", "c", "d"]),
+    # Nor does deleting the last one returned
+    (["a", "b", "c", "d"], ["a", "c", "d"], ["a", "b", "c", "d"]),
+    # A namespace deleted before its page is read is not returned
+    (["a", "b", "c", "d"], ["a", "b", "d"], ["a", "b", "d"]),
+    # One created before the token's name is not returned, nor repeats any
+    (["b", "c", "d"], ["a", "b", "c", "d"], ["b", "c", "d"]),
+    # One created after it is
+    (["a", "b", "d"], ["a", "b", "c", "d"], ["a", "b", "c", "d"]),
+]
+
+
+@pytest.mark.parametrize("before, after, read", CHANGE_CASES)
+def test_paginate_across_changes(before, after, read):
+    page, next_token, _ = paginate(namespaces(*before), 2, None, "1")
+    seen = names(page)
+    current = namespaces(*after)
+    while next_token:
+        page, next_token, _ = paginate(current, 2, next_token, "2")
+        seen += names(page)
+    assert seen == read
+
+
+# (namespaces, placeholder, names listed)
+LIST_CASES = [
+    (["a", "b"], True, ["a", "b"]),
+    (["a", "b"], False, ["a", "b"]),
+    ([], True, ["No namespaces found for team 'x' (user 'x-admin')"]),
+    # A labelSelector or paging that matches nothing gives an empty list
+    ([], False, []),
+]
+
+
+@pytest.mark.parametrize("items, placeholder, listed", LIST_CASES)
+def test_list_items(items, placeholder, listed):
+    found = list(list_items(namespaces(*items), "x", "x-admin", placeholder))
+    assert [ns["metadata"]["name"] for ns in found] == listed
+    # Table rows are built from the same items
+    assert [row["cells"][0] for row in map(namespace_row, found)] == listed
@@ -0,0 +1,13 @@
+def negotiate(accept, as_kind, group, versions):
+    """The first of versions that an Accept header asks for as_kind of
+    group in, through a media range like kubectl's
+    "application/json;as=Table;v=v1;g=meta.k8s.io", or None if the header
+    only accepts plain JSON (or nothing this server serves)."""
+    for media_range in (accept or "").split(","):
+        media_type, *params = [p.strip() for p in media_range.split(";")]
+        if media_type not in ("application/json", "application/*", "*/*"):
+            continue
+        params = dict(p.split("=", 1) for p in params if "=" in p)
+        if params.get("as") == as_kind and params.get("g") == group and params.get("v") in versions:
+            return params["v"]
+    return None
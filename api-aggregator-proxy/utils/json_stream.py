@@ -0,0 +1,26 @@
+import json
+
+# Items serialized per chunk written to the client
+CHUNK_ITEMS = 100
+
+
+def stream_list(head, key, items, chunk_items=CHUNK_ITEMS):
+    """Serialize head with items appended under key, chunk by chunk, so a
+    large list is never held in memory as one document and the first
+    bytes go out before the last item is formatted. items may be any
+    iterable, including a generator."""
+    prefix = json.dumps(head, separators=(",", ":"))[:-1]
+    if head:
+        prefix += ","
+    yield prefix + json.dumps(key) + ":["
+
+    chunk = []
+    first = True
+    for item in items:
+        chunk.append(json.dumps(item, separators=(",", ":")))
+        if len(chunk) >= chunk_items:
+            yield ("" if first else ",") + ",".join(chunk)
+            chunk, first = [], False
+    if chunk:
+        yield ("" if first else ",") + ",".join(chunk)
+    yield "]}"
@@ -0,0 +1,22 @@
+import hashlib
+import json
+
+from flask import Response, request
+
+
+class StaticDocument:
+    """A JSON document serialized once, at startup, and served with a
+    strong ETag (the SHA-256 of the body). A request whose If-None-Match
+    holds the ETag gets an empty 304 Not Modified, so the kube-apiserver
+    aggregator's periodic polling costs a header comparison."""
+
+    def __init__(self, document, content_type="application/json"):
+        self.body = json.dumps(document, separators=(",", ":"), sort_keys=True).encode()
+        self.hash = hashlib.sha256(self.body).hexdigest()
+        self.content_type = content_type
+
+    def response(self, cache_control="no-cache, private"):
+        resp = Response(self.body, 200, content_type=self.content_type)
+        resp.set_etag(self.hash)
+        resp.headers["Cache-Control"] = cache_control
+        return resp.make_conditional(request)
@@ -0,0 +1,91 @@
+from celpy import json_to_cel
+from celpy import celtypes
+
+
+class RequestActivation:
+    """CEL variables for a single admission request.
+
+    ``object``, ``oldObject``, ``request``, ``userInfo`` and
+    ``namespaceObject`` are converted to CEL values on first use and then
+    shared by every rule evaluated for the request. ``request`` reuses the
+    converted objects rather than converting them a second time."""
+
+    def __init__(self, req, namespace_object=None):
+        self.req = req
+        self.namespace_object = namespace_object
+        self._converted = {}
+        self._sources = {
+            "object": self._object,
+            "oldObject": self._old_object,
+            "request": self._request,
+            "userInfo": self._user_info,
+            "namespaceObject": lambda: json_to_cel(self.namespace_object),
+        }
+
+    def __contains__(self, name):
+        return name in self._sources
+
+    def get(self, name):
+        if name not in self._converted:
+            self._converted[name] = self._sources[name]()
+        return self._converted[name]
+
+    def _request_object(self):
+        if "_requestObject" not in self._converted:
+            self._converted["_requestObject"] = json_to_cel(self.req.get("object"))
+        return self._converted["_requestObject"]
+
+    def _object(self):
+        obj = self._request_object()
+        return obj if obj is not None else self.get("oldObject")
+
+    def _old_object(self):
+        return json_to_cel(self.req.get("oldObject"))
+
+    def _user_info(self):
+        return json_to_cel(self.req.get("userInfo", {}))
+
+    def _request(self):
+        converted = celtypes.MapType()
+        for key, value in self.req.items():
+            if key == "object":
+                converted[celtypes.StringType(key)] = self._request_object()
+            elif key == "oldObject":
+                converted[celtypes.StringType(key)] = self.get("oldObject")
+            elif key == "userInfo":
+                converted[celtypes.StringType(key)] = self.get("userInfo")
+            else:
+                converted[celtypes.StringType(key)] = json_to_cel(value)
+        return converted
+
+    def for_policy(self, namespace, scope, params=None):
+        return PolicyActivation(self, {
+            "namespace": celtypes.StringType(namespace) if namespace else None,
+            "policyScope": celtypes.StringType(scope),
+        }, params)
+
+
+class PolicyActivation:
+    """Policy-specific variables layered over a shared RequestActivation.
+    ``params`` is converted only if one of the policy's rules reads it."""
+
+    __slots__ = ("request_activation", "policy_vars", "params", "_params")
+
+    def __init__(self, request_activation, policy_vars, params=None):
+        self.request_activation = request_activation
+        self.policy_vars = policy_vars
+        self.params = params
+        self._params = None
+
+    def variables(self, identifiers):
+        context = {}
+        for name in identifiers:
+            if name in self.policy_vars:
+                context[name] = self.policy_vars[name]
+            elif name == "params":
+                if self._params is None and self.params is not None:
+                    self._params = json_to_cel(self.params)
+                context[name] = self._params
+            elif name in self.request_activation:
+                context[name] = self.request_activation.get(name)
+        return context
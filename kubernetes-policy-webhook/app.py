@@ -1,11 +1,36 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 import logging
 import json
 import base64
-import copy
+import os
 from kubernetes import client, config
 from celpy import Environment
 
+from cel_programs import PolicyCompiler, ProgramCache
+from context_cache import ContextCache
+from evaluator import EvaluationEngine
+from json_patch import Mutation
+import metrics
+from policy_cache import (
+    CLUSTER_MUTATE_PLURAL,
+    CLUSTER_VALIDATE_PLURAL,
+    NAMESPACE_MUTATE_PLURAL,
+    NAMESPACE_VALIDATE_PLURAL,
+    POLICY_GROUP,
+    POLICY_VERSION,
+    PolicyCache,
+)
+from policy_index import PolicyIndex
+from policy_snapshot import (
+    DEFAULT_SNAPSHOT_PATH,
+    SnapshotContextSource,
+    SnapshotPolicySource,
+    context_path,
+    heartbeat_path,
+)
+from rule_stats import RuleStats
+from verdict_cache import VerdictCache
+
 # ------------------------
 # Logging
 # ------------------------
@@ -28,61 +53,93 @@ except Exception:
     logger.info("Loaded kubeconfig")
 
 custom_api = client.CustomObjectsApi()
+core_api = client.CoreV1Api()
 
 # ------------------------
 # Constants
 # ------------------------
-POLICY_GROUP = "policy.example.com"
-POLICY_VERSION = "v1"
+CEL_PROGRAM_CACHE_SIZE = int(os.environ.get("CEL_PROGRAM_CACHE_SIZE", 1024))
+
+# One pool worker per server thread by default, so no admission waits for a
+# worker while another request's rules run
+CEL_EVAL_WORKERS = int(os.environ.get("CEL_EVAL_WORKERS") or os.environ.get("WEB_THREADS", 4))
+CEL_RULE_BUDGET_MS = int(os.environ.get("CEL_RULE_BUDGET_MS", 100))
+CEL_REQUEST_BUDGET_MS = int(os.environ.get("CEL_REQUEST_BUDGET_MS", 3000))
+CEL_BUDGET_ACTION = os.environ.get("CEL_BUDGET_ACTION", "deny").lower()
+# "adaptive" runs cheap, often failing enforce rules first; "declared" keeps policy order
+CEL_RULE_ORDER = os.environ.get("CEL_RULE_ORDER", "adaptive").lower()
+
+VERDICT_CACHE_ENABLED = os.environ.get("VERDICT_CACHE_ENABLED", "false").lower() == "true"
+VERDICT_CACHE_SIZE = int(os.environ.get("VERDICT_CACHE_SIZE", 4096))
+VERDICT_CACHE_TTL_SECONDS = int(os.environ.get("VERDICT_CACHE_TTL_SECONDS", 30))
+
+# "watch" runs the informers in this process; "snapshot" (set by gunicorn.conf.py)
+# reads the policies published by the loader process the gunicorn master forked
+POLICY_SOURCE = os.environ.get("POLICY_SOURCE", "watch").lower()
+POLICY_SNAPSHOT_PATH = os.environ.get("POLICY_SNAPSHOT_PATH", DEFAULT_SNAPSHOT_PATH)
 
-CLUSTER_MUTATE_PLURAL = "clustercelmutationpolicies"
-NAMESPACE_MUTATE_PLURAL = "namespacecelmutationpolicies"
+cel_env = Environment()
+cel_programs = ProgramCache(cel_env, max_size=CEL_PROGRAM_CACHE_SIZE)
+rule_stats = RuleStats() if CEL_RULE_ORDER == "adaptive" else None
 
-CLUSTER_VALIDATE_PLURAL = "clustercelvalidationpolicies"
-NAMESPACE_VALIDATE_PLURAL = "namespacecelvalidationpolicies"
+# ------------------------
+# Policy and context caches
+# ------------------------
+# The context cache holds namespaceObject and params for CEL rules; both are
+# started below. With a snapshot, the loader runs their informers.
+if POLICY_SOURCE == "snapshot":
+    policy_cache = SnapshotPolicySource(POLICY_SNAPSHOT_PATH, cel_programs)
+    context_cache = SnapshotContextSource(context_path(POLICY_SNAPSHOT_PATH), heartbeat_path(POLICY_SNAPSHOT_PATH))
+else:
+    policy_cache = PolicyCache(
+        custom_api,
+        POLICY_GROUP,
+        POLICY_VERSION,
+        cluster_plurals=[CLUSTER_MUTATE_PLURAL, CLUSTER_VALIDATE_PLURAL],
+        namespace_plurals=[NAMESPACE_MUTATE_PLURAL, NAMESPACE_VALIDATE_PLURAL],
+    )
+    context_cache = ContextCache(
+        client.ApiClient(), core_api, custom_api, [CLUSTER_VALIDATE_PLURAL, NAMESPACE_VALIDATE_PLURAL]
+    )
 
-cel_env = Environment()
+# Started before the informers so pool workers fork from a single thread
+evaluation_engine = EvaluationEngine(
+    cel_programs,
+    workers=CEL_EVAL_WORKERS,
+    rule_budget=CEL_RULE_BUDGET_MS / 1000,
+    request_budget=CEL_REQUEST_BUDGET_MS / 1000,
+    budget_action=CEL_BUDGET_ACTION,
+    program_cache_size=CEL_PROGRAM_CACHE_SIZE,
+    rule_stats=rule_stats,
+    context=context_cache,
+)
+if POLICY_SOURCE == "snapshot":
+    # Pool workers start with the programs the loader already parsed
+    policy_cache.preload_programs()
+evaluation_engine.start()
+
+policy_compiler = PolicyCompiler(cel_programs, [CLUSTER_VALIDATE_PLURAL, NAMESPACE_VALIDATE_PLURAL])
+mutate_index = PolicyIndex(CLUSTER_MUTATE_PLURAL, NAMESPACE_MUTATE_PLURAL)
+validate_index = PolicyIndex(CLUSTER_VALIDATE_PLURAL, NAMESPACE_VALIDATE_PLURAL)
+policy_cache.add_listener(policy_compiler.on_policy_change)
+policy_cache.add_listener(mutate_index.on_policy_change)
+policy_cache.add_listener(validate_index.on_policy_change)
+policy_cache.add_listener(context_cache.on_policy_change)
+
+verdict_cache = None
+if VERDICT_CACHE_ENABLED:
+    verdict_cache = VerdictCache(cel_programs, max_size=VERDICT_CACHE_SIZE, ttl=VERDICT_CACHE_TTL_SECONDS)
+    # Must run after the index listener, see VerdictCache
+    policy_cache.add_listener(verdict_cache.on_policy_change)
+    # Rules may read params, which are not part of the cache key
+    context_cache.add_listener(verdict_cache.on_policy_change)
+
+context_cache.start()
+policy_cache.start()
 
 # ------------------------
 # Helper functions
 # ------------------------
-def list_cluster_policies(plural):
-    try:
-        return custom_api.list_cluster_custom_object(
-            POLICY_GROUP,
-            POLICY_VERSION,
-            plural
-        )["items"]
-    except client.exceptions.ApiException as e:
-        if e.status == 404:
-            logger.warning(f"Cluster policy CRD '{plural}' not found")
-            return []
-        raise
-
-def list_namespace_policies(namespace, plural):
-    if not namespace:
-        return []
-
-    try:
-        return custom_api.list_namespaced_custom_object(
-            POLICY_GROUP,
-            POLICY_VERSION,
-            namespace,
-            plural
-        )["items"]
-    except client.exceptions.ApiException as e:
-        if e.status == 404:
-            logger.warning(f"Namespace policy CRD '{plural}' not found")
-            return []
-        raise
-
-def generate_patch(original, modified):
-    patch = []
-    for k, v in modified.get("metadata", {}).get("labels", {}).items():
-        orig_val = original.get("metadata", {}).get("labels", {}).get(k)
-        if orig_val != v:
-            patch.append({"op": "add" if orig_val is None else "replace", "path": f"/metadata/labels/{k}", "value": v})
-    return patch
 
 def allow(uid, warnings=None):
     resp = {
@@ -107,48 +164,37 @@ def deny(uid, message):
             "status": {"message": str(message)}
         }
     }
+    g.admission_outcome = "denied"
     logger.info(f"Denying request: {message}")
     return jsonify(resp)
 
-def eval_cel(expression, context):
-    try:
-        ast = cel_env.compile(expression)
-        program = cel_env.program(ast)
-        return program.evaluate(context)
-    except Exception as e:
-        logger.error(f"CEL evaluation error: {e}")
-        return False
-
 # ------------------------
 # Mutating webhook
 # ------------------------
 @app.route("/mutate", methods=["POST"])
+@metrics.timed_admission("mutate")
 def mutate():
     review = request.get_json()
     req = review["request"]
     uid = req["uid"]
     obj = req.get("object") or req.get("oldObject")
     namespace = obj.get("metadata", {}).get("namespace") if obj else None
-    original_obj = copy.deepcopy(obj)
+    mutation = Mutation(obj)
 
-    # Load policies
-    policies = list_cluster_policies(CLUSTER_MUTATE_PLURAL)
-    policies += list_namespace_policies(namespace, NAMESPACE_MUTATE_PLURAL)
+    with metrics.POLICY_LOOKUP_SECONDS.labels("mutate").time():
+        matched = mutate_index.lookup(req["kind"]["kind"], req["operation"], namespace)
 
     # Apply labels
-    for policy in policies:
+    debug = logger.isEnabledFor(logging.DEBUG)
+    for _, policy in matched:
         spec = policy.get("spec", {})
-        match = spec.get("match", {})
-        if req["kind"]["kind"] not in match.get("resources", []):
-            continue
-        if req["operation"] not in match.get("operations", []):
-            continue
         labels = spec.get("labels", {})
         for k, v in labels.items():
-            obj.setdefault("metadata", {}).setdefault("labels", {})[k] = v
-            logger.info(f"Applied label: {k}={v}")
+            mutation.set(("metadata", "labels", k), v)
+            if debug:
+                logger.debug(f"Applied label: {k}={v}")
 
-    patch = generate_patch(original_obj, obj)
+    patch = mutation.patch()
     if patch:
         return jsonify({
             "apiVersion": "admission.k8s.io/v1",
@@ -166,6 +212,7 @@ def mutate():
 # Validating webhook
 # ------------------------
 @app.route("/validate", methods=["POST"])
+@metrics.timed_admission("validate")
 def validate():
     review = request.get_json()
     req = review["request"]
@@ -178,59 +225,44 @@ def validate():
     namespace = obj.get("metadata", {}).get("namespace") if obj else None
     name = obj.get("metadata", {}).get("name") if obj else None
 
-    warnings = []
-
-    logger.info(
-        f"Admission request: user={user.get('username')} "
-        f"groups={user.get('groups')} "
-        f"operation={operation} kind={kind} "
-        f"namespace={namespace} name={name}"
-    )
-
-    policies = []
-    for p in list_cluster_policies(CLUSTER_VALIDATE_PLURAL):
-        p["_scope"] = "cluster"
-        policies.append(p)
-    for p in list_namespace_policies(namespace, NAMESPACE_VALIDATE_PLURAL):
-        p["_scope"] = "namespace"
-        policies.append(p)
-
-    for policy in policies:
-        spec = policy.get("spec", {})
-        match = spec.get("match", {})
-
-        if kind not in match.get("resources", []):
-            continue
-        if operation not in match.get("operations", []):
-            continue
-        if policy["_scope"] == "namespace" and namespace != policy["metadata"]["namespace"]:
-            continue
-
-        context = {
-            "object": obj,
-            "request": req,
-            "params": None,
-            "namespace": namespace if policy["_scope"] == "namespace" else None,
-            "policyScope": policy["_scope"]
-        }
-
-        for rule in spec.get("validations", []):
-            logger.info(f"Evaluating policy={policy['metadata']['name']} scope={policy['_scope']} rule={rule['expression']}")
-            ok = eval_cel(rule["expression"], context)
-
-            if not ok:
-                message = eval_cel(rule.get("messageExpression", '"validation failed"'), context)
-                logger.info(f"Rule failed: policy={policy['metadata']['name']} scope={policy['_scope']} enforcement={rule['enforcement']} message={message}")
-
-                if rule["enforcement"] == "enforce":
-                    return deny(uid, message)
-                elif rule["enforcement"] == "warn":
-                    warnings.append(message)
-
-    if warnings:
-        logger.info(f"Warnings for {kind} {name}: {warnings}")
-
-    logger.info(f"Allowing {kind} {name} in namespace {namespace}")
+    verbose = logger.isEnabledFor(logging.INFO)
+    if verbose:
+        logger.info(
+            f"Admission request: user={user.get('username')} "
+            f"groups={user.get('groups')} "
+            f"operation={operation} kind={kind} "
+            f"namespace={namespace} name={name}"
+        )
+
+    # Read before the lookup, see VerdictCache.key
+    generation = verdict_cache.generation if verdict_cache else None
+    with metrics.POLICY_LOOKUP_SECONDS.labels("validate").time():
+        matched = validate_index.lookup(kind, operation, namespace)
+
+    # Read once so the cache key and the evaluation see the same object
+    namespace_object = context_cache.namespace_object(namespace)
+    verdict = None
+    if verdict_cache:
+        cache_key = verdict_cache.key(req, kind, operation, namespace, matched, generation, namespace_object)
+        verdict = verdict_cache.get(cache_key)
+
+    if verdict is None:
+        verdict = evaluation_engine.evaluate(req, matched, namespace, namespace_object)
+        metrics.observe_timings(verdict.timings)
+        if verdict_cache:
+            verdict_cache.put(cache_key, verdict, generation)
+    elif verbose:
+        logger.info(f"Verdict cache hit for {kind} {name}")
+
+    warnings = verdict.warnings
+
+    if not verdict.allowed:
+        return deny(uid, verdict.message)
+
+    if verbose:
+        if warnings:
+            logger.info(f"Warnings for {kind} {name}: {warnings}")
+        logger.info(f"Allowing {kind} {name} in namespace {namespace}")
     return allow(uid, warnings)
 
 @app.route("/health", methods=["GET"])
@@ -239,6 +271,29 @@ def health():
         "status": "ok"
     }), 200
 
+@app.route("/ready", methods=["GET"])
+def ready():
+    synced = policy_cache.has_synced() and context_cache.has_synced()
+    return jsonify({
+        "status": "ok" if synced else "syncing",
+        "policies": policy_cache.status(),
+        "context": context_cache.status()
+    }), 200 if synced else 503
+
+@app.route("/stats", methods=["GET"])
+def stats():
+    return jsonify({
+        "celPrograms": cel_programs.stats(),
+        "compileErrors": policy_compiler.errors,
+        "verdictCache": verdict_cache.stats() if verdict_cache else None,
+        "ruleStats": rule_stats.stats() if rule_stats else None
+    }), 200
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
 # ------------------------
 # Main
 # ------------------------
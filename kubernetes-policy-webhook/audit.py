@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""Audit existing cluster objects against the validation policies.
+
+Pages through every kind referenced by a validation policy with
+limit/continue, evaluates the applicable rules with the same engine as
+/validate and writes one JSON line per violation. Only one page of
+objects is held in memory at a time.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+from celpy import Environment
+from kubernetes import client, config, dynamic
+
+from cel_programs import PolicyCompiler, ProgramCache
+from context_cache import ContextCache
+from evaluator import EvaluationEngine
+from policy_cache import (
+    CLUSTER_VALIDATE_PLURAL,
+    NAMESPACE_VALIDATE_PLURAL,
+    POLICY_GROUP,
+    POLICY_VERSION,
+    PolicyCache,
+)
+from policy_index import PolicyIndex
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("k8s-admission-webhook")
+
+SERVICE_ACCOUNT_NAMESPACE_FILE = "/var/run/secrets/kubernetes.io/serviceaccount/namespace"
+
+
+def audit_user():
+    """userInfo of the audit requests: the service account the audit runs
+    as, from the POD_NAMESPACE and SERVICE_ACCOUNT env vars (set by the
+    CronJob from the downward API)."""
+    namespace = os.environ.get("POD_NAMESPACE")
+    if not namespace:
+        try:
+            with open(SERVICE_ACCOUNT_NAMESPACE_FILE) as f:
+                namespace = f.read().strip()
+        except OSError:
+            namespace = "default"
+    name = os.environ.get("SERVICE_ACCOUNT", "default")
+    return {
+        "username": f"system:serviceaccount:{namespace}:{name}",
+        "groups": ["system:serviceaccounts", f"system:serviceaccounts:{namespace}", "system:authenticated"],
+    }
+
+
+AUDIT_USER = audit_user()
+
+
+# ------------------------
+# Resource discovery and paging
+# ------------------------
+def audited_kinds(policy_cache):
+    kinds = set()
+    for plural in (CLUSTER_VALIDATE_PLURAL, NAMESPACE_VALIDATE_PLURAL):
+        for policy in policy_cache.informers[plural].list():
+            kinds.update(policy.get("spec", {}).get("match", {}).get("resources", []))
+    return sorted(kinds)
+
+
+def resolve_resource(dyn, kind):
+    candidates = [
+        r for r in dyn.resources.search(kind=kind)
+        if "/" not in r.name and "list" in (r.verbs or [])
+    ]
+    preferred = [r for r in candidates if getattr(r, "preferred", False)]
+    return (preferred or candidates or [None])[0]
+
+
+def iter_pages(resource, limit):
+    token = None
+    while True:
+        page = resource.get(limit=limit, _continue=token).to_dict()
+        yield page.get("items", [])
+        token = page.get("metadata", {}).get("continue")
+        if not token:
+            return
+
+
+def admission_request(obj, resource, kind, operation):
+    meta = obj.get("metadata", {})
+    group_version = {"group": resource.group or "", "version": resource.api_version}
+    obj.setdefault("apiVersion", resource.group_version)
+    obj.setdefault("kind", kind)
+    return {
+        "uid": f"audit-{meta.get('uid', '')}",
+        "kind": {**group_version, "kind": kind},
+        "resource": {**group_version, "resource": resource.name},
+        "name": meta.get("name"),
+        "namespace": meta.get("namespace"),
+        "operation": operation,
+        "userInfo": AUDIT_USER,
+        "object": obj,
+        "oldObject": None,
+        "dryRun": True,
+    }
+
+
+# ------------------------
+# Auditor
+# ------------------------
+class Auditor:
+    def __init__(self, dyn, index, engine, report, operation="CREATE", page_size=500, batch_size=50):
+        self.dyn = dyn
+        self.index = index
+        self.engine = engine
+        self.report = report
+        self.operation = operation
+        self.page_size = page_size
+        self.batch_size = batch_size
+
+    def _write(self, record):
+        self.report.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+    def audit_kind(self, kind):
+        counts = {"scanned": 0, "evaluated": 0, "violations": 0, "denied": 0}
+        resource = resolve_resource(self.dyn, kind)
+        if resource is None:
+            logger.warning(f"Audit: no listable resource found for kind {kind}")
+            return counts
+
+        try:
+            for items in iter_pages(resource, self.page_size):
+                requests = []
+                for obj in items:
+                    req = admission_request(obj, resource, kind, self.operation)
+                    matched = self.index.lookup(kind, self.operation, req["namespace"])
+                    if matched:
+                        requests.append((req, matched, req["namespace"]))
+                counts["scanned"] += len(items)
+                counts["evaluated"] += len(requests)
+
+                verdicts = self.engine.evaluate_many(requests, self.batch_size)
+                for (req, _, _), verdict in zip(requests, verdicts):
+                    if not verdict.allowed:
+                        counts["denied"] += 1
+                    for violation in verdict.violations:
+                        counts["violations"] += 1
+                        self._write({
+                            "type": "violation",
+                            "kind": kind,
+                            "namespace": req["namespace"],
+                            "name": req["name"],
+                            **violation,
+                        })
+                    if not verdict.cacheable:
+                        # A budget overrun is not a policy violation but must not pass silently
+                        self._write({
+                            "type": "error",
+                            "kind": kind,
+                            "namespace": req["namespace"],
+                            "name": req["name"],
+                            "message": verdict.message or "; ".join(verdict.warnings) or "evaluation budget exceeded",
+                        })
+                self.report.flush()
+        except client.exceptions.ApiException as e:
+            # An expired continue token (410) ends this kind with a partial result
+            logger.error(f"Audit: listing {kind} failed after {counts['scanned']} objects: {e.status} {e.reason}")
+            counts["error"] = f"{e.status} {e.reason}"
+        return counts
+
+    def run(self, kinds):
+        started = time.monotonic()
+        summary = {}
+        for kind in kinds:
+            summary[kind] = self.audit_kind(kind)
+            logger.info(f"Audit: {kind}: {summary[kind]}")
+        self._write({"type": "summary", "seconds": round(time.monotonic() - started, 3), "kinds": summary})
+        self.report.flush()
+        return summary
+
+
+# ------------------------
+# Main
+# ------------------------
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", help="violation report (JSON lines), default stdout")
+    parser.add_argument("--kinds", help="comma separated kinds, default every kind referenced by a policy")
+    parser.add_argument("--operation", default="CREATE", help="operation to match policies against")
+    parser.add_argument("--page-size", type=int, default=int(os.environ.get("AUDIT_PAGE_SIZE", 500)))
+    parser.add_argument("--batch-size", type=int, default=int(os.environ.get("AUDIT_BATCH_SIZE", 50)))
+    parser.add_argument("--interval", type=int, default=0, help="repeat every N seconds (0 runs once)")
+    args = parser.parse_args()
+
+    # Forked before any informer thread exists
+    programs = ProgramCache(Environment(), max_size=int(os.environ.get("CEL_PROGRAM_CACHE_SIZE", 1024)))
+    engine = EvaluationEngine(
+        programs,
+        workers=int(os.environ.get("CEL_EVAL_WORKERS", 2)),
+        rule_budget=int(os.environ.get("CEL_RULE_BUDGET_MS", 100)) / 1000,
+        request_budget=int(os.environ.get("CEL_REQUEST_BUDGET_MS", 3000)) / 1000,
+        budget_action=os.environ.get("CEL_BUDGET_ACTION", "deny").lower(),
+    )
+    engine.start()
+
+    try:
+        config.load_incluster_config()
+    except Exception:
+        config.load_kube_config()
+    api_client = client.ApiClient()
+    custom_api = client.CustomObjectsApi(api_client)
+    context = ContextCache(
+        api_client, client.CoreV1Api(api_client), custom_api, [CLUSTER_VALIDATE_PLURAL, NAMESPACE_VALIDATE_PLURAL]
+    )
+    engine.context = context
+
+    policy_cache = PolicyCache(
+        custom_api,
+        POLICY_GROUP,
+        POLICY_VERSION,
+        cluster_plurals=[CLUSTER_VALIDATE_PLURAL],
+        namespace_plurals=[NAMESPACE_VALIDATE_PLURAL],
+    )
+    compiler = PolicyCompiler(programs, [CLUSTER_VALIDATE_PLURAL, NAMESPACE_VALIDATE_PLURAL])
+    index = PolicyIndex(CLUSTER_VALIDATE_PLURAL, NAMESPACE_VALIDATE_PLURAL)
+    policy_cache.add_listener(compiler.on_policy_change)
+    policy_cache.add_listener(index.on_policy_change)
+    policy_cache.add_listener(context.on_policy_change)
+    context.start()
+    policy_cache.start()
+    if not policy_cache.wait_for_sync(60) or not context.wait_for_sync(60):
+        logger.error("Audit: policy cache did not sync")
+        sys.exit(1)
+    if not context.wait_for_sync(60, params=True):
+        # Rules then see null params, as they would at admission time
+        logger.warning(f"Audit: params did not sync: {json.dumps(context.status()['params'])}")
+
+    report = open(args.output, "a") if args.output else sys.stdout
+    auditor = Auditor(
+        dynamic.DynamicClient(api_client), index, engine, report,
+        operation=args.operation, page_size=args.page_size, batch_size=args.batch_size,
+    )
+    try:
+        while True:
+            kinds = args.kinds.split(",") if args.kinds else audited_kinds(policy_cache)
+            auditor.run(kinds)
+            if args.interval <= 0:
+                break
+            time.sleep(args.interval)
+    finally:
+        policy_cache.stop()
+        context.stop()
+        engine.stop()
+        if report is not sys.stdout:
+            report.close()
+
+
+if __name__ == "__main__":
+    main()
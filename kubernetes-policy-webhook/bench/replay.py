@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""Replay recorded AdmissionReviews against the webhook handlers in-process.
+
+Policies are loaded from YAML files and served by a fake CRD API, so no
+cluster is needed. Reports throughput, latency percentiles and the slowest
+policies and rules, and can write the results as JSON to compare runs.
+
+    python bench/replay.py --policies example-policies --corpus bench/corpus \\
+        --iterations 200 --output results.json
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import yaml
+
+WEBHOOK_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PLURALS = {
+    "ClusterCelMutationPolicy": "clustercelmutationpolicies",
+    "NamespaceCelMutationPolicy": "namespacecelmutationpolicies",
+    "ClusterCelValidationPolicy": "clustercelvalidationpolicies",
+    "NamespaceCelValidationPolicy": "namespacecelvalidationpolicies",
+}
+
+
+# ------------------------
+# Fake CRD API
+# ------------------------
+class FakeCustomObjectsApi:
+    """Serves policy YAMLs to the webhook informers. A LIST returns every
+    loaded policy of the plural; a WATCH never delivers an event and blocks
+    the (daemon) informer thread for the rest of the run."""
+
+    def __init__(self, policies):
+        self.policies = policies
+
+    def list_cluster_custom_object(self, group, version, plural, **kwargs):
+        if kwargs.get("watch"):
+            threading.Event().wait()
+        return {
+            "metadata": {"resourceVersion": "1"},
+            "items": [p for p in self.policies if PLURALS.get(p.get("kind")) == plural],
+        }
+
+
+class FakeCoreV1Api:
+    """Serves a fixed set of Namespaces (and no ConfigMaps) the same way."""
+
+    def __init__(self, namespaces):
+        self.namespaces = namespaces
+
+    def _list(self, items, **kwargs):
+        if kwargs.get("watch"):
+            threading.Event().wait()
+        return {"metadata": {"resourceVersion": "1"}, "items": items}
+
+    def list_namespace(self, **kwargs):
+        return self._list(self.namespaces, **kwargs)
+
+    def list_namespaced_config_map(self, namespace, **kwargs):
+        return self._list([], **kwargs)
+
+
+def load_policies(directory):
+    policies = []
+    for path in sorted(glob.glob(os.path.join(directory, "**", "*.y*ml"), recursive=True)):
+        with open(path) as f:
+            for doc in yaml.safe_load_all(f):
+                if doc and doc.get("kind") in PLURALS:
+                    meta = doc.setdefault("metadata", {})
+                    meta.setdefault("resourceVersion", "1")
+                    meta.setdefault("generation", 1)
+                    policies.append(doc)
+    return policies
+
+
+def load_corpus(directory):
+    reviews = []
+    for path in sorted(glob.glob(os.path.join(directory, "**", "*.json"), recursive=True)):
+        with open(path) as f:
+            data = json.load(f)
+        for review in data if isinstance(data, list) else [data]:
+            if review.get("request"):
+                reviews.append(review)
+    return reviews
+
+
+def corpus_namespaces(reviews):
+    names = {review["request"].get("namespace") for review in reviews} - {None}
+    return [
+        {"metadata": {"name": name, "resourceVersion": "1", "labels": {"kubernetes.io/metadata.name": name}}}
+        for name in sorted(names)
+    ]
+
+
+def load_webhook(policies, namespaces=()):
+    """Import app.py with the Kubernetes client pointed at the fake API."""
+    from kubernetes import client, config
+
+    fake = FakeCustomObjectsApi(policies)
+    fake_core = FakeCoreV1Api(list(namespaces))
+    config.load_incluster_config = lambda: None
+    client.CustomObjectsApi = lambda *args, **kwargs: fake
+    client.CoreV1Api = lambda *args, **kwargs: fake_core
+
+    sys.path.insert(0, WEBHOOK_DIR)
+    import app as webhook
+
+    if not webhook.policy_cache.wait_for_sync(30):
+        raise RuntimeError("policy cache did not sync")
+    return webhook
+
+
+# ------------------------
+# Statistics
+# ------------------------
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(p / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def summarize(latencies, wall_seconds):
+    values = sorted(latencies)
+    return {
+        "requests": len(values),
+        "throughput": len(values) / wall_seconds if wall_seconds else 0.0,
+        "meanMs": sum(values) / len(values) * 1000 if values else 0.0,
+        "p50Ms": percentile(values, 50) * 1000,
+        "p90Ms": percentile(values, 90) * 1000,
+        "p99Ms": percentile(values, 99) * 1000,
+        "maxMs": values[-1] * 1000 if values else 0.0,
+    }
+
+
+class RuleRecorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.rules = {}
+
+    def __call__(self, timing):
+        key = (timing.policy, timing.scope, timing.expression)
+        with self._lock:
+            self.rules.setdefault(key, []).append(timing.seconds)
+
+    def report(self, top):
+        rules = []
+        policies = {}
+        for (policy, scope, expression), samples in self.rules.items():
+            values = sorted(samples)
+            total = sum(values)
+            rules.append({
+                "policy": policy,
+                "scope": scope,
+                "expression": expression,
+                "evaluations": len(values),
+                "meanMs": total / len(values) * 1000,
+                "p99Ms": percentile(values, 99) * 1000,
+            })
+            entry = policies.setdefault((policy, scope), {"policy": policy, "scope": scope, "evaluations": 0, "totalMs": 0.0})
+            entry["evaluations"] += len(values)
+            entry["totalMs"] += total * 1000
+        rules.sort(key=lambda r: r["meanMs"], reverse=True)
+        ranked = sorted(policies.values(), key=lambda p: p["totalMs"], reverse=True)
+        return ranked[:top], rules[:top]
+
+
+# ------------------------
+# Replay
+# ------------------------
+def replay(webhook, reviews, endpoint, iterations, concurrency):
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    local = threading.local()
+
+    def send(review):
+        nonlocal errors
+        if not hasattr(local, "client"):
+            local.client = webhook.app.test_client()
+        started = time.perf_counter()
+        resp = local.client.post(endpoint, json=review)
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            if resp.status_code != 200:
+                errors += 1
+
+    work = [review for _ in range(iterations) for review in reviews]
+    started = time.perf_counter()
+    if concurrency <= 1:
+        for review in work:
+            send(review)
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(send, work))
+    wall = time.perf_counter() - started
+
+    result = summarize(latencies, wall)
+    result["errors"] = errors
+    return result
+
+
+def print_report(results):
+    print(f"policies={results['policies']} corpus={results['corpus']} "
+          f"iterations={results['iterations']} concurrency={results['concurrency']}")
+    for endpoint, r in results["endpoints"].items():
+        print(
+            f"{endpoint:10} {r['requests']:7d} req  {r['throughput']:9.1f} req/s  "
+            f"p50={r['p50Ms']:.2f}ms p90={r['p90Ms']:.2f}ms p99={r['p99Ms']:.2f}ms "
+            f"max={r['maxMs']:.2f}ms errors={r['errors']}"
+        )
+    if results["slowestPolicies"]:
+        print("\nslowest policies (total evaluation time):")
+        for p in results["slowestPolicies"]:
+            print(f"  {p['totalMs']:10.2f}ms  {p['evaluations']:7d} evals  {p['scope']}/{p['policy']}")
+    if results["slowestRules"]:
+        print("\nslowest rules (mean evaluation time):")
+        for r in results["slowestRules"]:
+            print(f"  {r['meanMs']:8.3f}ms  p99={r['p99Ms']:.3f}ms  {r['scope']}/{r['policy']}: {r['expression']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--policies", default=os.path.join(WEBHOOK_DIR, "example-policies"))
+    parser.add_argument("--corpus", default=os.path.join(WEBHOOK_DIR, "bench", "corpus"))
+    parser.add_argument("--endpoints", default="/mutate,/validate")
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--workers", type=int, help="CEL evaluation workers (CEL_EVAL_WORKERS)")
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--label", default="", help="free-form label stored in the results, e.g. a version")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    if args.workers is not None:
+        os.environ["CEL_EVAL_WORKERS"] = str(args.workers)
+
+    policies = load_policies(args.policies)
+    reviews = load_corpus(args.corpus)
+    if not reviews:
+        parser.error(f"no AdmissionReview JSON found in {args.corpus}")
+
+    # Set before import so forked evaluation workers inherit it
+    logging.getLogger("k8s-admission-webhook").setLevel(args.log_level.upper())
+    webhook = load_webhook(policies, corpus_namespaces(reviews))
+
+    endpoints = [e.strip() for e in args.endpoints.split(",") if e.strip()]
+    for endpoint in endpoints:
+        replay(webhook, reviews, endpoint, args.warmup, 1)
+
+    recorder = RuleRecorder()
+    webhook.evaluation_engine.add_observer(recorder)
+
+    results = {
+        "label": args.label,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "policies": len(policies),
+        "corpus": len(reviews),
+        "iterations": args.iterations,
+        "concurrency": args.concurrency,
+        "workers": webhook.evaluation_engine.workers,
+        "endpoints": {},
+    }
+    for endpoint in endpoints:
+        results["endpoints"][endpoint] = replay(webhook, reviews, endpoint, args.iterations, args.concurrency)
+    results["slowestPolicies"], results["slowestRules"] = recorder.report(args.top)
+
+    webhook.evaluation_engine.stop()
+
+    print_report(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
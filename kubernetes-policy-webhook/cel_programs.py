@@ -0,0 +1,251 @@
+import ast as pyast
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from lark import Tree
+
+from metrics import CEL_COMPILE_SECONDS
+
+logger = logging.getLogger("k8s-admission-webhook")
+
+DEFAULT_MESSAGE_EXPRESSION = '"validation failed"'
+
+
+class CelCompileError(Exception):
+    pass
+
+
+# Parse tree nodes that continue a field selection chain through children[0]
+_CHAIN_LINKS = ("member", "member_dot", "member_index", "member_dot_arg")
+
+
+def _literal(node):
+    while isinstance(node, Tree) and len(node.children) == 1 and node.data != "literal":
+        node = node.children[0]
+    if not isinstance(node, Tree) or node.data != "literal":
+        return None
+    try:
+        value = pyast.literal_eval(str(node.children[0]))
+    except (ValueError, SyntaxError):
+        return None
+    return value if isinstance(value, (str, int)) and not isinstance(value, bool) else None
+
+
+def _static_path(node):
+    data = node.data
+    if data == "member" and len(node.children) == 1:
+        return _static_path(node.children[0])
+    if data == "primary":
+        child = node.children[0]
+        if isinstance(child, Tree) and child.data == "ident":
+            return (str(child.children[0]),)
+        return None
+    if data == "member_dot":
+        base = _static_path(node.children[0])
+        return base + (str(node.children[1]),) if base else None
+    if data == "member_index":
+        base = _static_path(node.children[0])
+        key = _literal(node.children[1])
+        return base + (key,) if base and key is not None else None
+    return None
+
+
+def _read_path(node):
+    while isinstance(node, Tree):
+        path = _static_path(node)
+        if path:
+            return path
+        if node.data not in _CHAIN_LINKS:
+            return None
+        node = node.children[0]
+    return None
+
+
+def read_paths(ast):
+    """Field paths an expression reads, e.g. ('object', 'metadata', 'name').
+
+    Selections with a dynamic index or a method call are cut at the last
+    static field, so each path covers everything the expression can see."""
+    paths = set()
+
+    def visit(node, chain_base):
+        if not isinstance(node, Tree):
+            return
+        if not chain_base and (node.data in _CHAIN_LINKS or node.data == "primary"):
+            path = _read_path(node)
+            if path:
+                paths.add(path)
+        for i, child in enumerate(node.children):
+            visit(child, i == 0 and node.data in _CHAIN_LINKS)
+
+    visit(ast, False)
+    return frozenset(paths)
+
+
+class CompiledProgram:
+    """A compiled CEL program plus the identifiers and field paths it
+    references, so callers only need to bind the variables it can read."""
+
+    __slots__ = ("program", "identifiers", "paths")
+
+    def __init__(self, program, identifiers, paths):
+        self.program = program
+        self.identifiers = identifiers
+        self.paths = paths
+
+    def evaluate(self, context):
+        return self.program.evaluate(context)
+
+
+def policy_expressions(policy):
+    """Every CEL expression a validation policy can evaluate."""
+    expressions = []
+    for rule in policy.get("spec", {}).get("validations", []):
+        if rule.get("expression"):
+            expressions.append(rule["expression"])
+        expressions.append(rule.get("messageExpression", DEFAULT_MESSAGE_EXPRESSION))
+    return expressions
+
+
+class ProgramCache:
+    """Bounded LRU of compiled CEL programs keyed by (environment, expression).
+
+    Compile failures are cached as well, so a broken expression is parsed
+    once rather than on every admission request."""
+
+    def __init__(self, env, max_size=1024, env_key="default"):
+        self.env = env
+        self.env_key = env_key
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._programs = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, expression):
+        key = (self.env_key, expression)
+        with self._lock:
+            entry = self._programs.get(key)
+            if entry is not None:
+                self._programs.move_to_end(key)
+                self.hits += 1
+        if entry is None:
+            entry = self._compile(expression)
+            with self._lock:
+                self.misses += 1
+                self._programs[key] = entry
+                self._programs.move_to_end(key)
+                while len(self._programs) > self.max_size:
+                    self._programs.popitem(last=False)
+                    self.evictions += 1
+
+        program, error = entry
+        if error is not None:
+            raise CelCompileError(error)
+        return program
+
+    def _compile(self, expression):
+        started = time.perf_counter()
+        try:
+            entry = self._program(self.env.compile(expression)), None
+        except Exception as e:
+            entry = None, str(e)
+        CEL_COMPILE_SECONDS.labels("error" if entry[1] else "ok").observe(time.perf_counter() - started)
+        return entry
+
+    def _program(self, ast):
+        identifiers = frozenset(str(node.children[0]) for node in ast.find_data("ident"))
+        return CompiledProgram(self.env.program(ast), identifiers, read_paths(ast))
+
+    def expressions(self):
+        """Every expression cached for this environment, compiled or not."""
+        with self._lock:
+            return [expression for env_key, expression in self._programs if env_key == self.env_key]
+
+    def export(self, expressions):
+        """Parsed ASTs, or compile errors, for expressions as a picklable
+        {expression: (ast, error)} map that preload() accepts."""
+        exported = {}
+        for expression in expressions:
+            try:
+                exported[expression] = (self.get(expression).program.ast, None)
+            except CelCompileError as e:
+                exported[expression] = (None, str(e))
+        return exported
+
+    def preload(self, exported):
+        """Add programs parsed by another process's export() without parsing
+        them again. Expressions already cached are left alone."""
+        for expression, (ast, error) in exported.items():
+            key = (self.env_key, expression)
+            with self._lock:
+                if key in self._programs:
+                    continue
+            entry = (None, error) if error is not None else (self._program(ast), None)
+            with self._lock:
+                self._programs[key] = entry
+                while len(self._programs) > self.max_size:
+                    self._programs.popitem(last=False)
+                    self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._programs),
+                "maxSize": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+class PolicyCompiler:
+    """Precompiles validation policies as the policy cache ingests them and
+    reports compile errors once per policy generation."""
+
+    def __init__(self, programs, plurals):
+        self.programs = programs
+        self.plurals = set(plurals)
+        self._lock = threading.Lock()
+        self._reported = {}
+        self.errors = {}
+
+    def on_policy_change(self, plural, event_type, obj, old):
+        if plural not in self.plurals:
+            return
+        meta = obj.get("metadata", {})
+        key = f"{meta['namespace']}/{meta.get('name')}" if meta.get("namespace") else meta.get("name")
+        if event_type == "DELETED":
+            with self._lock:
+                self._reported.pop(key, None)
+                self.errors.pop(key, None)
+            return
+        self.compile_policy(key, obj)
+
+    def compile_policy(self, key, policy):
+        errors = []
+        for expression in policy_expressions(policy):
+            try:
+                self.programs.get(expression)
+            except CelCompileError as e:
+                errors.append({"expression": expression, "error": str(e)})
+
+        generation = policy.get("metadata", {}).get("generation")
+        with self._lock:
+            already_reported = self._reported.get(key) == generation
+            self._reported[key] = generation
+            if errors:
+                self.errors[key] = errors
+            else:
+                self.errors.pop(key, None)
+
+        if errors and not already_reported:
+            for err in errors:
+                logger.error(
+                    f"CEL compile error in policy={key} generation={generation}: "
+                    f"expression={err['expression']} error={err['error']}"
+                )
+        return errors
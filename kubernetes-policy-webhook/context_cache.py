@@ -0,0 +1,218 @@
+import logging
+import threading
+import time
+
+from kubernetes import dynamic
+
+from policy_cache import Informer
+
+logger = logging.getLogger("k8s-admission-webhook")
+
+
+# ------------------------
+# Helpers
+# ------------------------
+def param_ref(scope, policy):
+    """(apiVersion, kind, namespace, name) of the object a validation policy
+    references in spec.paramRef, or None. A namespace scoped policy's
+    reference defaults to the policy's namespace."""
+    ref = policy.get("spec", {}).get("paramRef")
+    if not ref or not ref.get("kind") or not ref.get("name"):
+        return None
+    namespace = ref.get("namespace")
+    if namespace is None and scope == "namespace":
+        namespace = policy.get("metadata", {}).get("namespace")
+    return (ref.get("apiVersion", "v1"), ref["kind"], namespace, ref["name"])
+
+
+def _split_api_version(api_version):
+    if "/" in api_version:
+        return tuple(api_version.split("/", 1))
+    return "", api_version
+
+
+# ------------------------
+# Context cache
+# ------------------------
+class ContextCache:
+    """Watch-backed caches of the objects CEL rules can read besides the
+    admission request itself: the request's Namespace (``namespaceObject``)
+    and the object a validation policy references in ``spec.paramRef``
+    (``params``).
+
+    Namespaces are mirrored by one cluster-wide informer. Param objects are
+    mirrored by one informer per (apiVersion, kind, namespace) that some
+    policy references; it is started when the first such policy appears and
+    stopped with the last. Lookups never call the API server.
+
+    Only the namespace informer gates readiness: a param informer that
+    cannot list its kind (e.g. for lack of RBAC) is reported in status()
+    and its params read as null, instead of keeping every worker unready."""
+
+    def __init__(self, api_client, core_api, custom_api, plurals):
+        self.api_client = api_client
+        self.core_api = core_api
+        self.custom_api = custom_api
+        self.plurals = set(plurals)
+        self.namespaces = Informer("namespaces", core_api.list_namespace)
+
+        self._lock = threading.Lock()
+        self._informers = {}  # (apiVersion, kind, namespace) -> Informer
+        self._users = {}  # (apiVersion, kind, namespace) -> referencing policy keys
+        self._refs = {}  # policy key -> param ref
+        self._errors = {}
+        self._listeners = []
+        self._dynamic = None
+
+    # --- lifecycle ---
+    def add_listener(self, callback):
+        """Register callback(source, event_type, obj, old_obj) for changes to
+        any param object; source is the (apiVersion, kind, namespace) key."""
+        self._listeners.append(callback)
+
+    def start(self):
+        self.namespaces.start()
+
+    def stop(self):
+        self.namespaces.stop()
+        with self._lock:
+            for informer in self._informers.values():
+                informer.stop()
+
+    def has_synced(self):
+        return self.namespaces.has_synced()
+
+    def wait_for_sync(self, timeout=None, params=False):
+        """Wait for the namespace informer and, with params, for every param
+        informer too."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            informers = [self.namespaces, *(self._informers.values() if params else ())]
+        for informer in informers:
+            remaining = None if deadline is None else max(0, deadline - time.monotonic())
+            if not informer.wait_for_sync(remaining):
+                return False
+        return True
+
+    # --- reads ---
+    def namespace_object(self, name):
+        if not name:
+            return None
+        return self.namespaces.get((None, name))
+
+    def params(self, scope, policy):
+        ref = param_ref(scope, policy)
+        if ref is None:
+            return None
+        informer = self._informers.get(ref[:3])
+        if informer is None:
+            return None
+        # Cluster scoped kinds are stored without a namespace
+        return informer.get((ref[2], ref[3])) or informer.get((None, ref[3]))
+
+    def export(self):
+        """Picklable copy of the cached objects, as published by the policy
+        loader (see policy_snapshot)."""
+        with self._lock:
+            informers = dict(self._informers)
+        return {
+            "namespaces": self.namespaces.list(),
+            "params": {source: informer.list() for source, informer in informers.items()},
+        }
+
+    # --- policy listener ---
+    def on_policy_change(self, plural, event_type, obj, old):
+        if plural not in self.plurals:
+            return
+        meta = obj.get("metadata", {})
+        key = (plural, meta.get("namespace"), meta.get("name"))
+        scope = "namespace" if meta.get("namespace") else "cluster"
+        ref = None if event_type == "DELETED" else param_ref(scope, obj)
+
+        with self._lock:
+            previous = self._refs.pop(key, None)
+            if ref is not None:
+                self._refs[key] = ref
+            if previous is not None and previous[:3] != (ref or ())[:3]:
+                self._release(previous[:3], key)
+            if ref is not None:
+                self._acquire(ref[:3], key)
+
+    def _acquire(self, source, policy_key):
+        self._users.setdefault(source, set()).add(policy_key)
+        if source in self._informers:
+            return
+        try:
+            informer = self._informer(*source)
+        except Exception as e:
+            logger.error(f"Context cache: cannot watch {source[1]} ({source[0]}) in {source[2] or 'cluster scope'}: {e}")
+            self._errors[source] = str(e)
+            return
+        self._errors.pop(source, None)
+        informer.add_listener(self._make_listener(source))
+        self._informers[source] = informer
+        informer.start()
+
+    def _release(self, source, policy_key):
+        users = self._users.get(source)
+        if users is None:
+            return
+        users.discard(policy_key)
+        if users:
+            return
+        del self._users[source]
+        self._errors.pop(source, None)
+        informer = self._informers.pop(source, None)
+        if informer is not None:
+            informer.stop()
+
+    def _informer(self, api_version, kind, namespace):
+        name = f"params-{kind.lower()}-{namespace or 'cluster'}"
+        if (api_version, kind) == ("v1", "ConfigMap"):
+            if not namespace:
+                raise ValueError("a ConfigMap paramRef needs a namespace")
+            return Informer(name, self.core_api.list_namespaced_config_map, namespace)
+
+        # Resolved once per referenced kind, off the admission path
+        if self._dynamic is None:
+            self._dynamic = dynamic.DynamicClient(self.api_client)
+        resource = self._dynamic.resources.get(api_version=api_version, kind=kind)
+        group, version = _split_api_version(api_version)
+        if not resource.namespaced:
+            return Informer(name, self.custom_api.list_cluster_custom_object, group, version, resource.name)
+        if not namespace:
+            raise ValueError(f"a {kind} paramRef needs a namespace")
+        return Informer(
+            name, self.custom_api.list_namespaced_custom_object, group, version, namespace, resource.name
+        )
+
+    def _make_listener(self, source):
+        def on_change(event_type, obj, old):
+            for callback in self._listeners:
+                callback(source, event_type, obj, old)
+        return on_change
+
+    def status(self):
+        with self._lock:
+            params = {
+                f"{kind} ({api_version}) in {namespace or 'cluster scope'}": {
+                    "synced": informer.has_synced(),
+                    "objects": len(informer),
+                    "policies": len(self._users.get((api_version, kind, namespace), ())),
+                    "lastError": informer.last_error,
+                }
+                for (api_version, kind, namespace), informer in self._informers.items()
+            }
+            for (api_version, kind, namespace), error in self._errors.items():
+                params[f"{kind} ({api_version}) in {namespace or 'cluster scope'}"] = {
+                    "synced": False, "objects": 0, "lastError": error,
+                }
+        return {
+            "namespaces": {
+                "synced": self.namespaces.has_synced(),
+                "objects": len(self.namespaces),
+                "resourceVersion": self.namespaces.resource_version,
+                "lastError": self.namespaces.last_error,
+            },
+            "params": params,
+        }
@@ -0,0 +1,445 @@
+import logging
+import multiprocessing
+import signal
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from celpy import Environment
+
+from activation import RequestActivation
+from cel_programs import DEFAULT_MESSAGE_EXPRESSION, CelCompileError, ProgramCache
+
+logger = logging.getLogger("k8s-admission-webhook")
+
+BUDGET_ACTIONS = ("allow", "deny", "warn")
+
+# Extra time the parent waits for a pool worker beyond the request budget,
+# covering pickling and scheduling.
+POOL_GRACE_SECONDS = 0.5
+# How often the parent checks whether a queued task was taken by a worker
+POOL_QUEUE_POLL_SECONDS = 0.05
+
+# Verdicts that depend on timing (budget overruns) are not cacheable.
+# violations lists every failed rule that was evaluated.
+Verdict = namedtuple(
+    "Verdict",
+    ["allowed", "message", "warnings", "cacheable", "timings", "violations"],
+    defaults=(True, (), ()),
+)
+
+# rule is the index of the rule in the policy; outcome is one of "pass", "fail" or "budget"
+RuleTiming = namedtuple("RuleTiming", ["policy", "scope", "rule", "expression", "seconds", "outcome"])
+
+
+# Default of EvaluationEngine.evaluate's namespace_object: look it up in the context
+_LOOKUP = object()
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+# ------------------------
+# Rule evaluation
+# ------------------------
+def _raise_budget_exceeded(signum, frame):
+    raise BudgetExceeded()
+
+
+def eval_cel(programs, expression, activation, budget=None):
+    """Evaluate one expression. With a budget (seconds), evaluation is
+    interrupted by SIGALRM; this is only used inside pool workers, where
+    tasks run on the main thread."""
+    try:
+        program = programs.get(expression)
+    except CelCompileError as e:
+        # Already reported when the policy was ingested
+        logger.debug(f"CEL compile error: {e}")
+        return False
+
+    if budget is not None:
+        signal.setitimer(signal.ITIMER_REAL, budget)
+    try:
+        return program.evaluate(activation.variables(program.identifiers))
+    except BudgetExceeded:
+        raise
+    except Exception as e:
+        logger.error(f"CEL evaluation error: {e}")
+        return False
+    finally:
+        if budget is not None:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+def policy_rules(scope, policy, namespace, params=None):
+    """The picklable part of a matched policy needed for evaluation."""
+    return {
+        "name": policy["metadata"]["name"],
+        "scope": scope,
+        "namespace": namespace if scope == "namespace" else None,
+        "validations": policy.get("spec", {}).get("validations", []),
+        "params": params,
+    }
+
+
+def evaluate_policies(programs, req, policies, rule_budget, request_budget, budget_action,
+                      preempt=False, exhaustive=False, order=None, namespace_object=None):
+    """Evaluate the rules of the matched policies in order. Stops at the
+    first failing enforce rule unless exhaustive, in which case every rule
+    is evaluated and reported in the verdict's violations.
+
+    order (see RuleStats.order) lists the enforce rules as (policy, rule)
+    index pairs to evaluate first; the other rules follow in declared order.
+    When an enforce rule fails, the enforce rules declared before it that
+    were skipped are evaluated too, so the deny message is the same as
+    with the declared order."""
+    activation = RequestActivation(req, namespace_object)
+    deadline = time.monotonic() + request_budget
+    warnings = []
+    timings = []
+    violations = []
+    contexts = {}
+    overran = False
+    stop = None
+
+    def over_budget(policy, rule, reason):
+        nonlocal overran
+        overran = True
+        message = f"policy {policy['name']}: rule evaluation exceeded {reason} budget"
+        logger.warning(f"{message}: expression={rule['expression']} action={budget_action}")
+        if budget_action == "deny":
+            return Verdict(False, message, warnings, False, timings, violations)
+        if budget_action == "warn":
+            warnings.append(message)
+        return None
+
+    def check(p, index):
+        """Evaluate one rule; False if it failed. Sets stop when evaluation
+        has to end because of a budget overrun."""
+        nonlocal stop
+        policy = policies[p]
+        rule = policy["validations"][index]
+        context = contexts.get(p)
+        if context is None:
+            context = contexts[p] = activation.for_policy(policy["namespace"], policy["scope"], policy.get("params"))
+
+        budget = rule.get("budgetMilliseconds", rule_budget * 1000) / 1000
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            stop = over_budget(policy, rule, "request") or Verdict(True, None, warnings, False, timings, violations)
+            return True
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Evaluating policy={policy['name']} scope={policy['scope']} rule={rule['expression']}")
+        started = time.monotonic()
+        try:
+            limit = min(budget, remaining) if preempt else None
+            ok = eval_cel(programs, rule["expression"], context, limit)
+            if not ok:
+                limit = max(deadline - time.monotonic(), 0.001) if preempt else None
+                message = eval_cel(
+                    programs, rule.get("messageExpression", DEFAULT_MESSAGE_EXPRESSION), context, limit
+                )
+        except BudgetExceeded:
+            timings.append(RuleTiming(
+                policy["name"], policy["scope"], index, rule["expression"], time.monotonic() - started, "budget"
+            ))
+            stop = over_budget(policy, rule, "rule" if budget < remaining else "request")
+            return True
+
+        elapsed = time.monotonic() - started
+        timings.append(RuleTiming(
+            policy["name"], policy["scope"], index, rule["expression"], elapsed, "pass" if ok else "fail"
+        ))
+
+        if not preempt and elapsed > budget:
+            # Without preemption the result is kept; the overrun is only reported.
+            logger.warning(f"policy {policy['name']}: rule took longer than its {budget * 1000:.0f}ms budget")
+
+        if not ok:
+            message = str(message)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Rule failed: policy={policy['name']} scope={policy['scope']} enforcement={rule.get('enforcement')} message={message}")
+            violations.append({
+                "policy": policy["name"],
+                "scope": policy["scope"],
+                "expression": rule["expression"],
+                "enforcement": rule.get("enforcement"),
+                "message": message,
+            })
+            if rule.get("enforcement") == "warn":
+                warnings.append(message)
+        return ok
+
+    def enforced(p, index):
+        return policies[p]["validations"][index].get("enforcement") == "enforce"
+
+    declared = [(p, index) for p, policy in enumerate(policies) for index in range(len(policy["validations"]))]
+    if exhaustive or order is None:
+        first, rest = [], declared
+    else:
+        first, rest = order, [rule for rule in declared if not enforced(*rule)]
+
+    done = set()
+    for rule in first:
+        done.add(rule)
+        ok = check(*rule)
+        if stop:
+            return stop
+        if not ok:
+            message = violations[-1]["message"]
+            for earlier in declared[:declared.index(rule)]:
+                if earlier in done or not enforced(*earlier):
+                    continue
+                ok = check(*earlier)
+                if stop:
+                    return stop
+                if not ok:
+                    message = violations[-1]["message"]
+                    break
+            return Verdict(False, message, warnings, not overran, timings, violations)
+
+    for rule in rest:
+        ok = check(*rule)
+        if stop:
+            return stop
+        if not ok and enforced(*rule) and not exhaustive:
+            return Verdict(False, violations[-1]["message"], warnings, not overran, timings, violations)
+
+    denied = [v for v in violations if v.get("enforcement") == "enforce"]
+    if denied:
+        return Verdict(False, denied[0]["message"], warnings, not overran, timings, violations)
+    return Verdict(True, None, warnings, not overran, timings, violations)
+
+
+# ------------------------
+# Pool worker
+# ------------------------
+_worker_programs = None
+
+
+def _worker_init(program_cache_size, programs=None):
+    global _worker_programs
+    _worker_programs = ProgramCache(Environment(), max_size=program_cache_size)
+    if programs:
+        # Parsed by the parent (see ProgramCache.export), so workers start warm
+        _worker_programs.preload(programs)
+    signal.signal(signal.SIGALRM, _raise_budget_exceeded)
+
+
+def _worker_evaluate(req, policies, rule_budget, request_budget, budget_action, order=None,
+                     namespace_object=None):
+    return evaluate_policies(
+        _worker_programs, req, policies, rule_budget, request_budget, budget_action, preempt=True,
+        order=order, namespace_object=namespace_object,
+    )
+
+
+def _worker_evaluate_batch(batch, rule_budget, request_budget, budget_action):
+    return [
+        evaluate_policies(
+            _worker_programs, req, policies, rule_budget, request_budget, budget_action,
+            preempt=True, exhaustive=True, namespace_object=namespace_object,
+        )
+        for req, policies, namespace_object in batch
+    ]
+
+
+def _noop():
+    return None
+
+
+# ------------------------
+# Engine
+# ------------------------
+class EvaluationEngine:
+    """Evaluates the matched validation policies of an admission request
+    under a per-rule and per-request time budget.
+
+    With workers > 0 evaluation runs in a process pool, so concurrent
+    admissions are not serialized on the GIL and a runaway expression can
+    be interrupted. With workers = 0 evaluation runs in-process and budgets
+    are only checked between rules.
+
+    With rule_stats, enforce rules are evaluated in the order it suggests
+    and it is fed the timing of every evaluated rule. With context (a
+    ContextCache), rules can read namespaceObject and their policy's params;
+    both are looked up here and sent along with the request."""
+
+    def __init__(self, programs, workers=0, rule_budget=0.1, request_budget=3.0,
+                 budget_action="deny", program_cache_size=1024, rule_stats=None, context=None):
+        if budget_action not in BUDGET_ACTIONS:
+            raise ValueError(f"budget action must be one of {BUDGET_ACTIONS}, got '{budget_action}'")
+        self.programs = programs
+        self.workers = workers
+        self.rule_budget = rule_budget
+        self.request_budget = request_budget
+        self.budget_action = budget_action
+        self.program_cache_size = program_cache_size
+        self.rule_stats = rule_stats
+        self.context = context
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._observers = [rule_stats.observe] if rule_stats else []
+
+    def add_observer(self, callback):
+        """Register callback(RuleTiming), called for every evaluated rule."""
+        self._observers.append(callback)
+
+    def start(self):
+        """Start the pool. Call before any background thread is started so
+        workers are forked from a single-threaded process. Workers are
+        seeded with every program already in the program cache."""
+        with self._pool_lock:
+            self._start_pool("fork")
+
+    def _start_pool(self, start_method):
+        if self.workers <= 0 or self._pool:
+            return
+        programs = self.programs.export(self.programs.expressions())
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context(start_method),
+            initializer=_worker_init,
+            initargs=(self.program_cache_size, programs),
+        )
+        # The fork context launches every worker on the first submit.
+        self._pool.submit(_noop).result()
+        logger.info(f"Started CEL evaluation pool with {self.workers} workers ({len(programs)} programs preloaded)")
+
+    def _restart(self, broken):
+        """Replace the broken pool, unless another request already has."""
+        with self._pool_lock:
+            if self._pool is not broken:
+                return
+            logger.error("CEL evaluation pool is broken, restarting it")
+            broken.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+            # Request threads are running by now, and forking a multithreaded
+            # process can copy a lock another thread holds; the forkserver
+            # forks workers from its own single-threaded process
+            self._start_pool("forkserver")
+
+    def stop(self):
+        with self._pool_lock:
+            if self._pool:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+    def evaluate(self, req, matched, namespace, namespace_object=_LOOKUP):
+        """Evaluate the matched policies. Pass namespace_object when the
+        caller has already read it (e.g. for a verdict cache key) so both
+        see the same object."""
+        if namespace_object is _LOOKUP:
+            namespace_object = self._namespace_object(namespace)
+        verdict = self._evaluate(req, matched, namespace, namespace_object)
+        for timing in verdict.timings:
+            for callback in self._observers:
+                callback(timing)
+        return verdict
+
+    def _policies(self, matched, namespace):
+        if self.context is None:
+            return [policy_rules(scope, policy, namespace) for scope, policy in matched]
+        return [
+            policy_rules(scope, policy, namespace, self.context.params(scope, policy))
+            for scope, policy in matched
+        ]
+
+    def _namespace_object(self, namespace):
+        return self.context.namespace_object(namespace) if self.context else None
+
+    def _evaluate(self, req, matched, namespace, namespace_object):
+        policies = self._policies(matched, namespace)
+        if not policies:
+            return Verdict(True, None, [])
+        order = self.rule_stats.order(policies) if self.rule_stats else None
+
+        pool = self._pool
+        if pool is None:
+            return evaluate_policies(
+                self.programs, req, policies, self.rule_budget, self.request_budget, self.budget_action,
+                order=order, namespace_object=namespace_object,
+            )
+
+        try:
+            future = pool.submit(
+                _worker_evaluate, req, policies, self.rule_budget, self.request_budget, self.budget_action,
+                order, namespace_object,
+            )
+            return self._wait(future, self.request_budget)
+        except FutureTimeoutError:
+            future.cancel()
+            return self._request_overrun()
+        except BrokenProcessPool:
+            # The request may be what broke the pool: running it here could
+            # hang or crash the serving worker
+            self._restart(pool)
+            return self._request_overrun()
+
+    @staticmethod
+    def _wait(future, budget):
+        """The result of a pool task, allowing budget (plus grace) from when
+        a worker takes it, so time queued behind other requests does not
+        count. A task is marked running when it moves to the pool's call
+        queue, where it can still wait for one task ahead of it, itself
+        bounded by the budget. Raises FutureTimeoutError on overrun."""
+        deadline = None
+        while True:
+            if deadline is None and future.running():
+                deadline = time.monotonic() + 2 * budget + POOL_GRACE_SECONDS
+            timeout = POOL_QUEUE_POLL_SECONDS if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                return future.result(timeout=timeout)
+            except FutureTimeoutError:
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise
+
+    def evaluate_many(self, requests, batch_size=50):
+        """Evaluate (req, matched, namespace) tuples exhaustively, in batches
+        spread across the pool. Returns verdicts in input order."""
+        work = [
+            (req, self._policies(matched, namespace), self._namespace_object(namespace))
+            for req, matched, namespace in requests
+        ]
+        if self._pool is None:
+            verdicts = [
+                evaluate_policies(
+                    self.programs, req, policies, self.rule_budget, self.request_budget,
+                    self.budget_action, exhaustive=True, namespace_object=namespace_object,
+                )
+                for req, policies, namespace_object in work
+            ]
+        else:
+            batches = [work[i:i + batch_size] for i in range(0, len(work), batch_size)]
+            futures = [
+                self._pool.submit(
+                    _worker_evaluate_batch, batch, self.rule_budget, self.request_budget, self.budget_action
+                )
+                for batch in batches
+            ]
+            verdicts = []
+            for batch, future in zip(batches, futures):
+                try:
+                    verdicts.extend(self._wait(future, self.request_budget * len(batch)))
+                except FutureTimeoutError:
+                    future.cancel()
+                    verdicts.extend(self._request_overrun() for _ in batch)
+
+        for verdict in verdicts:
+            for timing in verdict.timings:
+                for callback in self._observers:
+                    callback(timing)
+        return verdicts
+
+    def _request_overrun(self):
+        message = "policy evaluation exceeded request budget"
+        logger.warning(f"{message}: action={self.budget_action}")
+        if self.budget_action == "deny":
+            return Verdict(False, message, [], False)
+        if self.budget_action == "warn":
+            return Verdict(True, None, [message], False)
+        return Verdict(True, None, [], False)
@@ -0,0 +1,52 @@
+"""Gunicorn settings for the webhook image.
+
+The master forks one policy loader process that runs the informers and
+publishes a policy snapshot (see policy_snapshot.py). Workers serve
+admission requests from that snapshot instead of each watching the API
+server."""
+import os
+import shutil
+import signal
+
+# Set before prometheus_client is imported: every process (workers, their CEL
+# pools and the policy loader) writes its samples here and /metrics merges them
+PROMETHEUS_MULTIPROC_DIR = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/dev/shm/policy-webhook/metrics")
+
+from prometheus_client import multiprocess  # noqa: E402
+
+from policy_snapshot import DEFAULT_SNAPSHOT_PATH, start_loader  # noqa: E402
+
+bind = f"0.0.0.0:{os.environ.get('WEBHOOK_PORT', 8443)}"
+certfile = os.environ.get("TLS_CERT_FILE", "certs/tls.crt")
+keyfile = os.environ.get("TLS_KEY_FILE", "certs/tls.key")
+
+workers = int(os.environ.get("WEB_WORKERS", 2))
+threads = int(os.environ.get("WEB_THREADS", 4))
+worker_class = "gthread"
+timeout = int(os.environ.get("WEB_TIMEOUT_SECONDS", 30))
+graceful_timeout = 10
+# The API server reuses its connections to the webhook
+keepalive = 30
+
+POLICY_SNAPSHOT_PATH = os.environ.setdefault("POLICY_SNAPSHOT_PATH", DEFAULT_SNAPSHOT_PATH)
+
+
+def on_starting(server):
+    shutil.rmtree(PROMETHEUS_MULTIPROC_DIR, ignore_errors=True)
+    os.makedirs(PROMETHEUS_MULTIPROC_DIR)
+    # Inherited by every worker forked after this point
+    os.environ["POLICY_SOURCE"] = "snapshot"
+    server.policy_loader = start_loader(POLICY_SNAPSHOT_PATH)
+
+
+def child_exit(server, worker):
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def on_exit(server):
+    pid = getattr(server, "policy_loader", None)
+    if pid:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
@@ -0,0 +1,132 @@
+_MISSING = object()
+_REMOVED = object()
+
+
+def escape(token):
+    """RFC 6901 reference token escaping."""
+    return str(token).replace("~", "~0").replace("/", "~1")
+
+
+def pointer(path):
+    return "".join("/" + escape(token) for token in path)
+
+
+def _child(value, key):
+    if isinstance(value, dict):
+        return value.get(key, _MISSING)
+    if isinstance(value, list) and isinstance(key, int) and 0 <= key < len(value):
+        return value[key]
+    return _MISSING
+
+
+def _walk(value, path):
+    for key in path:
+        value = _child(value, key)
+        if value is _MISSING:
+            break
+    return value
+
+
+def _assoc(value, path, new):
+    """Copy of value with new stored at path. Only the containers along the
+    path are copied; missing maps are created."""
+    if not path:
+        return new
+    key, rest = path[0], path[1:]
+    if isinstance(value, list) and isinstance(key, int):
+        copied = list(value)
+        copied[key] = _assoc(copied[key], rest, new)
+        return copied
+    copied = dict(value) if isinstance(value, dict) else {}
+    copied[key] = _assoc(copied.get(key, _MISSING), rest, new)
+    return copied
+
+
+class Mutation:
+    """Copy-on-write overlay over an admission object that records changes
+    and turns them into a minimal JSON Patch.
+
+    The original object is never modified or copied. Each change is kept
+    under the shortest path that did not exist, or was replaced, in the
+    original, so creating `metadata.labels` and then setting several labels
+    yields a single `add` of the whole map."""
+
+    def __init__(self, obj):
+        self.original = obj if obj is not None else {}
+        self._changes = {}
+
+    def _overlay(self, path):
+        for i in range(len(path), 0, -1):
+            prefix = path[:i]
+            if prefix in self._changes:
+                return prefix
+        return None
+
+    def get(self, path, default=None):
+        path = tuple(path)
+        prefix = self._overlay(path)
+        if prefix is None:
+            value = _walk(self.original, path)
+        else:
+            stored = self._changes[prefix]
+            value = _MISSING if stored is _REMOVED else _walk(stored, path[len(prefix):])
+        return default if value is _MISSING else value
+
+    def _drop_below(self, path):
+        for key in [k for k in self._changes if len(k) > len(path) and k[:len(path)] == path]:
+            del self._changes[key]
+
+    def set(self, path, value):
+        path = tuple(path)
+        if self.get(path, _MISSING) == value:
+            return
+
+        prefix = self._overlay(path)
+        if prefix is not None and self._changes[prefix] is not _REMOVED:
+            self._changes[prefix] = _assoc(self._changes[prefix], path[len(prefix):], value)
+            return
+
+        # Find the first path segment that does not exist in the original
+        current = self.original
+        for depth, key in enumerate(path):
+            child = _child(current, key)
+            if child is _MISSING or (prefix is not None and path[:depth + 1] == prefix):
+                created = path[:depth + 1]
+                self._drop_below(created)
+                self._changes[created] = _assoc(_MISSING, path[depth + 1:], value)
+                return
+            current = child
+
+        self._drop_below(path)
+        self._changes[path] = value
+
+    def remove(self, path):
+        path = tuple(path)
+        if self.get(path, _MISSING) is _MISSING:
+            return
+
+        prefix = self._overlay(path)
+        if prefix is not None and prefix != path and self._changes[prefix] is not _REMOVED:
+            stored = self._changes[prefix]
+            parent = _walk(stored, path[len(prefix):-1])
+            if isinstance(parent, dict):
+                parent = {k: v for k, v in parent.items() if k != path[-1]}
+                self._changes[prefix] = _assoc(stored, path[len(prefix):-1], parent)
+            return
+
+        self._drop_below(path)
+        if _walk(self.original, path) is _MISSING:
+            self._changes.pop(path, None)
+        else:
+            self._changes[path] = _REMOVED
+
+    def patch(self):
+        ops = []
+        for path, value in self._changes.items():
+            if value is _REMOVED:
+                ops.append({"op": "remove", "path": pointer(path)})
+            elif _walk(self.original, path) is _MISSING:
+                ops.append({"op": "add", "path": pointer(path), "value": value})
+            else:
+                ops.append({"op": "replace", "path": pointer(path), "value": value})
+        return ops
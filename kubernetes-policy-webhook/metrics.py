@@ -0,0 +1,88 @@
+import functools
+import os
+import time
+
+from flask import g
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Histogram, generate_latest, multiprocess
+
+# Admission handling is expected to take milliseconds; the tail matters up
+# to the API server's webhook timeout.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LOOKUP_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01)
+
+ADMISSION_SECONDS = Histogram(
+    "policy_webhook_admission_duration_seconds",
+    "Time to handle an admission request.",
+    ["endpoint", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+POLICY_LOOKUP_SECONDS = Histogram(
+    "policy_webhook_policy_lookup_duration_seconds",
+    "Time to find the policies matching an admission request.",
+    ["endpoint"],
+    buckets=LOOKUP_BUCKETS,
+)
+CEL_COMPILE_SECONDS = Histogram(
+    "policy_webhook_cel_compile_duration_seconds",
+    "Time to compile a CEL expression (program cache misses only).",
+    ["outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+POLICY_EVALUATION_SECONDS = Histogram(
+    "policy_webhook_policy_evaluation_duration_seconds",
+    "Time spent evaluating the rules of one validation policy for one request.",
+    ["policy", "scope", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+RULE_EVALUATION_SECONDS = Histogram(
+    "policy_webhook_rule_evaluation_duration_seconds",
+    "Time to evaluate one validation rule; rule is its index in the policy.",
+    ["policy", "scope", "rule", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+
+# A policy's outcome is the worst of its rules' outcomes
+_OUTCOME_RANK = {"pass": 0, "fail": 1, "budget": 2}
+
+
+def observe_timings(timings):
+    """Record the RuleTimings of one evaluated request per rule and per policy."""
+    policies = {}
+    for timing in timings:
+        RULE_EVALUATION_SECONDS.labels(timing.policy, timing.scope, str(timing.rule), timing.outcome).observe(timing.seconds)
+        key = (timing.policy, timing.scope)
+        seconds, outcome = policies.get(key, (0.0, "pass"))
+        if _OUTCOME_RANK[timing.outcome] > _OUTCOME_RANK[outcome]:
+            outcome = timing.outcome
+        policies[key] = (seconds + timing.seconds, outcome)
+    for (policy, scope), (seconds, outcome) in policies.items():
+        POLICY_EVALUATION_SECONDS.labels(policy, scope, outcome).observe(seconds)
+
+
+def timed_admission(endpoint):
+    """Record the handler's latency under the outcome it stores in
+    flask.g.admission_outcome ("allowed" unless set, "error" on exceptions)."""
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            outcome = "error"
+            try:
+                response = handler(*args, **kwargs)
+                outcome = g.get("admission_outcome", "allowed")
+                return response
+            finally:
+                ADMISSION_SECONDS.labels(endpoint, outcome).observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+def render():
+    """Exposition text and content type. Under gunicorn every process writes
+    its samples to PROMETHEUS_MULTIPROC_DIR and they are merged here."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,313 @@
+import logging
+import threading
+import time
+
+from kubernetes import client, watch
+
+logger = logging.getLogger("k8s-admission-webhook")
+
+POLICY_GROUP = "policy.example.com"
+POLICY_VERSION = "v1"
+
+CLUSTER_MUTATE_PLURAL = "clustercelmutationpolicies"
+NAMESPACE_MUTATE_PLURAL = "namespacecelmutationpolicies"
+
+CLUSTER_VALIDATE_PLURAL = "clustercelvalidationpolicies"
+NAMESPACE_VALIDATE_PLURAL = "namespacecelvalidationpolicies"
+
+WATCH_TIMEOUT_SECONDS = 300
+RETRY_BACKOFF_SECONDS = 2
+MAX_BACKOFF_SECONDS = 30
+
+_serializer = client.ApiClient()
+
+
+# ------------------------
+# Helpers
+# ------------------------
+def object_key(obj):
+    meta = obj.get("metadata", {})
+    return (meta.get("namespace"), meta.get("name"))
+
+
+def _to_dict(obj):
+    if isinstance(obj, dict):
+        return obj
+    return _serializer.sanitize_for_serialization(obj)
+
+
+def _list_meta(result):
+    if isinstance(result, dict):
+        return result.get("items", []), result.get("metadata", {}).get("resourceVersion")
+    return result.items, result.metadata.resource_version
+
+
+# ------------------------
+# Informer
+# ------------------------
+class Informer:
+    """In-memory mirror of one collection: a single LIST, then a WATCH
+    resumed from the last seen resourceVersion. Falls back to a fresh LIST
+    when the server reports the resourceVersion as expired (410)."""
+
+    def __init__(self, name, list_func, *list_args, indexers=None, **list_kwargs):
+        self.name = name
+        self._list_func = list_func
+        self._list_args = list_args
+        self._list_kwargs = list_kwargs
+        self._indexers = indexers or {}
+
+        self._lock = threading.Lock()
+        self._store = {}
+        self._indices = {index: {} for index in self._indexers}
+        self._listeners = []
+
+        self._synced = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._watch = None
+
+        self.resource_version = None
+        self.last_error = None
+
+    # --- lifecycle ---
+    def add_listener(self, callback):
+        """Register callback(event_type, obj, old_obj), called after every change."""
+        self._listeners.append(callback)
+
+    def start(self):
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._run, name=f"informer-{self.name}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._watch:
+            self._watch.stop()
+
+    def has_synced(self):
+        return self._synced.is_set()
+
+    def wait_for_sync(self, timeout=None):
+        return self._synced.wait(timeout)
+
+    # --- reads ---
+    def list(self):
+        with self._lock:
+            return list(self._store.values())
+
+    def get(self, key):
+        with self._lock:
+            return self._store.get(key)
+
+    def by_index(self, index, value):
+        with self._lock:
+            return list(self._indices[index].get(value, {}).values())
+
+    def __len__(self):
+        return len(self._store)
+
+    # --- sync loop ---
+    def _run(self):
+        backoff = RETRY_BACKOFF_SECONDS
+        while not self._stopped.is_set():
+            try:
+                if self.resource_version is None:
+                    self._relist()
+                self._watch_once()
+                backoff = RETRY_BACKOFF_SECONDS
+            except client.exceptions.ApiException as e:
+                if e.status == 410:
+                    logger.info(f"Informer {self.name}: resourceVersion {self.resource_version} expired, relisting")
+                    self.resource_version = None
+                    continue
+                if e.status == 404:
+                    logger.warning(f"Informer {self.name}: resource not found, treating as empty")
+                    self._replace([], None)
+                else:
+                    logger.error(f"Informer {self.name}: API error {e.status}: {e.reason}")
+                self.last_error = str(e)
+                self._stopped.wait(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF_SECONDS)
+            except Exception as e:
+                logger.error(f"Informer {self.name}: watch failed: {e}")
+                self.last_error = str(e)
+                self._stopped.wait(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF_SECONDS)
+
+    def _relist(self):
+        started = time.monotonic()
+        result = self._list_func(*self._list_args, **self._list_kwargs)
+        items, resource_version = _list_meta(result)
+        self._replace([_to_dict(i) for i in items], resource_version)
+        logger.info(
+            f"Informer {self.name}: listed {len(items)} objects at "
+            f"resourceVersion={resource_version} in {time.monotonic() - started:.3f}s"
+        )
+
+    def _watch_once(self):
+        self._watch = watch.Watch()
+        stream = self._watch.stream(
+            self._list_func,
+            *self._list_args,
+            resource_version=self.resource_version,
+            timeout_seconds=WATCH_TIMEOUT_SECONDS,
+            allow_watch_bookmarks=True,
+            **self._list_kwargs,
+        )
+        for event in stream:
+            if self._stopped.is_set():
+                break
+            obj = event.get("raw_object") or _to_dict(event["object"])
+            resource_version = obj.get("metadata", {}).get("resourceVersion")
+            if event["type"] != "BOOKMARK":
+                self._apply(event["type"], obj)
+            if resource_version:
+                self.resource_version = resource_version
+        self._watch = None
+
+    # --- store mutation ---
+    def _replace(self, items, resource_version):
+        fresh = {object_key(obj): obj for obj in items}
+        events = []
+        with self._lock:
+            for key, old in self._store.items():
+                if key not in fresh:
+                    events.append(("DELETED", old, old))
+            for key, obj in fresh.items():
+                old = self._store.get(key)
+                if old is None:
+                    events.append(("ADDED", obj, None))
+                elif old.get("metadata", {}).get("resourceVersion") != obj.get("metadata", {}).get("resourceVersion"):
+                    events.append(("MODIFIED", obj, old))
+            self._store = fresh
+            self._indices = {index: {} for index in self._indexers}
+            for key, obj in fresh.items():
+                self._index(key, obj)
+        self.resource_version = resource_version
+        for event_type, obj, old in events:
+            self._notify(event_type, obj, old)
+        # Only report synced once listeners (indexes, compiled programs) have caught up
+        self._synced.set()
+
+    def _apply(self, event_type, obj):
+        key = object_key(obj)
+        with self._lock:
+            old = self._store.get(key)
+            if old is not None:
+                self._unindex(key, old)
+            if event_type == "DELETED":
+                self._store.pop(key, None)
+            else:
+                self._store[key] = obj
+                self._index(key, obj)
+        self._notify(event_type, obj, old)
+
+    def _index(self, key, obj):
+        for index, func in self._indexers.items():
+            for value in func(obj):
+                self._indices[index].setdefault(value, {})[key] = obj
+
+    def _unindex(self, key, obj):
+        for index, func in self._indexers.items():
+            for value in func(obj):
+                bucket = self._indices[index].get(value)
+                if bucket is not None:
+                    bucket.pop(key, None)
+                    if not bucket:
+                        del self._indices[index][value]
+
+    def _notify(self, event_type, obj, old):
+        for callback in self._listeners:
+            try:
+                callback(event_type, obj, old)
+            except Exception as e:
+                logger.error(f"Informer {self.name}: listener failed on {event_type}: {e}")
+
+
+# ------------------------
+# Policy cache
+# ------------------------
+def _namespace_of(obj):
+    return [obj.get("metadata", {}).get("namespace")]
+
+
+class PolicyCache:
+    """Watch-backed cache of the cluster and namespace scoped policy CRDs.
+
+    Admission handlers read from memory; the API server is only contacted
+    by the background informers."""
+
+    def __init__(self, custom_api, group, version, cluster_plurals, namespace_plurals):
+        self.generation = 0
+        self._generation_lock = threading.Lock()
+        self._listeners = []
+        self.informers = {}
+
+        for plural in cluster_plurals:
+            self.informers[plural] = Informer(
+                plural, custom_api.list_cluster_custom_object, group, version, plural
+            )
+        for plural in namespace_plurals:
+            # A cluster-wide list of a namespaced CRD returns every namespace's objects.
+            self.informers[plural] = Informer(
+                plural, custom_api.list_cluster_custom_object, group, version, plural,
+                indexers={"namespace": _namespace_of},
+            )
+
+        for plural, informer in self.informers.items():
+            informer.add_listener(self._make_listener(plural))
+
+    def _make_listener(self, plural):
+        def on_change(event_type, obj, old):
+            with self._generation_lock:
+                self.generation += 1
+            for callback in self._listeners:
+                callback(plural, event_type, obj, old)
+        return on_change
+
+    def add_listener(self, callback):
+        """Register callback(plural, event_type, obj, old_obj) for any policy change."""
+        self._listeners.append(callback)
+
+    def start(self):
+        for informer in self.informers.values():
+            informer.start()
+
+    def stop(self):
+        for informer in self.informers.values():
+            informer.stop()
+
+    def has_synced(self):
+        return all(informer.has_synced() for informer in self.informers.values())
+
+    def wait_for_sync(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for informer in self.informers.values():
+            remaining = None if deadline is None else max(0, deadline - time.monotonic())
+            if not informer.wait_for_sync(remaining):
+                return False
+        return True
+
+    def cluster_policies(self, plural):
+        return sorted(self.informers[plural].list(), key=lambda p: p["metadata"]["name"])
+
+    def namespace_policies(self, namespace, plural):
+        if not namespace:
+            return []
+        return sorted(
+            self.informers[plural].by_index("namespace", namespace),
+            key=lambda p: p["metadata"]["name"],
+        )
+
+    def status(self):
+        return {
+            plural: {
+                "synced": informer.has_synced(),
+                "objects": len(informer),
+                "resourceVersion": informer.resource_version,
+                "lastError": informer.last_error,
+            }
+            for plural, informer in self.informers.items()
+        }
@@ -0,0 +1,75 @@
+import threading
+
+
+def _match_keys(policy):
+    match = policy.get("spec", {}).get("match", {})
+    return {
+        (kind, operation)
+        for kind in match.get("resources", [])
+        for operation in match.get("operations", [])
+    }
+
+
+class PolicyIndex:
+    """Precomputed lookup of the policies that apply to an admission request.
+
+    Cluster policies are indexed by (kind, operation) and namespace policies
+    by (namespace, kind, operation). Buckets are immutable tuples ordered by
+    policy name, replaced as policies change, so lookups never scan
+    policies that do not match."""
+
+    def __init__(self, cluster_plural, namespace_plural):
+        self.cluster_plural = cluster_plural
+        self.namespace_plural = namespace_plural
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def on_policy_change(self, plural, event_type, obj, old):
+        if plural == self.cluster_plural:
+            scope = "cluster"
+        elif plural == self.namespace_plural:
+            scope = "namespace"
+        else:
+            return
+
+        with self._lock:
+            for policy in (old, obj):
+                if policy is not None:
+                    self._remove(scope, policy)
+            if event_type != "DELETED":
+                self._add(scope, obj)
+
+    def _bucket_keys(self, scope, policy):
+        if scope == "cluster":
+            return {("cluster", None) + key for key in _match_keys(policy)}
+        namespace = policy.get("metadata", {}).get("namespace")
+        return {("namespace", namespace) + key for key in _match_keys(policy)}
+
+    def _remove(self, scope, policy):
+        name = policy["metadata"]["name"]
+        for key in self._bucket_keys(scope, policy):
+            bucket = self._buckets.get(key)
+            if not bucket:
+                continue
+            remaining = tuple(p for p in bucket if p["metadata"]["name"] != name)
+            if remaining:
+                self._buckets[key] = remaining
+            else:
+                del self._buckets[key]
+
+    def _add(self, scope, policy):
+        for key in self._bucket_keys(scope, policy):
+            bucket = self._buckets.get(key, ()) + (policy,)
+            self._buckets[key] = tuple(sorted(bucket, key=lambda p: p["metadata"]["name"]))
+
+    def lookup(self, kind, operation, namespace):
+        """Return (scope, policy) pairs: cluster policies first, then the
+        policies of the request's namespace, each ordered by name."""
+        buckets = self._buckets
+        matched = [("cluster", p) for p in buckets.get(("cluster", None, kind, operation), ())]
+        if namespace:
+            matched += [("namespace", p) for p in buckets.get(("namespace", namespace, kind, operation), ())]
+        return matched
+
+    def __len__(self):
+        return len(self._buckets)
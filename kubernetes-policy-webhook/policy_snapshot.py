@@ -0,0 +1,520 @@
+import logging
+import os
+import pickle
+import signal
+import tempfile
+import threading
+import time
+
+from kubernetes import client, config
+from celpy import Environment
+
+from cel_programs import PolicyCompiler, ProgramCache, policy_expressions
+from context_cache import ContextCache, param_ref
+from policy_cache import (
+    CLUSTER_MUTATE_PLURAL,
+    CLUSTER_VALIDATE_PLURAL,
+    NAMESPACE_MUTATE_PLURAL,
+    NAMESPACE_VALIDATE_PLURAL,
+    POLICY_GROUP,
+    POLICY_VERSION,
+    PolicyCache,
+    object_key,
+)
+
+logger = logging.getLogger("k8s-admission-webhook")
+
+DEFAULT_SNAPSHOT_PATH = "/dev/shm/policy-webhook/policies.pickle"
+WRITE_INTERVAL_SECONDS = 0.2
+POLL_INTERVAL_SECONDS = 0.5
+# The loader rewrites <snapshot path>.heartbeat this often; readers stop
+# reporting ready when it is older than the timeout
+HEARTBEAT_INTERVAL_SECONDS = 5
+HEARTBEAT_TIMEOUT_SECONDS = 30
+# Delay before restarting a loader that exited, doubled up to the maximum
+# while it keeps exiting within RESTART_RESET_SECONDS of being started
+RESTART_BACKOFF_SECONDS = 1
+RESTART_BACKOFF_MAX_SECONDS = 30
+RESTART_RESET_SECONDS = 60
+
+
+def heartbeat_path(path):
+    """Rewritten by the loader every HEARTBEAT_INTERVAL_SECONDS with the
+    context cache status, so informer errors show up without republishing
+    the context snapshot."""
+    return path + ".heartbeat"
+
+
+def context_path(path):
+    """Where the loader publishes the namespace and params caches."""
+    return path + ".context"
+
+
+def _publish(path, snapshot):
+    """Replace the file at path with snapshot, atomically."""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".snapshot-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def _diff(current, fresh):
+    """ADDED/MODIFIED/DELETED events turning current into fresh, two
+    {key: object} maps, by resourceVersion."""
+    events = [("DELETED", old, old) for key, old in current.items() if key not in fresh]
+    for key, obj in fresh.items():
+        old = current.get(key)
+        if old is None:
+            events.append(("ADDED", obj, None))
+        elif old.get("metadata", {}).get("resourceVersion") != obj.get("metadata", {}).get("resourceVersion"):
+            events.append(("MODIFIED", obj, old))
+    return events
+
+
+# ------------------------
+# Writer (policy loader process)
+# ------------------------
+class SnapshotWriter:
+    """Publishes the policy cache and the parsed ASTs of every validation
+    expression to a file that serving workers load.
+
+    Changes are coalesced to at most one write per interval, nothing is
+    written before the cache has synced, and the file is replaced with a
+    rename so readers never see a partial snapshot. A heartbeat file is
+    rewritten every HEARTBEAT_INTERVAL_SECONDS while the loop runs.
+
+    With a context cache, its namespaces and params are published the same
+    way to a second file (context_path) when they change. Its status, which
+    changes without an event when a param informer fails, goes in the
+    heartbeat instead."""
+
+    def __init__(self, policy_cache, compiler, path, interval=WRITE_INTERVAL_SECONDS, context=None):
+        self.policy_cache = policy_cache
+        self.compiler = compiler
+        self.path = path
+        self.interval = interval
+        self.context = context
+        self._dirty = threading.Event()
+        self._dirty.set()  # an empty cluster still needs a first snapshot
+        self._context_dirty = threading.Event()
+        self._context_dirty.set()
+        self._stopped = threading.Event()
+        self._beat_at = 0
+        self.writes = 0
+
+    def on_policy_change(self, plural, event_type, obj, old):
+        self._dirty.set()
+        # Policies start and stop param informers
+        self._context_dirty.set()
+
+    def on_context_change(self, *args):
+        self._context_dirty.set()
+
+    def stop(self):
+        self._stopped.set()
+
+    def heartbeat(self):
+        _publish(heartbeat_path(self.path), {
+            "createdAt": time.time(),
+            "context": self.context.status() if self.context else None,
+        })
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            if time.monotonic() - self._beat_at >= HEARTBEAT_INTERVAL_SECONDS:
+                try:
+                    self.heartbeat()
+                    self._beat_at = time.monotonic()
+                except Exception as e:
+                    logger.error(f"Policy snapshot: heartbeat failed: {e}")
+            if self._dirty.is_set() and self.policy_cache.has_synced():
+                self._dirty.clear()
+                try:
+                    self.write()
+                except Exception as e:
+                    logger.error(f"Policy snapshot: write to {self.path} failed: {e}")
+                    self._dirty.set()
+            if self.context and self._context_dirty.is_set() and self.context.has_synced():
+                self._context_dirty.clear()
+                try:
+                    self.write_context()
+                except Exception as e:
+                    logger.error(f"Policy snapshot: write to {context_path(self.path)} failed: {e}")
+                    self._context_dirty.set()
+
+    def write(self):
+        started = time.monotonic()
+        generation = self.policy_cache.generation
+        policies = {plural: informer.list() for plural, informer in self.policy_cache.informers.items()}
+        expressions = {
+            expression
+            for plural in self.compiler.plurals
+            for policy in policies.get(plural, [])
+            for expression in policy_expressions(policy)
+        }
+        snapshot = {
+            "generation": generation,
+            "createdAt": time.time(),
+            "policies": policies,
+            "programs": self.compiler.programs.export(expressions),
+        }
+
+        _publish(self.path, snapshot)
+        self.writes += 1
+        logger.info(
+            f"Policy snapshot: published generation={generation} "
+            f"({sum(len(p) for p in policies.values())} policies, {len(expressions)} programs) "
+            f"in {time.monotonic() - started:.3f}s"
+        )
+
+    def write_context(self):
+        _publish(context_path(self.path), {"createdAt": time.time(), **self.context.export()})
+
+
+def run_loader(path, interval=WRITE_INTERVAL_SECONDS):
+    """Entry point of the policy loader process: runs the policy and
+    context informers and keeps the snapshots at path current. Does not
+    return."""
+    logging.basicConfig(level=logging.INFO)
+    try:
+        config.load_incluster_config()
+    except Exception:
+        config.load_kube_config(config_file="config")
+
+    programs = ProgramCache(Environment(), max_size=int(os.environ.get("CEL_PROGRAM_CACHE_SIZE", 1024)))
+    compiler = PolicyCompiler(programs, [CLUSTER_VALIDATE_PLURAL, NAMESPACE_VALIDATE_PLURAL])
+    policy_cache = PolicyCache(
+        client.CustomObjectsApi(),
+        POLICY_GROUP,
+        POLICY_VERSION,
+        cluster_plurals=[CLUSTER_MUTATE_PLURAL, CLUSTER_VALIDATE_PLURAL],
+        namespace_plurals=[NAMESPACE_MUTATE_PLURAL, NAMESPACE_VALIDATE_PLURAL],
+    )
+    context = ContextCache(
+        client.ApiClient(), client.CoreV1Api(), client.CustomObjectsApi(),
+        [CLUSTER_VALIDATE_PLURAL, NAMESPACE_VALIDATE_PLURAL],
+    )
+    writer = SnapshotWriter(policy_cache, compiler, path, interval, context)
+    policy_cache.add_listener(compiler.on_policy_change)
+    policy_cache.add_listener(context.on_policy_change)
+    policy_cache.add_listener(writer.on_policy_change)
+    context.namespaces.add_listener(writer.on_context_change)
+    context.add_listener(writer.on_context_change)
+    context.start()
+    policy_cache.start()
+    writer.run()
+
+
+def _fork_loader(path, interval):
+    pid = os.fork()
+    if pid == 0:
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            run_loader(path, interval)
+        finally:
+            os._exit(1)
+    logger.info(f"Policy snapshot: started loader pid={pid} writing {path}")
+    return pid
+
+
+def supervise_loader(path, interval=WRITE_INTERVAL_SECONDS):
+    """Entry point of the supervisor process: keeps a loader running,
+    restarting it with a backoff when it exits. Exits, stopping the
+    loader, on SIGTERM or once its parent (the gunicorn master) is gone.
+    Stays single threaded so the loaders it forks are too."""
+    logging.basicConfig(level=logging.INFO)
+    parent = os.getppid()
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    backoff = RESTART_BACKOFF_SECONDS
+    while not stopping:
+        started = time.monotonic()
+        pid = _fork_loader(path, interval)
+        while not stopping:
+            if os.waitpid(pid, os.WNOHANG) != (0, 0):
+                break
+            if os.getppid() != parent:
+                logger.error("Policy snapshot: gunicorn master exited, stopping the loader")
+                stopping = True
+                break
+            time.sleep(1)
+        if stopping:
+            try:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+            break
+
+        if time.monotonic() - started >= RESTART_RESET_SECONDS:
+            backoff = RESTART_BACKOFF_SECONDS
+        logger.error(f"Policy snapshot: loader pid={pid} exited, restarting it in {backoff}s")
+        deadline = time.monotonic() + backoff
+        while not stopping and time.monotonic() < deadline:
+            time.sleep(0.1)
+        backoff = min(backoff * 2, RESTART_BACKOFF_MAX_SECONDS)
+
+
+def start_loader(path=DEFAULT_SNAPSHOT_PATH, interval=WRITE_INTERVAL_SECONDS):
+    """Fork the loader supervisor (see supervise_loader) and return its pid.
+    Call from the gunicorn master before any worker is forked, so the master
+    stays single threaded. The gunicorn arbiter reaps any child it did not
+    fork as a worker, so the master cannot wait on the loader itself."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    for stale in (path, heartbeat_path(path), context_path(path)):  # left over from a previous run
+        try:
+            os.unlink(stale)
+        except FileNotFoundError:
+            pass
+    pid = os.fork()
+    if pid == 0:
+        try:
+            supervise_loader(path, interval)
+        finally:
+            os._exit(0)
+    logger.info(f"Policy snapshot: started loader supervisor pid={pid}")
+    return pid
+
+
+# ------------------------
+# Reader (serving workers)
+# ------------------------
+class _SnapshotReader:
+    """Polls a snapshot file published by the loader and hands every new
+    version to _load."""
+
+    name = "snapshot"
+
+    def __init__(self, path, poll_interval=POLL_INTERVAL_SECONDS):
+        self.path = path
+        self.poll_interval = poll_interval
+        self._signature = None
+        self._synced = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+        self.snapshot_created_at = None
+        self.last_error = None
+
+    def start(self):
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def wait_for_sync(self, timeout=None):
+        return self._synced.wait(timeout)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self._poll()
+            except Exception as e:
+                logger.error(f"Policy snapshot: loading {self.path} failed: {e}")
+                self.last_error = str(e)
+            self._stopped.wait(self.poll_interval)
+
+    def _poll(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        signature = (stat.st_ino, stat.st_mtime_ns)
+        if signature == self._signature:
+            return
+        with open(self.path, "rb") as f:
+            snapshot = pickle.load(f)
+        self._signature = signature
+        self._load(snapshot)
+        self.snapshot_created_at = snapshot["createdAt"]
+        self.last_error = None
+        self._synced.set()
+
+    def _load(self, snapshot):
+        raise NotImplementedError
+
+    def _snapshot_age(self):
+        if not self.snapshot_created_at:
+            return None
+        return round(time.time() - self.snapshot_created_at, 3)
+
+
+class SnapshotPolicySource(_SnapshotReader):
+    """Stands in for a PolicyCache in serving workers: instead of watching
+    the API server itself, it polls the snapshot published by the loader.
+
+    Each new snapshot is diffed against the previous one and replayed to
+    the listeners as ADDED/MODIFIED/DELETED events, so the policy indexes,
+    compiler and verdict cache work unchanged. Parsed programs from the
+    snapshot are loaded into the program cache first."""
+
+    name = "policy-snapshot"
+
+    def __init__(self, path, programs, poll_interval=POLL_INTERVAL_SECONDS):
+        super().__init__(path, poll_interval)
+        self.programs = programs
+        self.generation = 0
+        self._listeners = []
+        self._store = {}
+        self.snapshot_generation = None
+
+    def add_listener(self, callback):
+        """Register callback(plural, event_type, obj, old_obj) for any policy change."""
+        self._listeners.append(callback)
+
+    def has_synced(self):
+        """A snapshot was loaded and the loader is still alive."""
+        if not self._synced.is_set():
+            return False
+        age = self.heartbeat_age()
+        return age is not None and age < HEARTBEAT_TIMEOUT_SECONDS
+
+    def heartbeat_age(self):
+        try:
+            return time.time() - os.stat(heartbeat_path(self.path)).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def preload_programs(self):
+        """Load the programs of the current snapshot, if there is one, into
+        the program cache without replaying its policies. Lets the
+        evaluation pool be seeded before the source is started."""
+        try:
+            with open(self.path, "rb") as f:
+                snapshot = pickle.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.warning(f"Policy snapshot: preloading programs from {self.path} failed: {e}")
+            return
+        self.programs.preload(snapshot["programs"])
+
+    def _load(self, snapshot):
+        self.programs.preload(snapshot["programs"])
+        for plural, items in snapshot["policies"].items():
+            fresh = {object_key(obj): obj for obj in items}
+            events = _diff(self._store.get(plural, {}), fresh)
+            self._store[plural] = fresh
+            for event_type, obj, old in events:
+                self._notify(plural, event_type, obj, old)
+        self.snapshot_generation = snapshot["generation"]
+
+    def _notify(self, plural, event_type, obj, old):
+        self.generation += 1
+        for callback in self._listeners:
+            try:
+                callback(plural, event_type, obj, old)
+            except Exception as e:
+                logger.error(f"Policy snapshot: listener failed on {plural} {event_type}: {e}")
+
+    def status(self):
+        age = self._snapshot_age()
+        heartbeat_age = self.heartbeat_age()
+        return {
+            plural: {
+                "synced": self.has_synced(),
+                "objects": len(items),
+                "snapshotGeneration": self.snapshot_generation,
+                "snapshotAgeSeconds": age,
+                "loaderHeartbeatAgeSeconds": round(heartbeat_age, 3) if heartbeat_age is not None else None,
+                "lastError": self.last_error,
+            }
+            for plural, items in self._store.items()
+        } or {"snapshot": {
+            "synced": False,
+            "path": self.path,
+            "loaderHeartbeatAgeSeconds": round(heartbeat_age, 3) if heartbeat_age is not None else None,
+            "lastError": self.last_error,
+        }}
+
+
+class SnapshotContextSource(_SnapshotReader):
+    """Stands in for a ContextCache in serving workers: the namespaces and
+    params CEL rules read come from the context snapshot published by the
+    loader, which runs the informers (see ContextCache.export).
+
+    Changes to param objects are replayed to the listeners as ContextCache
+    reports them, keyed by (apiVersion, kind, namespace). The loader tracks
+    which param objects the policies reference, so on_policy_change does
+    nothing here."""
+
+    name = "context-snapshot"
+
+    def __init__(self, path, heartbeat, poll_interval=POLL_INTERVAL_SECONDS):
+        super().__init__(path, poll_interval)
+        self.heartbeat = heartbeat
+        self._listeners = []
+        self._namespaces = {}
+        self._params = {}
+
+    def add_listener(self, callback):
+        """Register callback(source, event_type, obj, old_obj) for changes to
+        any param object; source is the (apiVersion, kind, namespace) key."""
+        self._listeners.append(callback)
+
+    def has_synced(self):
+        return self._synced.is_set()
+
+    def on_policy_change(self, plural, event_type, obj, old):
+        pass
+
+    def namespace_object(self, name):
+        if not name:
+            return None
+        return self._namespaces.get(name)
+
+    def params(self, scope, policy):
+        ref = param_ref(scope, policy)
+        if ref is None:
+            return None
+        objects = self._params.get(ref[:3])
+        if objects is None:
+            return None
+        # Cluster scoped kinds are stored without a namespace
+        return objects.get((ref[2], ref[3])) or objects.get((None, ref[3]))
+
+    def _load(self, snapshot):
+        namespaces = {obj["metadata"]["name"]: obj for obj in snapshot["namespaces"]}
+        params = {
+            source: {object_key(obj): obj for obj in items}
+            for source, items in snapshot["params"].items()
+        }
+        events = [
+            (source, event)
+            for source in self._params.keys() | params.keys()
+            for event in _diff(self._params.get(source, {}), params.get(source, {}))
+        ]
+        self._namespaces = namespaces
+        self._params = params
+        for source, (event_type, obj, old) in events:
+            for callback in self._listeners:
+                try:
+                    callback(source, event_type, obj, old)
+                except Exception as e:
+                    logger.error(f"Policy snapshot: listener failed on {source[1]} {event_type}: {e}")
+
+    def status(self):
+        """The context cache status from the loader's last heartbeat."""
+        try:
+            with open(self.heartbeat, "rb") as f:
+                status = pickle.load(f)["context"]
+        except FileNotFoundError:
+            status = None
+        except Exception as e:
+            return {"snapshot": {"synced": False, "path": self.heartbeat, "lastError": str(e)}}
+        if status is None or not self.has_synced():
+            return {"snapshot": {"synced": False, "path": self.path, "lastError": self.last_error}}
+        return {**status, "snapshotAgeSeconds": self._snapshot_age(), "lastError": self.last_error}
@@ -0,0 +1,73 @@
+import threading
+from collections import OrderedDict
+
+# Weight of the newest sample in the moving averages
+SMOOTHING = 0.05
+# Floor for the failure rate so rules that never fail still sort by cost
+MIN_FAILURE_RATE = 0.001
+
+
+class RuleStats:
+    """Moving averages of evaluation cost and failure rate per rule
+    expression, used to order enforce rules for an early exit.
+
+    A request is denied as soon as any enforce rule fails, so the expected
+    cost of the enforce rules is lowest when they run in ascending order of
+    cost / failure rate: cheap rules that often fail first. Rules never seen
+    before sort first so they are measured. The moving averages forget old
+    samples, so the order follows changes in the request mix."""
+
+    def __init__(self, max_size=4096):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._rules = OrderedDict()  # expression -> [evaluations, seconds, failure rate]
+
+    def observe(self, timing):
+        """EvaluationEngine observer, called with every RuleTiming."""
+        failed = 1.0 if timing.outcome == "fail" else 0.0
+        with self._lock:
+            entry = self._rules.get(timing.expression)
+            if entry is None:
+                self._rules[timing.expression] = [1, timing.seconds, failed]
+                while len(self._rules) > self.max_size:
+                    self._rules.popitem(last=False)
+                return
+            self._rules.move_to_end(timing.expression)
+            entry[0] += 1
+            # Plain mean until there are enough samples for the moving average
+            weight = max(SMOOTHING, 1.0 / entry[0])
+            entry[1] += (timing.seconds - entry[1]) * weight
+            entry[2] += (failed - entry[2]) * weight
+
+    def score(self, expression):
+        entry = self._rules.get(expression)
+        if entry is None:
+            return 0.0
+        return entry[1] / max(entry[2], MIN_FAILURE_RATE)
+
+    def order(self, policies):
+        """(policy, rule) index pairs of the enforce rules in policies
+        (as built by evaluator.policy_rules), in evaluation order."""
+        enforce = [
+            (p, r, rule["expression"])
+            for p, policy in enumerate(policies)
+            for r, rule in enumerate(policy["validations"])
+            if rule.get("enforcement") == "enforce"
+        ]
+        # sorted() is stable: ties keep the declared order
+        return [(p, r) for p, r, expression in sorted(enforce, key=lambda e: self.score(e[2]))]
+
+    def stats(self):
+        with self._lock:
+            rules = [
+                {
+                    "expression": expression,
+                    "evaluations": evaluations,
+                    "meanMs": seconds * 1000,
+                    "failureRate": failure_rate,
+                    "score": seconds / max(failure_rate, MIN_FAILURE_RATE),
+                }
+                for expression, (evaluations, seconds, failure_rate) in self._rules.items()
+            ]
+        rules.sort(key=lambda r: r["score"])
+        return {"size": len(rules), "maxSize": self.max_size, "rules": rules}
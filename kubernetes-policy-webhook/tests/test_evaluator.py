@@ -0,0 +1,71 @@
+import pytest
+from celpy import Environment
+
+from cel_programs import ProgramCache
+from evaluator import evaluate_policies, policy_rules
+from rule_stats import RuleStats
+
+REQUEST = {"object": {"metadata": {"name": "pod", "labels": {"team": "a"}}}}
+
+
+def rules(*validations):
+    return [policy_rules("cluster", {"metadata": {"name": "test"}, "spec": {"validations": list(validations)}}, None)]
+
+
+def evaluate(policies, order=None):
+    return evaluate_policies(ProgramCache(Environment()), REQUEST, policies, 0.1, 3.0, "deny", order=order)
+
+
+# (description, validations, allowed, message)
+CASES = [
+    (
+        "rules without enforcement pass",
+        [{"expression": "true"}, {"expression": "object.metadata.name == 'pod'", "enforcement": "enforce"}],
+        True,
+        None,
+    ),
+    (
+        "a failing rule without enforcement does not deny",
+        [{"expression": "false", "message": "x"}, {"expression": "true", "enforcement": "enforce"}],
+        True,
+        None,
+    ),
+    (
+        "an enforce rule after one without enforcement still denies",
+        [
+            {"expression": "true"},
+            {"expression": "has(object.metadata.labels.owner)", "enforcement": "enforce",
+             "messageExpression": "'owner label required'"},
+        ],
+        False,
+        "owner label required",
+    ),
+    (
+        "a failing warn rule allows with a warning",
+        [{"expression": "false", "enforcement": "warn", "messageExpression": "'careful'"}],
+        True,
+        None,
+    ),
+]
+
+
+@pytest.mark.parametrize(
+    "validations, allowed, message",
+    [case[1:] for case in CASES],
+    ids=[case[0] for case in CASES],
+)
+@pytest.mark.parametrize("ordering", ["declared", "adaptive"])
+def test_enforcement(validations, allowed, message, ordering):
+    policies = rules(*validations)
+    order = RuleStats().order(policies) if ordering == "adaptive" else None
+    verdict = evaluate(policies, order)
+    assert verdict.allowed is allowed
+    assert verdict.message == message
+
+
+def test_adaptive_order_keeps_declared_deny_message():
+    policies = rules(
+        {"expression": "false", "enforcement": "enforce", "messageExpression": "'first'"},
+        {"expression": "false", "enforcement": "enforce", "messageExpression": "'second'"},
+    )
+    assert evaluate(policies, [(0, 1), (0, 0)]).message == "first"
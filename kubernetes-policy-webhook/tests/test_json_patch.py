@@ -0,0 +1,129 @@
+import pytest
+
+from json_patch import Mutation, escape, pointer
+
+# (reference token, escaped)
+ESCAPE_CASES = [
+    ("plain", "plain"),
+    ("app.kubernetes.io/name", "app.kubernetes.io~1name"),
+    ("a~b", "a~0b"),
+    # "~" is escaped first, so "~1" in a key does not turn into "/"
+    ("~1", "~01"),
+    ("/~", "~1~0"),
+    ("", ""),
+    (0, "0"),
+]
+
+
+@pytest.mark.parametrize("token, escaped", ESCAPE_CASES)
+def test_escape(token, escaped):
+    assert escape(token) == escaped
+
+
+# (path, pointer)
+POINTER_CASES = [
+    ((), ""),
+    (("metadata", "labels"), "/metadata/labels"),
+    (("metadata", "annotations", "example.com/owner"), "/metadata/annotations/example.com~1owner"),
+    (("spec", "containers", 0, "image"), "/spec/containers/0/image"),
+    (("metadata", "labels", ""), "/metadata/labels/"),
+]
+
+
+@pytest.mark.parametrize("path, expected", POINTER_CASES)
+def test_pointer(path, expected):
+    assert pointer(path) == expected
+
+
+POD = {
+    "metadata": {"name": "pod", "labels": {"app": "web"}},
+    "spec": {"containers": [{"name": "web", "image": "web:1"}]},
+}
+
+# (description, changes as ("set", path, value) or ("remove", path), expected patch)
+PATCH_CASES = [
+    (
+        "no changes",
+        [],
+        [],
+    ),
+    (
+        "setting the current value is a no-op",
+        [("set", ("metadata", "labels", "app"), "web")],
+        [],
+    ),
+    (
+        "replace an existing value",
+        [("set", ("spec", "containers", 0, "image"), "web:2")],
+        [{"op": "replace", "path": "/spec/containers/0/image", "value": "web:2"}],
+    ),
+    (
+        "add a key that needs escaping",
+        [("set", ("metadata", "labels", "app.kubernetes.io/name"), "web")],
+        [{"op": "add", "path": "/metadata/labels/app.kubernetes.io~1name", "value": "web"}],
+    ),
+    (
+        "missing maps are added once, with every key set below them",
+        [
+            ("set", ("metadata", "annotations", "example.com/a"), "1"),
+            ("set", ("metadata", "annotations", "b~c"), "2"),
+        ],
+        [{"op": "add", "path": "/metadata/annotations", "value": {"example.com/a": "1", "b~c": "2"}}],
+    ),
+    (
+        "remove an existing key",
+        [("remove", ("metadata", "labels", "app"))],
+        [{"op": "remove", "path": "/metadata/labels/app"}],
+    ),
+    (
+        "removing a missing key is a no-op",
+        [("remove", ("metadata", "labels", "missing"))],
+        [],
+    ),
+    (
+        "removing an added key drops the change",
+        [
+            ("set", ("metadata", "labels", "team"), "a"),
+            ("remove", ("metadata", "labels", "team")),
+        ],
+        [],
+    ),
+    (
+        "removing from an added map edits the added value",
+        [
+            ("set", ("metadata", "annotations", "a"), "1"),
+            ("set", ("metadata", "annotations", "b"), "2"),
+            ("remove", ("metadata", "annotations", "a")),
+        ],
+        [{"op": "add", "path": "/metadata/annotations", "value": {"b": "2"}}],
+    ),
+    (
+        "setting below a removed map adds it back",
+        [
+            ("remove", ("metadata", "labels")),
+            ("set", ("metadata", "labels", "team"), "a"),
+        ],
+        [{"op": "replace", "path": "/metadata/labels", "value": {"team": "a"}}],
+    ),
+]
+
+
+@pytest.mark.parametrize(
+    "changes, expected",
+    [case[1:] for case in PATCH_CASES],
+    ids=[case[0] for case in PATCH_CASES],
+)
+def test_patch(changes, expected):
+    mutation = Mutation(POD)
+    for op, path, *value in changes:
+        getattr(mutation, op)(path, *value)
+    assert mutation.patch() == expected
+
+
+def test_original_is_not_modified():
+    mutation = Mutation(POD)
+    mutation.set(("metadata", "labels", "team"), "a")
+    mutation.set(("spec", "containers", 0, "image"), "web:2")
+    assert POD["metadata"]["labels"] == {"app": "web"}
+    assert POD["spec"]["containers"][0]["image"] == "web:1"
+    assert mutation.get(("metadata", "labels", "team")) == "a"
@@ -0,0 +1,162 @@
+import pytest
+from celpy import Environment
+
+from cel_programs import ProgramCache
+from evaluator import Verdict
+from verdict_cache import VerdictCache
+
+
+def policy(*expressions):
+    return (
+        "cluster",
+        {
+            "metadata": {"name": "test"},
+            "spec": {"validations": [{"expression": e, "enforcement": "enforce"} for e in expressions]},
+        },
+    )
+
+
+def request(labels=None, name="pod", user="alice"):
+    return {
+        "uid": name,
+        "object": {"metadata": {"name": name, "labels": labels or {}}},
+        "userInfo": {"username": user},
+    }
+
+
+@pytest.fixture
+def cache():
+    return VerdictCache(ProgramCache(Environment()), max_size=4, ttl=30)
+
+
+# (description, matched, first (req, namespace object), second (req, namespace object), same key)
+KEY_CASES = [
+    (
+        "fields no rule reads are ignored",
+        [policy("has(object.metadata.labels.team)")],
+        (request({"team": "a"}, name="one"), None),
+        (request({"team": "a"}, name="two"), None),
+        True,
+    ),
+    (
+        "fields a rule reads are part of the key",
+        [policy("object.metadata.labels.team == 'a'")],
+        (request({"team": "a"}), None),
+        (request({"team": "b"}), None),
+        False,
+    ),
+    (
+        "a missing field differs from an empty one",
+        [policy("has(object.metadata.labels.team)")],
+        (request({"team": ""}), None),
+        (request({}), None),
+        False,
+    ),
+    (
+        "userInfo is read through request",
+        [policy("request.userInfo.username != 'mallory'")],
+        (request(user="alice"), None),
+        (request(user="mallory"), None),
+        False,
+    ),
+    (
+        "namespaceObject fields a rule reads are part of the key",
+        [policy("namespaceObject.metadata.labels.tier == 'prod'")],
+        (request(), {"metadata": {"labels": {"tier": "prod"}}}),
+        (request(), {"metadata": {"labels": {"tier": "dev"}}}),
+        False,
+    ),
+    (
+        "namespaceObject fields no rule reads are ignored",
+        [policy("namespaceObject.metadata.labels.tier == 'prod'")],
+        (request(), {"metadata": {"labels": {"tier": "prod"}, "resourceVersion": "1"}}),
+        (request(), {"metadata": {"labels": {"tier": "prod"}, "resourceVersion": "2"}}),
+        True,
+    ),
+    (
+        "messageExpression reads are part of the key",
+        [(
+            "cluster",
+            {
+                "metadata": {"name": "test"},
+                "spec": {"validations": [{
+                    "expression": "false",
+                    "messageExpression": "'denied ' + object.metadata.name",
+                    "enforcement": "enforce",
+                }]},
+            },
+        )],
+        (request(name="one"), None),
+        (request(name="two"), None),
+        False,
+    ),
+    (
+        "expressions that don't compile are skipped",
+        [policy("object.(", "object.metadata.labels.team == 'a'")],
+        (request({"team": "a"}, name="one"), None),
+        (request({"team": "a"}, name="two"), None),
+        True,
+    ),
+]
+
+
+@pytest.mark.parametrize(
+    "matched, first, second, same",
+    [case[1:] for case in KEY_CASES],
+    ids=[case[0] for case in KEY_CASES],
+)
+def test_key(cache, matched, first, second, same):
+    keys = [
+        cache.key(req, "Pod", "CREATE", "default", matched, cache.generation, namespace_object)
+        for req, namespace_object in (first, second)
+    ]
+    assert (keys[0] == keys[1]) is same
+
+
+# (description, arguments of the second key that differ from the first)
+SCOPE_CASES = [
+    ("kind", {"kind": "Deployment"}),
+    ("operation", {"operation": "UPDATE"}),
+    ("namespace", {"namespace": "other"}),
+    ("generation", {"generation": 1}),
+]
+
+
+@pytest.mark.parametrize("changes", [case[1] for case in SCOPE_CASES], ids=[case[0] for case in SCOPE_CASES])
+def test_key_scope(cache, changes):
+    matched = [policy("true")]
+    arguments = {"kind": "Pod", "operation": "CREATE", "namespace": "default", "generation": 0}
+    first = cache.key(request(), matched=matched, **arguments)
+    second = cache.key(request(), matched=matched, **{**arguments, **changes})
+    assert first != second
+
+
+def test_put_and_get(cache):
+    key = cache.key(request(), "Pod", "CREATE", "default", [policy("true")], cache.generation)
+    assert cache.get(key) is None
+    cache.put(key, Verdict(True, None, []), cache.generation)
+    assert cache.get(key) == Verdict(True, None, [])
+    assert cache.stats()["hits"] == 1
+
+
+def test_put_skips_uncacheable_and_stale(cache):
+    generation = cache.generation
+    key = cache.key(request(), "Pod", "CREATE", "default", [policy("true")], generation)
+    cache.put(key, Verdict(True, None, [], cacheable=False), generation)
+    assert cache.get(key) is None
+
+    cache.invalidate()
+    cache.put(key, Verdict(True, None, []), generation)
+    assert cache.get(key) is None
+
+
+def test_eviction(cache):
+    keys = [
+        cache.key(request({"team": str(i)}), "Pod", "CREATE", "default", [policy("object.metadata.labels.team == 'a'")], 0)
+        for i in range(cache.max_size + 1)
+    ]
+    for key in keys:
+        cache.put(key, Verdict(True, None, []), 0)
+    assert cache.get(keys[0]) is None
+    assert cache.get(keys[-1]) is not None
+    assert cache.stats()["evictions"] == 1
@@ -0,0 +1,146 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from cel_programs import DEFAULT_MESSAGE_EXPRESSION, CelCompileError
+
+_ABSENT = "\x00absent"
+# Variables whose values are part of the key; params changes invalidate instead
+_ROOTS = ("object", "oldObject", "request", "userInfo", "namespaceObject")
+
+
+def _resolve(value, path):
+    for key in path:
+        if isinstance(value, dict) and isinstance(key, str) and key in value:
+            value = value[key]
+        elif isinstance(value, list) and isinstance(key, int) and -len(value) <= key < len(value):
+            value = value[key]
+        else:
+            return _ABSENT
+    return value
+
+
+def _roots(req, namespace_object):
+    return {
+        "object": req.get("object") or req.get("oldObject"),
+        "oldObject": req.get("oldObject"),
+        "request": req,
+        "userInfo": req.get("userInfo", {}),
+        "namespaceObject": namespace_object,
+    }
+
+
+class VerdictCache:
+    """Cache of validation verdicts for admission requests that look the
+    same to the matching policies.
+
+    The key hashes the policy generation, the request's kind, operation and
+    namespace, and the values at every field path the matching policies'
+    expressions read, including the request's namespace object. Requests
+    that differ only in fields no policy reads (generated names, UIDs, ...)
+    share a verdict. Entries expire after a TTL, the least recently used are
+    evicted beyond max_size, and the whole cache is dropped whenever a
+    policy or a param object changes.
+
+    Register on_policy_change after the policy index listener: the cache
+    generation moves on only once the index reflects the change, and
+    verdicts computed under an older generation are not stored."""
+
+    def __init__(self, programs, max_size=4096, ttl=30):
+        self.programs = programs
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._verdicts = OrderedDict()
+        self._paths = {}
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def on_policy_change(self, plural, event_type, obj, old):
+        self.invalidate()
+
+    def invalidate(self):
+        with self._lock:
+            self._verdicts.clear()
+            self._paths.clear()
+            self.generation += 1
+            self.invalidations += 1
+
+    def _read_paths(self, lookup_key, matched):
+        paths = self._paths.get(lookup_key)
+        if paths is None:
+            collected = set()
+            for _, policy in matched:
+                for rule in policy.get("spec", {}).get("validations", []):
+                    for expression in (rule.get("expression"), rule.get("messageExpression", DEFAULT_MESSAGE_EXPRESSION)):
+                        try:
+                            program = self.programs.get(expression)
+                        except CelCompileError:
+                            continue
+                        collected.update(p for p in program.paths if p[0] in _ROOTS)
+            paths = sorted(collected, key=repr)
+            with self._lock:
+                if len(self._paths) >= self.max_size:
+                    self._paths.clear()
+                self._paths[lookup_key] = paths
+        return paths
+
+    def key(self, req, kind, operation, namespace, matched, generation, namespace_object=None):
+        """Call with the generation read before the policy index lookup."""
+        lookup_key = (generation, kind, operation, namespace)
+        roots = _roots(req, namespace_object)
+        material = [
+            generation, kind, operation, namespace,
+            [[list(path), _resolve(roots[path[0]], path[1:])] for path in self._read_paths(lookup_key, matched)],
+        ]
+        encoded = json.dumps(material, sort_keys=True, separators=(",", ":"), default=str)
+        return hashlib.sha256(encoded.encode()).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._verdicts.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, verdict = entry
+            if expires_at < time.monotonic():
+                del self._verdicts[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._verdicts.move_to_end(key)
+            self.hits += 1
+            return verdict
+
+    def put(self, key, verdict, generation):
+        if not verdict.cacheable:
+            return
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._verdicts[key] = (time.monotonic() + self.ttl, verdict)
+            self._verdicts.move_to_end(key)
+            while len(self._verdicts) > self.max_size:
+                self._verdicts.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._verdicts),
+                "maxSize": self.max_size,
+                "ttlSeconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRatio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }